@@ -1,17 +1,159 @@
 import sys
 import os
 import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
+from scipy.spatial import cKDTree
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                             QGroupBox, QLabel, QLineEdit, QPushButton, QCheckBox, 
                             QRadioButton, QComboBox, QAction, QMenu, QMenuBar, QStatusBar,
                             QTabWidget, QTextEdit, QSplitter, QFileDialog, QMessageBox,
-                            QFormLayout, QListWidget, QListWidgetItem, QProgressBar)
+                            QFormLayout, QListWidget, QListWidgetItem, QProgressBar, QSpinBox)
 from PyQt5.QtGui import QIcon, QFont, QDoubleValidator
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
 import fiona
+import shapely
+from shapely import STRtree
 from shapely.geometry import shape
 
+# 每次向STRtree查询的几何体数量，限制候选节点对数组的内存占用
+DISTANCE_CHUNK = 5000
+
+# 写出距离文件的缓冲区大小（字节）
+WRITE_BUFFER = 1 << 20
+
+# 进程池启动子进程的方式：进程池在界面的QThread中创建，fork多线程进程可能死锁，统一使用spawn
+MP_START_METHOD = "spawn"
+
+def edge_distance_chunk(geometries, tree, threshold, start, stop):
+    """用STRtree剪枝计算i在[start, stop)内、边到边距离不超过阈值的节点对
+    
+    以阈值外扩的外包矩形查询STRtree得到候选对，只对候选对向量化计算精确距离。
+    返回按(i, j)排序且i < j的(i, j, distance)数组。
+    """
+    offset = np.array([-threshold, -threshold, threshold, threshold])
+    # 空几何体没有外包矩形，不参与查询
+    bounds = shapely.bounds(geometries[start:stop]) + offset
+    valid = np.flatnonzero(~np.isnan(bounds).any(axis=1))
+    envelopes = shapely.box(*bounds[valid].T)
+    left, right = tree.query(envelopes)
+    left = valid[left] + start
+    
+    keep = left < right
+    left, right = left[keep], right[keep]
+    distances = shapely.distance(geometries[left], geometries[right])
+    keep = distances <= threshold
+    left, right, distances = left[keep], right[keep], distances[keep]
+    
+    order = np.lexsort((right, left))
+    return left[order], right[order], distances[order]
+
+def centroid_xy(geometries):
+    """提取质心坐标为(n, 2)数组，并返回有质心（非空几何体）的下标"""
+    centroids = shapely.centroid(np.asarray(geometries, dtype=object))
+    xy = np.column_stack([shapely.get_x(centroids), shapely.get_y(centroids)])
+    return xy, np.flatnonzero(~np.isnan(xy).any(axis=1))
+
+def centroid_distance_chunk(xy, valid, tree, threshold, start, stop):
+    """计算i在[start, stop)内、质心距离不超过阈值的节点对，tree为xy[valid]的cKDTree
+    
+    返回格式与edge_distance_chunk相同。
+    """
+    chunk = valid[(valid >= start) & (valid < stop)]
+    if len(chunk) == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+    records = cKDTree(xy[chunk]).sparse_distance_matrix(tree, threshold, output_type='ndarray')
+    left, right = chunk[records['i']], valid[records['j']]
+    keep = left < right
+    left, right = left[keep], right[keep]
+    
+    order = np.lexsort((right, left))
+    left, right = left[order], right[order]
+    return left, right, np.hypot(*(xy[left] - xy[right]).T)
+
+def iter_distance_pairs(geometries, threshold, chunk_size=DISTANCE_CHUNK):
+    """用STRtree剪枝计算边到边距离不超过阈值的节点对
+    
+    耗时与输出的节点对数量成正比。按i分块依次产出(i, j, distance)数组，块内按(i, j)排序且i < j。
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    tree = STRtree(geometries)
+    for start in range(0, len(geometries), chunk_size):
+        yield edge_distance_chunk(geometries, tree, threshold, start, start + chunk_size)
+
+def iter_centroid_pairs(geometries, threshold, chunk_size=DISTANCE_CHUNK):
+    """用cKDTree计算质心距离不超过阈值的节点对
+    
+    质心只提取一次为(n, 2)数组，query_pairs直接给出阈值内的全部节点对，百万级斑块也只需数秒。
+    产出格式与iter_distance_pairs相同。
+    """
+    xy, valid = centroid_xy(geometries)
+    pairs = cKDTree(xy[valid]).query_pairs(threshold, output_type='ndarray')
+    left, right = np.sort(valid[pairs], axis=1).T
+    order = np.lexsort((right, left))
+    left, right = left[order], right[order]
+    distances = np.hypot(*(xy[left] - xy[right]).T)
+    
+    bounds = np.searchsorted(left, np.arange(0, len(geometries) + chunk_size, chunk_size))
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if stop > start:
+            yield left[start:stop], right[start:stop], distances[start:stop]
+
+def format_pairs(id_strings, left, right, distances):
+    """把节点对格式化为distances.txt的文本行"""
+    return "".join(f"{id_strings[i]}\t{id_strings[j]}\t{distance:.2f}\n"
+                   for i, j, distance in zip(left.tolist(), right.tolist(), distances.tolist()))
+
+# 并行计算时每个工作进程持有的几何体、空间索引、节点ID和距离方式
+_worker_state = {}
+
+def _init_distance_worker(wkb, id_strings, distance_mode):
+    """工作进程初始化：从WKB数组重建几何体并建立空间索引，每个进程只做一次"""
+    geometries = shapely.from_wkb(wkb)
+    _worker_state['ids'] = id_strings
+    _worker_state['mode'] = distance_mode
+    if distance_mode == "centroid":
+        xy, valid = centroid_xy(geometries)
+        _worker_state['data'] = (xy, valid, cKDTree(xy[valid]))
+    else:
+        _worker_state['data'] = (geometries, STRtree(geometries))
+
+def _distance_chunk_task(start, stop, threshold):
+    """工作进程任务：计算一个i区间的节点对，返回(节点对数, 格式化后的文本)"""
+    if _worker_state['mode'] == "centroid":
+        left, right, distances = centroid_distance_chunk(*_worker_state['data'], threshold, start, stop)
+    else:
+        left, right, distances = edge_distance_chunk(*_worker_state['data'], threshold, start, stop)
+    return len(left), format_pairs(_worker_state['ids'], left, right, distances)
+
+def iter_parallel_pairs(wkb, id_strings, threshold, distance_mode="edge", n_workers=2, chunk_size=DISTANCE_CHUNK):
+    """把i的范围分块交给进程池计算节点对，按块的顺序依次产出(节点对数, 已处理节点数, 文本)
+    
+    几何体以WKB数组传给各工作进程，文本行也在工作进程中格式化；同时在途的块数不超过进程数的两倍，
+    因此内存占用与节点对总数无关，输出顺序与串行计算完全一致。
+    """
+    n = len(wkb)
+    # 块数至少为进程数的8倍，使各进程负载均衡
+    chunk_size = max(1, min(chunk_size, -(-n // (n_workers * 8))))
+    chunks = [(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+    
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context(MP_START_METHOD),
+                             initializer=_init_distance_worker,
+                             initargs=(wkb, id_strings, distance_mode)) as executor:
+        pending = {}
+        submitted = 0
+        try:
+            for index in range(len(chunks)):
+                while submitted < len(chunks) and submitted < index + 2 * n_workers:
+                    pending[submitted] = executor.submit(_distance_chunk_task, *chunks[submitted], threshold)
+                    submitted += 1
+                count, text = pending.pop(index).result()
+                yield count, chunks[index][1], text
+        finally:
+            for future in pending.values():
+                future.cancel()
+
 class GISProcessor:
     """GIS数据处理类，用于准备Conefor输入数据"""
     def __init__(self):
@@ -21,6 +163,7 @@ class GISProcessor:
         self.area_field = ""
         self.threshold = 1000
         self.distance_type = "Euclidean"
+        self.distance_mode = "edge"
         
     def extract_nodes(self, shapefile_path, output_path, node_field, area_field):
         """从Shapefile中提取节点信息"""
@@ -36,7 +179,9 @@ class GISProcessor:
                         f.write("id\n")
                     
                     # 遍历要素
+                    count = 0
                     for feature in src:
+                        count += 1
                         node_id = feature['properties'][node_field]
                         
                         if area_field and area_field in src.schema['properties']:
@@ -45,39 +190,90 @@ class GISProcessor:
                         else:
                             f.write(f"{node_id}\n")
             
-            return True, f"成功提取 {len(src)} 个节点"
+            return True, f"成功提取 {count} 个节点"
             
         except Exception as e:
             return False, f"提取节点时出错: {str(e)}"
     
-    def calculate_distances(self, shapefile_path, output_path, node_field, threshold):
-        """计算节点之间的距离"""
+    def calculate_distances(self, shapefile_path, output_path, node_field, threshold, distance_mode="edge",
+                            n_workers=1, progress_callback=None):
+        """计算节点之间的距离
+        
+        distance_mode为"edge"时计算斑块边到边的距离，为"centroid"时计算质心之间的距离；
+        n_workers大于1时按节点分块并行计算，结果按块顺序流式写出，输出与串行计算一致
+        """
         try:
-            # 使用Fiona打开Shapefile
-            with fiona.open(shapefile_path, 'r') as src:
-                # 获取所有要素和几何体
-                features = list(src)
-                geometries = [shape(feature['geometry']) for feature in features]
-                node_ids = [feature['properties'][node_field] for feature in features]
-                
-                # 创建输出文件
-                with open(output_path, 'w') as f:
-                    f.write("id1\tid2\tdistance\n")
-                    
-                    # 计算每对节点之间的距离
-                    count = 0
-                    for i in range(len(geometries)):
-                        for j in range(i+1, len(geometries)):
-                            distance = geometries[i].distance(geometries[j])
-                            
-                            if distance <= threshold:
-                                f.write(f"{node_ids[i]}\t{node_ids[j]}\t{distance:.2f}\n")
-                                count += 1
-            
+            node_ids, geometries, _ = self.read_patches(shapefile_path, node_field)
+            count = self.write_distances(output_path, node_ids, geometries, threshold, distance_mode,
+                                         n_workers, progress_callback)
             return True, f"成功计算 {count} 对节点之间的距离"
             
         except Exception as e:
             return False, f"计算距离时出错: {str(e)}"
+    
+    def prepare_inputs(self, shapefile_path, nodes_path, distances_path, node_field, area_field, threshold,
+                       distance_mode="edge", n_workers=1, progress_callback=None):
+        """只读取一次Shapefile，生成Conefor所需的节点文件(id, area)和距离文件
+        
+        没有指定面积字段时由几何体计算面积（单位为坐标系单位的平方）
+        """
+        try:
+            node_ids, geometries, areas = self.read_patches(shapefile_path, node_field, area_field)
+            if areas is None:
+                # 空几何体的面积记为0
+                areas = np.nan_to_num(shapely.area(np.asarray(geometries, dtype=object))).tolist()
+            
+            with open(nodes_path, 'w', buffering=WRITE_BUFFER) as f:
+                f.write("id\tarea\n")
+                f.writelines(f"{node_id}\t{area}\n" for node_id, area in zip(node_ids, areas))
+            
+            count = self.write_distances(distances_path, node_ids, geometries, threshold, distance_mode,
+                                         n_workers, progress_callback)
+            return True, f"成功提取 {len(node_ids)} 个节点，计算 {count} 对节点之间的距离"
+            
+        except Exception as e:
+            return False, f"准备Conefor输入时出错: {str(e)}"
+    
+    def read_patches(self, shapefile_path, node_field, area_field=""):
+        """读取所有斑块，返回(节点ID列表, 几何体列表, 面积列表)；面积字段不存在时面积列表为None"""
+        # 使用Fiona打开Shapefile
+        with fiona.open(shapefile_path, 'r') as src:
+            use_area = bool(area_field) and area_field in src.schema['properties']
+            node_ids = []
+            geometries = []
+            areas = [] if use_area else None
+            for feature in src:
+                node_ids.append(feature['properties'][node_field])
+                geometries.append(shape(feature['geometry']) if feature['geometry'] else None)
+                if use_area:
+                    areas.append(feature['properties'][area_field])
+        return node_ids, geometries, areas
+    
+    def write_distances(self, output_path, node_ids, geometries, threshold, distance_mode="edge",
+                        n_workers=1, progress_callback=None):
+        """计算阈值内的节点对并写出距离文件，返回节点对数"""
+        id_strings = [str(node_id) for node_id in node_ids]
+        if n_workers > 1:
+            # 几何体以WKB数组交给进程池
+            wkb = shapely.to_wkb(np.asarray(geometries, dtype=object))
+            blocks = iter_parallel_pairs(wkb, id_strings, threshold, distance_mode, n_workers)
+        else:
+            # 质心距离用cKDTree直接配对，边到边距离只计算STRtree筛选出的候选节点对
+            pairs = iter_centroid_pairs if distance_mode == "centroid" else iter_distance_pairs
+            blocks = ((len(left), left[-1] + 1 if len(left) else 0, format_pairs(id_strings, left, right, distances))
+                      for left, right, distances in pairs(geometries, threshold))
+        
+        # 创建输出文件
+        with open(output_path, 'w', buffering=WRITE_BUFFER) as f:
+            f.write("id1\tid2\tdistance\n")
+            
+            count = 0
+            for block_count, done, text in blocks:
+                f.write(text)
+                count += block_count
+                if progress_callback and done:
+                    progress_callback(int(100 * done / len(node_ids)))
+        return count
 
 class ProcessingThread(QThread):
     """处理线程，避免界面卡顿"""
@@ -98,7 +294,12 @@ class ProcessingThread(QThread):
                 success, message = self.processor.extract_nodes(**self.kwargs)
             elif self.task_type == "calculate_distances":
                 self.update_signal.emit("📏 开始计算节点距离...")
-                success, message = self.processor.calculate_distances(**self.kwargs)
+                success, message = self.processor.calculate_distances(
+                    progress_callback=self.progress_signal.emit, **self.kwargs)
+            elif self.task_type == "prepare_inputs":
+                self.update_signal.emit("📦 开始准备Conefor输入（节点和距离）...")
+                success, message = self.processor.prepare_inputs(
+                    progress_callback=self.progress_signal.emit, **self.kwargs)
             else:
                 success, message = False, "未知任务类型"
                 
@@ -107,6 +308,71 @@ class ProcessingThread(QThread):
         except Exception as e:
             self.finished_signal.emit(False, f"处理过程中出错: {str(e)}")
 
+def batch_output_names(file_paths):
+    """为每个情景文件生成输出文件名前缀，文件名重复时追加序号"""
+    names = []
+    used = set()
+    for path in file_paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name = stem
+        index = 2
+        while name in used:
+            name = f"{stem}_{index}"
+            index += 1
+        used.add(name)
+        names.append(name)
+    return names
+
+def _batch_file_task(shapefile_path, output_dir, name, node_field, area_field, threshold, distance_mode):
+    """批量处理工作进程任务：只读取一次情景文件，生成节点和距离文件，返回(是否成功, 消息)"""
+    return GISProcessor().prepare_inputs(
+        shapefile_path,
+        os.path.join(output_dir, f"{name}_nodes.txt"),
+        os.path.join(output_dir, f"{name}_distances.txt"),
+        node_field, area_field, threshold, distance_mode)
+
+class BatchProcessingThread(QThread):
+    """批量处理线程：在进程池中并发处理多个情景文件，逐个报告完成情况"""
+    update_signal = pyqtSignal(str)
+    progress_signal = pyqtSignal(int)
+    finished_signal = pyqtSignal(bool, str)
+    
+    def __init__(self, file_paths, output_dir, n_workers=1, **kwargs):
+        super().__init__()
+        self.file_paths = file_paths
+        self.output_dir = output_dir
+        self.n_workers = n_workers
+        self.kwargs = kwargs
+        
+    def run(self):
+        try:
+            total = len(self.file_paths)
+            names = batch_output_names(self.file_paths)
+            self.update_signal.emit(f"🔁 开始批量处理 {total} 个文件（{self.n_workers} 个进程）...")
+            
+            failed = 0
+            with ProcessPoolExecutor(max_workers=max(1, min(self.n_workers, total)),
+                                     mp_context=multiprocessing.get_context(MP_START_METHOD)) as executor:
+                futures = {executor.submit(_batch_file_task, path, self.output_dir, name, **self.kwargs): path
+                           for path, name in zip(self.file_paths, names)}
+                for done, future in enumerate(as_completed(futures), 1):
+                    filename = os.path.basename(futures[future])
+                    try:
+                        success, message = future.result()
+                    except Exception as e:
+                        success, message = False, str(e)
+                    if success:
+                        self.update_signal.emit(f"✅ [{done}/{total}] {filename}: {message}")
+                    else:
+                        failed += 1
+                        self.update_signal.emit(f"❌ [{done}/{total}] {filename}: {message}")
+                    self.progress_signal.emit(int(100 * done / total))
+            
+            self.finished_signal.emit(failed == 0, f"批量处理完成：成功 {total - failed} 个，失败 {failed} 个")
+            
+        except Exception as e:
+            self.finished_signal.emit(False, f"批量处理过程中出错: {str(e)}")
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -192,6 +458,10 @@ class MainWindow(QMainWindow):
         calculate_distances_action.triggered.connect(self.calculate_distances)
         tools_menu.addAction(calculate_distances_action)
         
+        prepare_inputs_action = QAction("📦 一次生成节点和距离", self)
+        prepare_inputs_action.triggered.connect(self.prepare_inputs)
+        tools_menu.addAction(prepare_inputs_action)
+        
         batch_process_action = QAction("🔁 批量处理", self)
         batch_process_action.triggered.connect(self.batch_process)
         tools_menu.addAction(batch_process_action)
@@ -260,7 +530,18 @@ class MainWindow(QMainWindow):
         validator = QDoubleValidator(0, 1000000, 2)
         self.threshold_edit.setValidator(validator)
         
+        self.distance_mode_combo = QComboBox()
+        self.distance_mode_combo.addItem("边到边 (Edge-to-edge)", "edge")
+        self.distance_mode_combo.addItem("质心 (Centroid)", "centroid")
+        
         connection_layout.addRow("距离类型:", self.distance_type_combo)
+        connection_layout.addRow("距离计算方式:", self.distance_mode_combo)
+        
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, os.cpu_count() or 1)
+        self.workers_spin.setValue(1)
+        self.workers_spin.setToolTip("大于1时按节点分块并行计算距离；批量处理时为同时处理的文件数")
+        connection_layout.addRow("并行进程数:", self.workers_spin)
         connection_layout.addRow("距离阈值:", self.threshold_edit)
         
         input_layout.addWidget(file_group)
@@ -391,6 +672,8 @@ class MainWindow(QMainWindow):
         self.area_field_combo.clear()
         self.threshold_edit.setText("1000")
         self.distance_type_combo.setCurrentIndex(0)
+        self.distance_mode_combo.setCurrentIndex(0)
+        self.workers_spin.setValue(1)
         self.file_list.clear()
         self.output_area.clear()
     
@@ -429,6 +712,7 @@ class MainWindow(QMainWindow):
         output_dir = self.output_dir_edit.text()
         node_field = self.node_field_combo.currentText()
         threshold = float(self.threshold_edit.text())
+        distance_mode = self.distance_mode_combo.currentData()
         
         output_path = os.path.join(output_dir, "distances.txt")
         
@@ -438,7 +722,9 @@ class MainWindow(QMainWindow):
             shapefile_path=input_file,
             output_path=output_path,
             node_field=node_field,
-            threshold=threshold
+            threshold=threshold,
+            distance_mode=distance_mode,
+            n_workers=self.workers_spin.value()
         )
         self.connect_thread_signals()
         self.processing_thread.start()
@@ -446,18 +732,77 @@ class MainWindow(QMainWindow):
         self.status_bar.showMessage("正在计算距离... ⏳")
         self.progress_bar.setVisible(True)
     
+    def prepare_inputs(self):
+        """只读取一次输入文件，同时生成节点和距离文件"""
+        if not self.validate_inputs():
+            return
+            
+        output_dir = self.output_dir_edit.text()
+        area_field = self.area_field_combo.currentText() if self.area_field_combo.currentText() != "(无)" else ""
+        
+        # 启动处理线程
+        self.processing_thread = ProcessingThread(
+            self.processor, "prepare_inputs",
+            shapefile_path=self.input_file_edit.text(),
+            nodes_path=os.path.join(output_dir, "nodes.txt"),
+            distances_path=os.path.join(output_dir, "distances.txt"),
+            node_field=self.node_field_combo.currentText(),
+            area_field=area_field,
+            threshold=float(self.threshold_edit.text()),
+            distance_mode=self.distance_mode_combo.currentData(),
+            n_workers=self.workers_spin.value()
+        )
+        self.connect_thread_signals()
+        self.processing_thread.start()
+        
+        self.status_bar.showMessage("正在生成节点和距离... ⏳")
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(True)
+    
     def batch_process(self):
         """批量处理"""
         if self.file_list.count() == 0:
             QMessageBox.warning(self, "警告", "请先添加要处理的文件！")
             return
             
-        if not self.output_dir_edit.text():
+        if not self.output_dir_edit.text() or not os.path.isdir(self.output_dir_edit.text()):
             QMessageBox.warning(self, "警告", "请先选择输出目录！")
             return
-            
-        # 这里可以实现批量处理逻辑
-        QMessageBox.information(self, "批量处理", "批量处理功能将在这里实现 🔁")
+        
+        file_paths = [self.file_list.item(i).text() for i in range(self.file_list.count())]
+        
+        # 没有选择输入文件时，从第一个批量文件读取字段名
+        if self.node_field_combo.count() == 0:
+            self.load_field_names(file_paths[0])
+        if self.node_field_combo.currentText() == "":
+            QMessageBox.warning(self, "警告", "请选择节点ID字段！")
+            return
+        
+        try:
+            threshold = float(self.threshold_edit.text())
+        except ValueError:
+            threshold = 0
+        if threshold <= 0:
+            QMessageBox.warning(self, "警告", "距离阈值必须是大于0的有效数字！")
+            return
+        
+        area_field = self.area_field_combo.currentText() if self.area_field_combo.currentText() != "(无)" else ""
+        
+        # 启动批量处理线程，各情景文件在进程池中并发处理
+        self.processing_thread = BatchProcessingThread(
+            file_paths, self.output_dir_edit.text(),
+            n_workers=self.workers_spin.value(),
+            node_field=self.node_field_combo.currentText(),
+            area_field=area_field,
+            threshold=threshold,
+            distance_mode=self.distance_mode_combo.currentData()
+        )
+        self.connect_thread_signals()
+        self.processing_thread.start()
+        
+        self.status_bar.showMessage("正在批量处理... ⏳")
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(True)
     
     def validate_inputs(self):
         """验证输入"""
@@ -519,6 +864,7 @@ class MainWindow(QMainWindow):
                               "功能包括:\n"
                               "• 从GIS数据中提取节点信息\n"
                               "• 计算节点之间的距离\n"
+                              "• 一次读取生成节点和距离文件（未指定面积字段时按几何计算面积）\n"
                               "• 批量处理多个文件\n\n"
                               "输出文件可以直接用于Conefor Sensinode计算 📚")
     
@@ -1,14 +1,2865 @@
 import sys
 import os
+import time
+import tempfile
+import shutil
+import glob
+import json
+import hashlib
+import warnings
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
+import pandas as pd
 import geopandas as gpd
+import shapely
 import rasterio
 from rasterio import features
+from rasterio.windows import Window
+from rasterio.vrt import WarpedVRT
+from rasterio.enums import Resampling
+from pyproj import CRS, Transformer
+from pyproj.crs import ProjectedCRS
+from pyproj.crs.coordinate_operation import LambertAzimuthalEqualAreaConversion
 from shapely.geometry import Polygon, MultiPolygon, box, shape
+
+# Unicode符号定义
+RED_LIGHT = "🔴"
+BLUE_LIGHT = "🔵"
+GREEN_LIGHT = "🟢"
+
+# 应用设置
+APP_NAME = "ProfessionalGISGridTool"
+ORG_NAME = "GeoDataLab"
+
+# 网格统计方法（另支持p10、p90等百分位数）
+GRID_STAT_METHODS = ("mean", "sum", "max", "min", "count", "std", "median")
+
+# 进程池启动子进程的方式（命令行模式下可改为fork）
+MP_START_METHOD = "spawn"
+
+# 可由细网格逐级合并得到的统计方法，以及为此在最细一级网格上计算的可分解统计量
+PYRAMID_STAT_METHODS = ("mean", "sum", "max", "min", "count", "std")
+PYRAMID_PARTIALS = ("count", "sum", "min", "max", "std")
+
+# 支持分块写出的输出格式，以及分块写出时每块的网格单元数
+CHUNK_OUTPUT_FORMATS = ("parquet", "fgb")
+GRID_CHUNK_CELLS = 200000
+
+# 预览概览长边的像素数：没有内部概览的栅格生成一次该大小的概览并缓存
+OVERVIEW_SIZE = 2048
+
+# 检查点模式下至少划分的行带数：中断时最多损失约1/CHECKPOINT_BANDS的计算量
+CHECKPOINT_BANDS = 64
+
+
+def grid_shape(minx, miny, maxx, maxy, grid_size):
+    """计算覆盖给定范围所需的网格行列数"""
+    cols = max(1, int(np.ceil((maxx - minx) / grid_size)))
+    rows = max(1, int(np.ceil((maxy - miny) / grid_size)))
+    return rows, cols
+
+
+class RegularGrid:
+    """隐式规则网格：只保存有效网格的整数编号和统计字段，多边形按需生成
+
+    网格单元(row, col)在x方向覆盖 x0 + col*grid_size ~ x0 + (col+1)*grid_size；
+    top_down为False时各行自y0向上排列（矢量网格，自下而上），
+    为True时自y0向下排列（栅格网格，自栅格左上角起算）。
+    网格编号 cell_id = row * cols + col，可直接用作整数连接键。
+    不含有效网格的实例可作为网格布局，用于推算候选网格和生成结果。
+    """
+
+    def __init__(self, x0, y0, grid_size, rows, cols, cell_ids=(), attributes=None, crs=None, top_down=False):
+        self.x0 = x0
+        self.y0 = y0
+        self.grid_size = grid_size
+        self.rows = rows
+        self.cols = cols
+        self.cell_ids = np.asarray(cell_ids, dtype=np.int64)
+        self.attributes = pd.DataFrame(attributes).reset_index(drop=True)
+        self.crs = crs
+        self.top_down = top_down
+
+    @classmethod
+    def shape_for_extent(cls, minx, miny, maxx, maxy, grid_size):
+        """计算以(minx, miny)为原点覆盖给定范围所需的网格行列数"""
+        return grid_shape(minx, miny, maxx, maxy, grid_size)
+
+    def __len__(self):
+        return len(self.cell_ids)
+
+    def __getitem__(self, column):
+        return self.attributes[column]
+
+    @property
+    def columns(self):
+        """统计字段名"""
+        return list(self.attributes.columns)
+
+    def with_cells(self, cell_ids, attributes, crs=None):
+        """以相同的网格布局生成包含给定有效网格和属性的新网格"""
+        return type(self)(self.x0, self.y0, self.grid_size, self.rows, self.cols, cell_ids, attributes,
+                          crs if crs is not None else self.crs, self.top_down)
+
+    def row_col(self):
+        """返回有效网格的(行号, 列号)"""
+        return np.divmod(self.cell_ids, self.cols)
+
+    def coarsen(self, factor):
+        """返回以factor×factor个网格为一个单元、原点相同的粗网格布局（不含有效网格）"""
+        return type(self)(self.x0, self.y0, self.grid_size * factor, -(-self.rows // factor),
+                          -(-self.cols // factor), crs=self.crs, top_down=self.top_down)
+
+    def coarse_cell_ids(self, cell_ids, factor):
+        """把本网格的网格编号换算为coarsen(factor)粗网格中所属单元的编号"""
+        row_idx, col_idx = np.divmod(np.asarray(cell_ids), self.cols)
+        return (row_idx // factor) * -(-self.cols // factor) + col_idx // factor
+
+    def cell_extent(self, row_idx, col_idx):
+        """返回给定行列号网格单元的(minx, miny, maxx, maxy)坐标数组"""
+        x1 = self.x0 + col_idx * self.grid_size
+        if self.top_down:
+            y2 = self.y0 - row_idx * self.grid_size
+            return x1, y2 - self.grid_size, x1 + self.grid_size, y2
+        y1 = self.y0 + row_idx * self.grid_size
+        return x1, y1, x1 + self.grid_size, y1 + self.grid_size
+
+    def cell_polygons(self, row_idx, col_idx):
+        """批量生成给定行列号的网格多边形"""
+        return shapely.box(*self.cell_extent(row_idx, col_idx))
+
+    def row_span(self, first_row, last_row):
+        """返回first_row至last_row（不含）各行网格覆盖的y范围(下界, 上界)"""
+        y1 = self.y0 + first_row * self.grid_size
+        y2 = self.y0 + last_row * self.grid_size
+        return (y2, y1) if self.top_down else (y1, y2)
+
+    def candidate_ranges(self, bounds):
+        """由外包矩形推算可能相交的网格行列范围(起始行, 结束行, 起始列, 结束列)，均含端点
+
+        与网格边界接触也算相交，因此起止行列各向外放宽一个容差。
+        """
+        with np.errstate(invalid="ignore"):
+            c0 = np.ceil((bounds[:, 0] - self.x0) / self.grid_size - 1 - 1e-9)
+            c1 = np.floor((bounds[:, 2] - self.x0) / self.grid_size + 1e-9)
+            r0 = np.ceil((bounds[:, 1] - self.y0) / self.grid_size - 1 - 1e-9)
+            r1 = np.floor((bounds[:, 3] - self.y0) / self.grid_size + 1e-9)
+        return r0, r1, c0, c1
+
+    def cell_bounds(self, index=slice(None)):
+        """返回有效网格的(minx, miny, maxx, maxy)坐标数组，index可选取部分网格"""
+        return self.cell_extent(*np.divmod(self.cell_ids[index], self.cols))
+
+    @property
+    def total_bounds(self):
+        """有效网格的总范围[minx, miny, maxx, maxy]"""
+        if len(self) == 0:
+            return np.full(4, np.nan)
+        x1, y1, x2, y2 = self.cell_bounds()
+        return np.array([x1.min(), y1.min(), x2.max(), y2.max()])
+
+    def polygons(self, index=slice(None)):
+        """生成有效网格的多边形，index可选取部分网格"""
+        return self.cell_polygons(*np.divmod(self.cell_ids[index], self.cols))
+
+    def to_geodataframe(self):
+        """生成带cell_id字段和网格多边形的GeoDataFrame，用于导出"""
+        attributes = self.attributes.copy()
+        attributes.insert(0, "cell_id", self.cell_ids)
+        return gpd.GeoDataFrame(attributes, geometry=self.polygons(), crs=self.crs)
+
+    def to_image(self, values, max_pixels=100_000_000):
+        """把网格值排布为二维图像（首行在上），返回(图像, [minx, maxx, miny, maxy])
+
+        像素数超过max_pixels时按k×k块对有效网格值取平均抽稀：由行列号直接算出各网格所在的块，
+        不生成完整分辨率的图像，末尾不足k的块按实际包含的网格计算。
+        """
+        k = max(1, int(np.ceil(np.sqrt(self.rows * self.cols / max_pixels))))
+        rows, cols = -(-self.rows // k), -(-self.cols // k)
+        row_idx, col_idx = self.row_col()
+        if not self.top_down:
+            row_idx = self.rows - 1 - row_idx
+        block = (row_idx // k) * cols + col_idx // k
+        values = np.asarray(values, dtype=np.float64)
+
+        if k == 1:
+            image = np.full(rows * cols, np.nan)
+            image[block] = values
+        else:
+            valid = ~np.isnan(values)
+            sums = np.bincount(block[valid], values[valid], minlength=rows * cols)
+            counts = np.bincount(block[valid], minlength=rows * cols)
+            image = np.full(rows * cols, np.nan)
+            np.divide(sums, counts, out=image, where=counts > 0)
+
+        height = self.rows * self.grid_size
+        maxy = self.y0 if self.top_down else self.y0 + height
+        return image.reshape(rows, cols), [self.x0, self.x0 + cols * k * self.grid_size,
+                                           maxy - rows * k * self.grid_size, maxy]
+
+    @staticmethod
+    def concat(grids, rows=None):
+        """按顺序合并同一网格布局下的多个网格块"""
+        first = grids[0]
+        merged = first.with_cells(
+            np.concatenate([grid.cell_ids for grid in grids]),
+            pd.concat([grid.attributes for grid in grids], ignore_index=True)
+        )
+        merged.rows = rows if rows is not None else max(grid.rows for grid in grids)
+        return merged
+
+
+class HexGrid(RegularGrid):
+    """隐式六边形网格（尖顶朝上，奇数行右移半个单元）
+
+    六边形面积与边长为grid_size的正方形相同，便于与正方形网格结果比较。
+    网格(row, col)的中心为 x = x0 + (col + 0.5*(row % 2)) * 宽度，y = y0 + row * 1.5 * 外接圆半径，
+    各行自下而上排列；网格编号同样为 cell_id = row * cols + col。
+    """
+
+    def __init__(self, x0, y0, grid_size, rows, cols, cell_ids=(), attributes=None, crs=None, top_down=False):
+        super().__init__(x0, y0, grid_size, rows, cols, cell_ids, attributes, crs, False)
+        self.radius = self.hex_radius(grid_size)
+        self.width = np.sqrt(3) * self.radius
+
+    @staticmethod
+    def hex_radius(grid_size):
+        """面积等于grid_size²的正六边形的外接圆半径"""
+        return grid_size * np.sqrt(2 / (3 * np.sqrt(3)))
+
+    @classmethod
+    def shape_for_extent(cls, minx, miny, maxx, maxy, grid_size):
+        """计算以(minx, miny)为首个网格中心覆盖给定范围所需的六边形行列数"""
+        radius = cls.hex_radius(grid_size)
+        width = np.sqrt(3) * radius
+        # 每行六边形在中心上下各半个半径的范围内完整覆盖
+        rows = max(1, int(np.ceil((maxy - miny - radius / 2) / (1.5 * radius))) + 1)
+        cols = max(1, int(np.ceil((maxx - minx) / width)) + 1)
+        return rows, cols
+
+    def cell_centers(self, row_idx, col_idx):
+        """返回给定行列号六边形的中心坐标"""
+        cx = self.x0 + (col_idx + 0.5 * (row_idx % 2)) * self.width
+        cy = self.y0 + row_idx * 1.5 * self.radius
+        return cx, cy
+
+    def cell_extent(self, row_idx, col_idx):
+        cx, cy = self.cell_centers(row_idx, col_idx)
+        return cx - self.width / 2, cy - self.radius, cx + self.width / 2, cy + self.radius
+
+    def cell_polygons(self, row_idx, col_idx):
+        cx, cy = self.cell_centers(np.asarray(row_idx), np.asarray(col_idx))
+        angles = np.radians(np.arange(30, 390, 60))
+        coords = np.empty((len(cx), 7, 2))
+        coords[:, :6, 0] = cx[:, None] + self.radius * np.cos(angles)
+        coords[:, :6, 1] = cy[:, None] + self.radius * np.sin(angles)
+        coords[:, 6] = coords[:, 0]
+        return shapely.polygons(coords)
+
+    def row_span(self, first_row, last_row):
+        y1 = self.y0 + first_row * 1.5 * self.radius - self.radius
+        y2 = self.y0 + (last_row - 1) * 1.5 * self.radius + self.radius
+        return y1, y2
+
+    def candidate_ranges(self, bounds):
+        # 行按六边形上下顶点、列按奇偶行外包矩形的并集推算
+        with np.errstate(invalid="ignore"):
+            c0 = np.ceil((bounds[:, 0] - self.x0) / self.width - 1 - 1e-9)
+            c1 = np.floor((bounds[:, 2] - self.x0) / self.width + 0.5 + 1e-9)
+            r0 = np.ceil((bounds[:, 1] - self.radius - self.y0) / (1.5 * self.radius) - 1e-9)
+            r1 = np.floor((bounds[:, 3] + self.radius - self.y0) / (1.5 * self.radius) + 1e-9)
+        return r0, r1, c0, c1
+
+    def locate(self, x, y):
+        """批量计算点所在六边形的(行号, 列号)，点可位于网格范围之外"""
+        px = (x - self.x0) / self.radius
+        py = (y - self.y0) / self.radius
+        # 换算为立方坐标后取整
+        q = np.sqrt(3) / 3 * px - py / 3
+        r = 2 / 3 * py
+        s = -q - r
+        rq, rr, rs = np.round(q), np.round(r), np.round(s)
+        dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+        fix_q = (dq > dr) & (dq > ds)
+        fix_r = ~fix_q & (dr > ds)
+        rq = np.where(fix_q, -rr - rs, rq)
+        rr = np.where(fix_r, -rq - rs, rr)
+        row_idx = rr.astype(np.int64)
+        col_idx = rq.astype(np.int64) + (row_idx - (row_idx & 1)) // 2
+        return row_idx, col_idx
+
+    def coarsen(self, factor):
+        """相邻六边形无法拼合为更大的六边形"""
+        raise ValueError("六边形网格不支持逐级合并，金字塔模式仅支持正方形网格")
+
+    def to_image(self, values, max_pixels=100_000_000):
+        """六边形网格无法排布为规则图像，返回None"""
+        return None
+
+
+# 网格形状与对应的隐式网格类型
+GRID_TYPES = {"square": RegularGrid, "hexagon": HexGrid}
+
+
+def grid_feature_pairs(geometries, layout, row_range=None, max_candidates=2_000_000):
+    """不生成完整网格，求出全部(要素, 网格)相交对
+
+    由各要素的外包矩形推算其可能相交的网格行列范围，只为这些候选网格生成多边形并批量判断相交，
+    候选对按max_candidates分批处理以控制内存。layout为网格布局（RegularGrid或HexGrid），
+    row_range可把网格行限制在(起始行, 结束行)之间。
+    """
+    geometries = np.asarray(geometries)
+    first_row, last_row = row_range if row_range is not None else (0, layout.rows)
+    r0, r1, c0, c1 = layout.candidate_ranges(shapely.bounds(geometries))
+    c0 = np.maximum(c0, 0)
+    c1 = np.minimum(c1, layout.cols - 1)
+    r0 = np.maximum(r0, first_row)
+    r1 = np.minimum(r1, last_row - 1)
+    n_cols = np.nan_to_num(c1 - c0 + 1).clip(0).astype(np.int64)
+    n_rows = np.nan_to_num(r1 - r0 + 1).clip(0).astype(np.int64)
+    counts = n_cols * n_rows
+    c0 = np.nan_to_num(c0).astype(np.int64)
+    r0 = np.nan_to_num(r0).astype(np.int64)
+
+    shapely.prepare(geometries)
+    ends = np.cumsum(counts)
+    feature_parts, cell_parts = [], []
+    start = 0
+    while start < len(geometries):
+        # 每批至少包含一个要素
+        stop = max(start + 1, int(np.searchsorted(ends, ends[start] - counts[start] + max_candidates, side="right")))
+        batch = np.arange(start, stop)
+        batch_counts = counts[batch]
+        feature_idx = np.repeat(batch, batch_counts)
+        # 每个候选网格在所属要素候选范围内的序号
+        offsets = np.arange(len(feature_idx)) - np.repeat(np.cumsum(batch_counts) - batch_counts, batch_counts)
+        dr, dc = np.divmod(offsets, n_cols[feature_idx])
+        row_idx = r0[feature_idx] + dr
+        col_idx = c0[feature_idx] + dc
+
+        hit = shapely.intersects(geometries[feature_idx], layout.cell_polygons(row_idx, col_idx))
+        feature_parts.append(feature_idx[hit])
+        cell_parts.append(row_idx[hit] * layout.cols + col_idx[hit])
+        start = stop
+
+    if not feature_parts:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate(feature_parts), np.concatenate(cell_parts)
+
+
+def grid_vector_features(gdf, minx, miny, rows, cols, grid_size, stat_method="mean",
+                         keep_original_attributes=True, row_range=None, grid_type="square"):
+    """基于隐式网格的矢量网格划分
+
+    不生成完整网格，按要素外包矩形推算候选网格后一次性批量判断相交，
+    各字段的统计值由一次groupby完成。grid_type为"square"或"hexagon"，
+    返回只含有效网格的RegularGrid或HexGrid。
+    """
+    layout = GRID_TYPES[grid_type](minx, miny, grid_size, rows, cols, crs=gdf.crs)
+    feature_idx, cell_idx = grid_feature_pairs(gdf.geometry.values, layout, row_range)
+    return aggregate_feature_pairs(gdf, layout, feature_idx, cell_idx, stat_method, keep_original_attributes)
+
+
+def aggregate_feature_pairs(gdf, layout, feature_idx, cell_idx, stat_method="mean", keep_original_attributes=True):
+    """由(要素, 网格)相交对按网格汇总要素属性，返回layout布局下只含有效网格的网格"""
+    # 按(网格, 要素)排序以保持原始要素顺序
+    order = np.lexsort((feature_idx, cell_idx))
+    feature_idx = feature_idx[order]
+    cell_idx = cell_idx[order]
+
+    # 每个有效网格中的第一个相交要素（与原始要素顺序一致）
+    valid_cells, first_pos = np.unique(cell_idx, return_index=True)
+    first_features = gdf.iloc[feature_idx[first_pos]]
+
+    attributes = pd.DataFrame(index=pd.RangeIndex(len(valid_cells)))
+    for col in gdf.columns:
+        if col == gdf.geometry.name:
+            continue
+        if keep_original_attributes:
+            # 保留原始属性：使用第一个相交要素的值
+            attributes[col] = first_features[col].to_numpy()
+        elif col != 'id':
+            if gdf[col].dtype in [np.int64, np.float64]:
+                # 数值字段：按网格分组一次性计算统计值
+                values = pd.Series(gdf[col].to_numpy()[feature_idx])
+                grouped = values.groupby(cell_idx, sort=True).agg(stat_method)
+                attributes[col] = grouped.to_numpy()
+            else:
+                # 非数值字段：使用第一个相交要素的值
+                attributes[col] = first_features[col].to_numpy()
+
+    return layout.with_cells(valid_cells, attributes)
+
+
+def weighted_group_stat(group, values, weights, n_groups, stat_method, feature_totals=None):
+    """按组计算加权统计值（group为组号，权重为相交面积/长度）
+
+    mean/std/median按权重加权；sum按相交比例分摊原始值；
+    count为相交比例之和；max/min取相交部分的极值。
+    """
+    ok = ~np.isnan(values) & (weights > 0)
+    g, x, w = group[ok], values[ok], weights[ok]
+    wsum = np.bincount(g, w, n_groups)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if stat_method in ("mean", "std"):
+            mean = np.bincount(g, w * x, n_groups) / wsum
+            if stat_method == "mean":
+                return mean
+            return np.sqrt(np.bincount(g, w * (x - mean[g]) ** 2, n_groups) / wsum)
+        if stat_method in ("sum", "count"):
+            share = w / feature_totals[ok]
+            if stat_method == "sum":
+                return np.bincount(g, share * x, n_groups)
+            return np.bincount(g, share, n_groups)
+
+    result = np.full(n_groups, np.nan)
+    if stat_method == "max":
+        np.fmax.at(result, g, x)
+    elif stat_method == "min":
+        np.fmin.at(result, g, x)
+    elif stat_method == "median":
+        # 组内按值排序后取累计权重首次过半的值
+        order = np.lexsort((x, g))
+        g, x, w = g[order], x[order], w[order]
+        cum = np.cumsum(w)
+        group_start = np.concatenate([[0], cum[:-1]])[np.searchsorted(g, g, side="left")]
+        half = (cum - group_start) >= wsum[g] / 2
+        first = np.unique(g[half], return_index=True)
+        result[first[0]] = x[half][first[1]]
+    else:
+        raise ValueError(f"未知的统计方法: {stat_method}")
+    return result
+
+
+def grid_vector_weighted(gdf, minx, miny, rows, cols, grid_size, stat_method="mean",
+                         keep_original_attributes=True, row_range=None, grid_type="square"):
+    """按相交面积/长度加权的矢量网格划分
+
+    要素与网格的相交对由隐式网格求出，只为相交的网格生成矩形并一次性批量裁剪，
+    面要素以相交面积、线要素以相交长度、点要素以1作为权重。
+    保留原始属性及非数值字段取网格内权重最大的要素的值。返回只含有效网格的RegularGrid或HexGrid。
+    """
+    layout = GRID_TYPES[grid_type](minx, miny, grid_size, rows, cols, crs=gdf.crs)
+    feature_idx, cell_idx = grid_feature_pairs(gdf.geometry.values, layout, row_range)
+    feature_idx, cell_idx, weights, feature_totals = pair_weights(gdf.geometry.values, layout, feature_idx, cell_idx)
+    return aggregate_weighted_pairs(gdf, layout, feature_idx, cell_idx, weights, feature_totals,
+                                    stat_method, keep_original_attributes)
+
+
+def pair_weights(geometries, layout, feature_idx, cell_idx):
+    """批量裁剪要素并计算各相交对的权重
+
+    返回去掉权重为0（仅与网格边界接触）的相交对后的(要素序号, 网格编号, 权重, 各要素总面积/长度)。
+    """
+    geometries = np.asarray(geometries)
+    cells = layout.cell_polygons(*np.divmod(cell_idx, layout.cols))
+    pieces = shapely.intersection(geometries[feature_idx], cells)
+    dimensions = shapely.get_dimensions(geometries)
+    piece_dims = dimensions[feature_idx]
+    weights = np.where(piece_dims == 2, shapely.area(pieces),
+                       np.where(piece_dims == 1, shapely.length(pieces), 1.0))
+    feature_totals = np.where(dimensions == 2, shapely.area(geometries),
+                              np.where(dimensions == 1, shapely.length(geometries), 1.0))
+
+    # 仅与网格边界接触的要素权重为0，不计入该网格
+    keep = weights > 0
+    return feature_idx[keep], cell_idx[keep], weights[keep], feature_totals
+
+
+def aggregate_weighted_pairs(gdf, layout, feature_idx, cell_idx, weights, feature_totals,
+                             stat_method="mean", keep_original_attributes=True):
+    """由带权重的(要素, 网格)相交对按网格加权汇总要素属性，返回layout布局下只含有效网格的网格"""
+    valid_cells, group = np.unique(cell_idx, return_inverse=True)
+    n_groups = len(valid_cells)
+
+    # 每个网格中权重最大的要素（权重相同时取原始顺序靠前者）
+    order = np.lexsort((feature_idx, -weights, group))
+    first_pos = order[np.unique(group[order], return_index=True)[1]]
+    dominant_features = gdf.iloc[feature_idx[first_pos]]
+
+    attributes = pd.DataFrame(index=pd.RangeIndex(n_groups))
+    for col in gdf.columns:
+        if col == gdf.geometry.name:
+            continue
+        if keep_original_attributes:
+            attributes[col] = dominant_features[col].to_numpy()
+        elif col != 'id':
+            if gdf[col].dtype in [np.int64, np.float64]:
+                values = gdf[col].to_numpy(dtype=np.float64)[feature_idx]
+                attributes[col] = weighted_group_stat(
+                    group, values, weights, n_groups, stat_method,
+                    feature_totals[feature_idx]
+                )
+            else:
+                attributes[col] = dominant_features[col].to_numpy()
+
+    return layout.with_cells(valid_cells, attributes)
+
+
+def coarsen_pairs(layout, factor, feature_idx, cell_idx, weights=None):
+    """把layout上的(要素, 网格)相交对换算为coarsen(factor)粗网格上的相交对
+
+    粗网格由factor×factor个网格拼成，要素与粗网格相交当且仅当与其中某个网格相交，
+    相交面积/长度为各网格中相交部分之和。返回(要素序号, 粗网格编号, 权重或None)。
+    """
+    coarse_idx = layout.coarse_cell_ids(cell_idx, factor)
+    n_coarse = -(-layout.rows // factor) * -(-layout.cols // factor)
+    keys, inverse = np.unique(feature_idx * n_coarse + coarse_idx, return_inverse=True)
+    coarse_weights = None if weights is None else np.bincount(inverse, weights, len(keys))
+    feature_idx, coarse_idx = np.divmod(keys, n_coarse)
+    return feature_idx, coarse_idx, coarse_weights
+
+
+def grid_vector_pyramid(gdf, minx, miny, rows, cols, grid_size, factors, stat_method="mean",
+                        keep_original_attributes=True, weighted=False):
+    """多级分辨率矢量网格划分：只在最细一级求交（加权模式下裁剪），各级由相交对换算得到
+
+    rows、cols为grid_size对应的最细一级网格行列数，factors为各级网格相对grid_size的整数倍数。
+    各级结果与直接按该级网格大小划分一致，返回按factors顺序排列的RegularGrid列表。
+    """
+    geometries = gdf.geometry.values
+    layout = RegularGrid(minx, miny, grid_size, rows, cols, crs=gdf.crs)
+    feature_idx, cell_idx = grid_feature_pairs(geometries, layout)
+    weights = feature_totals = None
+    if weighted:
+        feature_idx, cell_idx, weights, feature_totals = pair_weights(geometries, layout, feature_idx, cell_idx)
+    is_point = shapely.get_dimensions(np.asarray(geometries)) == 0
+
+    grids = []
+    for factor in factors:
+        level = layout.coarsen(factor)
+        level_features, level_cells, level_weights = coarsen_pairs(layout, factor, feature_idx, cell_idx, weights)
+        if weighted:
+            # 点要素在每个相交网格中的权重恒为1，位于网格边界上时不累加
+            level_weights[is_point[level_features]] = 1.0
+            grids.append(aggregate_weighted_pairs(gdf, level, level_features, level_cells, level_weights,
+                                                  feature_totals, stat_method, keep_original_attributes))
+        else:
+            grids.append(aggregate_feature_pairs(gdf, level, level_features, level_cells,
+                                                 stat_method, keep_original_attributes))
+    return grids
+
+
+def raster_cell_edges(n_pixels, pixel_size, grid_size, n_cells):
+    """计算每个网格单元在某一方向上覆盖的像素起止索引"""
+    edges = np.floor(np.arange(n_cells + 1) * grid_size / pixel_size + 1e-9).astype(np.int64)
+    return np.clip(edges, 0, n_pixels)
+
+
+def block_view(raster_data, row_edges, col_edges):
+    """将二维栅格整理为(网格行, 块高, 网格列, 块宽)的四维数组，不足部分以NaN填充
+
+    网格大小为像素大小整数倍时直接填充后reshape；否则按起止索引一次性批量取值。
+    """
+    rows, cols = len(row_edges) - 1, len(col_edges) - 1
+    row_sizes = np.diff(row_edges)
+    col_sizes = np.diff(col_edges)
+    ky, kx = int(row_sizes.max()), int(col_sizes.max())
+
+    regular = (np.array_equal(row_edges[:-1], np.arange(rows) * ky) and
+               np.array_equal(col_edges[:-1], np.arange(cols) * kx))
+    if regular:
+        padded = np.full((rows * ky, cols * kx), np.nan, dtype=raster_data.dtype)
+        padded[:raster_data.shape[0], :raster_data.shape[1]] = raster_data[:rows * ky, :cols * kx]
+        return padded.reshape(rows, ky, cols, kx)
+
+    # 末尾追加一行一列NaN，越界的索引都指向它
+    padded = np.pad(raster_data, ((0, 1), (0, 1)), constant_values=np.nan)
+    row_idx = row_edges[:-1, None] + np.arange(ky)[None, :]
+    row_idx[row_idx >= row_edges[1:, None]] = raster_data.shape[0]
+    col_idx = col_edges[:-1, None] + np.arange(kx)[None, :]
+    col_idx[col_idx >= col_edges[1:, None]] = raster_data.shape[1]
+    return padded[row_idx[:, :, None, None], col_idx[None, None, :, :]]
+
+
+def parse_stat_methods(text):
+    """解析逗号分隔的统计方法列表，百分位数写作p10、p90等"""
+    stat_methods = []
+    for item in text.replace("，", ",").split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        if item in GRID_STAT_METHODS:
+            pass
+        elif item.startswith("p") and item[1:].replace(".", "", 1).isdigit() and 0 <= float(item[1:]) <= 100:
+            pass
+        else:
+            raise ValueError(f"未知的统计方法: {item}")
+        if item not in stat_methods:
+            stat_methods.append(item)
+    return stat_methods
+
+
+def reduce_blocks(blocks, stat_methods):
+    """对四维块数组按网格单元一次性计算多种忽略NaN的统计值
+
+    返回({统计方法: 统计值}, 有效像素数)，百分位数在一次nanpercentile调用中完成。
+    """
+    rows, ky, cols, kx = blocks.shape
+    flat = blocks.transpose(0, 2, 1, 3).reshape(rows, cols, ky * kx)
+    count = np.count_nonzero(~np.isnan(flat), axis=-1)
+
+    results = {}
+    percentiles = [stat for stat in stat_methods if stat.startswith("p")]
+
+    # 全为NaN的单元会触发"空切片"警告，这些单元随后会被丢弃
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for stat_method in stat_methods:
+            if stat_method == "mean":
+                results[stat_method] = np.nanmean(flat, axis=-1)
+            elif stat_method == "sum":
+                results[stat_method] = np.nansum(flat, axis=-1)
+            elif stat_method == "max":
+                results[stat_method] = np.nanmax(flat, axis=-1)
+            elif stat_method == "min":
+                results[stat_method] = np.nanmin(flat, axis=-1)
+            elif stat_method == "count":
+                results[stat_method] = count
+            elif stat_method == "std":
+                results[stat_method] = np.nanstd(flat, axis=-1)
+            elif stat_method == "median":
+                results[stat_method] = np.nanmedian(flat, axis=-1)
+            elif stat_method not in percentiles:
+                raise ValueError(f"未知的统计方法: {stat_method}")
+
+        if percentiles:
+            values = np.nanpercentile(flat, [float(stat[1:]) for stat in percentiles], axis=-1)
+            for stat_method, value in zip(percentiles, values):
+                results[stat_method] = value
+
+    return {stat_method: results[stat_method] for stat_method in stat_methods}, count
+
+
+def stat_column_names(bands, stat_methods):
+    """输出字段名：单波段单统计量时沿用value，否则为b<波段>_<统计方法>"""
+    if len(bands) == 1 and len(stat_methods) == 1:
+        return {(bands[0], stat_methods[0]): "value"}
+    return {(band, stat): f"b{band}_{stat}" for band in bands for stat in stat_methods}
+
+
+def raster_grid_layout(transform, width, height, grid_size):
+    """计算栅格对应网格的行列数以及每行、每列网格覆盖的像素起止索引"""
+    pixel_width = transform[0]
+    pixel_height = abs(transform[4])
+    rows, cols = grid_shape(0, 0, width * pixel_width, height * pixel_height, grid_size)
+    row_edges = raster_cell_edges(height, pixel_height, grid_size, rows)
+    col_edges = raster_cell_edges(width, pixel_width, grid_size, cols)
+    return rows, cols, row_edges, col_edges
+
+
+def raster_grid_plan(transform, width, height, grid_size, grid_type="square"):
+    """返回栅格对应的网格布局
+
+    正方形网格自栅格左上角起算、自上而下排列；六边形网格以栅格左下角为首个网格中心。
+    """
+    if grid_type == "hexagon":
+        left, top = transform[2], transform[5]
+        right = left + width * transform[0]
+        bottom = top + height * transform[4]
+        rows, cols = HexGrid.shape_for_extent(left, bottom, right, top, grid_size)
+        return HexGrid(left, bottom, grid_size, rows, cols)
+    rows, cols, _, _ = raster_grid_layout(transform, width, height, grid_size)
+    return RegularGrid(transform[2], transform[5], grid_size, rows, cols, top_down=True)
+
+
+def reduce_labels(labels, values, n_labels, stat_methods):
+    """按标签（网格内序号）对像素值一次性计算多种忽略NaN的统计值
+
+    用于无法整理为规则块的网格（如六边形）：均值、总和、标准差由bincount完成，
+    极值由ufunc.at完成，中位数和百分位数在按(标签, 值)排序后按位置线性插值。
+    返回({统计方法: 统计值}, 有效像素数)。
+    """
+    ok = ~np.isnan(values)
+    labels, values = labels[ok], values[ok]
+    count = np.bincount(labels, minlength=n_labels)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        total = np.bincount(labels, values, n_labels)
+        mean = total / count
+
+    results = {}
+    sorted_values = None
+    for stat_method in stat_methods:
+        if stat_method == "mean":
+            results[stat_method] = mean
+        elif stat_method == "sum":
+            results[stat_method] = total
+        elif stat_method == "count":
+            results[stat_method] = count
+        elif stat_method == "std":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                results[stat_method] = np.sqrt(np.bincount(labels, (values - mean[labels]) ** 2, n_labels) / count)
+        elif stat_method in ("max", "min"):
+            result = np.full(n_labels, np.nan)
+            (np.fmax if stat_method == "max" else np.fmin).at(result, labels, values)
+            results[stat_method] = result
+        elif stat_method == "median" or stat_method.startswith("p"):
+            if sorted_values is None:
+                sorted_values = values[np.lexsort((values, labels))]
+                starts = np.cumsum(count) - count
+            q = 50.0 if stat_method == "median" else float(stat_method[1:])
+            position = starts + np.maximum(count - 1, 0) * q / 100
+            lower = np.minimum(np.floor(position).astype(np.int64), len(sorted_values) - 1)
+            upper = np.minimum(np.ceil(position).astype(np.int64), len(sorted_values) - 1)
+            if len(sorted_values):
+                result = sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+            else:
+                result = np.zeros(n_labels)
+            results[stat_method] = np.where(count > 0, result, np.nan)
+        else:
+            raise ValueError(f"未知的统计方法: {stat_method}")
+    return results, count
+
+
+def reduce_hex_block(raster_data, transform, pixel_row0, layout, row_range, bands, stat_methods, nodata=None):
+    """对一块(波段, 行, 列)栅格数据按六边形网格做标签归约
+
+    每个像素按中心点归入唯一的六边形，只统计行号位于row_range内的网格。
+    pixel_row0为该块首行在整幅栅格中的像素行号。返回(有效网格编号, {输出字段名: 统计值})。
+    """
+    first_row, last_row = row_range
+    n_rows, width = raster_data.shape[1:]
+    x = transform[2] + (np.arange(width) + 0.5) * transform[0]
+    y = transform[5] + (pixel_row0 + np.arange(n_rows) + 0.5) * transform[4]
+    row_idx, col_idx = layout.locate(x[np.newaxis, :], y[:, np.newaxis])
+    inside = (row_idx >= first_row) & (row_idx < last_row) & (col_idx >= 0) & (col_idx < layout.cols)
+
+    offset = first_row * layout.cols
+    labels = row_idx[inside] * layout.cols + col_idx[inside] - offset
+    n_labels = (last_row - first_row) * layout.cols
+    del row_idx, col_idx
+
+    column_names = stat_column_names(bands, stat_methods)
+    columns = {}
+    valid = np.zeros(n_labels, dtype=bool)
+    for band, band_data in zip(bands, raster_data):
+        values = band_data[inside].astype(np.float64)
+        if nodata is not None and not np.isnan(nodata):
+            values[values == nodata] = np.nan
+        results, count = reduce_labels(labels, values, n_labels, stat_methods)
+        for stat_method, stat_values in results.items():
+            columns[column_names[(band, stat_method)]] = stat_values
+        valid |= count > 0
+
+    cell_idx = np.flatnonzero(valid)
+    return cell_idx + offset, {name: values[cell_idx] for name, values in columns.items()}
+
+
+def reduce_raster_block(raster_data, row_edges, col_edges, bands, stat_methods, nodata=None):
+    """对一块(波段, 行, 列)栅格数据做块归约
+
+    返回({输出字段名: 网格统计值}, 有效网格掩膜)，任一波段含有效像素的网格即为有效网格。
+    """
+    column_names = stat_column_names(bands, stat_methods)
+    columns = {}
+    valid = None
+    for band, band_data in zip(bands, raster_data):
+        data = band_data.astype(np.float64)
+        if nodata is not None and not np.isnan(nodata):
+            data[data == nodata] = np.nan
+        results, count = reduce_blocks(block_view(data, row_edges, col_edges), stat_methods)
+        for stat_method, values in results.items():
+            columns[column_names[(band, stat_method)]] = values
+        valid = count > 0 if valid is None else valid | (count > 0)
+    return columns, valid
+
+
+def grid_raster_array(raster_data, transform, grid_size, stat_methods=("mean",), nodata=None, bands=(1,),
+                      grid_type="square"):
+    """块归约方式的栅格网格划分
+
+    raster_data为二维（单波段）或按bands排列的三维数组。正方形网格自栅格左上角起算，
+    所有波段、所有统计量由一次NumPy块归约得到；六边形网格按像素所属网格做标签归约。
+    返回只含有效网格的RegularGrid或HexGrid。
+    """
+    if raster_data.ndim == 2:
+        raster_data = raster_data[np.newaxis]
+    height, width = raster_data.shape[1:]
+    layout = raster_grid_plan(transform, width, height, grid_size, grid_type)
+    if isinstance(layout, HexGrid):
+        cell_ids, columns = reduce_hex_block(raster_data, transform, 0, layout, (0, layout.rows),
+                                             list(bands), list(stat_methods), nodata)
+        return layout.with_cells(cell_ids, columns)
+
+    _, _, row_edges, col_edges = raster_grid_layout(transform, width, height, grid_size)
+    columns, valid = reduce_raster_block(raster_data, row_edges, col_edges, list(bands), list(stat_methods), nodata)
+
+    # 仅保留含有效像素的网格
+    row_idx, col_idx = np.nonzero(valid)
+    return layout.with_cells(row_idx * layout.cols + col_idx,
+                             {name: values[row_idx, col_idx] for name, values in columns.items()})
+
+
+def strip_grid_rows(row_edges, width, block_height, memory_limit_mb, n_bands=1):
+    """根据内存上限把网格行划分为若干条带，返回每个条带的(起始网格行, 结束网格行)
+
+    每条带读取的像素行数尽量取栅格内部分块高度的整数倍，
+    块归约过程中的临时数组按原始窗口的约4倍估算。
+    """
+    rows = len(row_edges) - 1
+    ky = max(1, int(np.diff(row_edges).max()))
+    bytes_per_grid_row = ky * width * n_bands * np.dtype(np.float64).itemsize * 4
+    rows_per_strip = max(1, int(memory_limit_mb * 1024 * 1024 // bytes_per_grid_row))
+
+    # 对齐到分块：条带像素高度为分块高度整数倍时，每个分块只需解码一次
+    if block_height and rows_per_strip * ky >= block_height:
+        step = block_height // np.gcd(ky, block_height)
+        if rows_per_strip >= step:
+            rows_per_strip -= rows_per_strip % step
+
+    return [(r0, min(r0 + rows_per_strip, rows)) for r0 in range(0, rows, rows_per_strip)]
+
+
+def hex_strip_rows(layout, transform, height, width, row_range, memory_limit_mb, n_bands=1):
+    """根据内存上限把六边形网格行划分为条带
+
+    返回每个条带的((起始网格行, 结束网格行), (起始像素行, 结束像素行))。
+    相邻行的六边形在y方向相互交错，因此相邻条带读取的像素行会有少量重叠，
+    但每个像素只计入其所属的网格行。像素值之外的坐标、行列号等临时数组按约4倍估算。
+    """
+    first_row, last_row = row_range
+    pixel_height = abs(transform[4])
+    bytes_per_pixel_row = width * (n_bands + 4) * np.dtype(np.float64).itemsize
+    budget_rows = memory_limit_mb * 1024 * 1024 / bytes_per_pixel_row
+    row_pixels = 1.5 * layout.radius / pixel_height
+    rows_per_strip = max(1, int((budget_rows - 2 * layout.radius / pixel_height) // row_pixels))
+
+    strips = []
+    for h0 in range(first_row, last_row, rows_per_strip):
+        h1 = min(h0 + rows_per_strip, last_row)
+        y1, y2 = layout.row_span(h0, h1)
+        p0 = int(np.clip(np.floor((transform[5] - y2) / pixel_height), 0, height))
+        p1 = int(np.clip(np.ceil((transform[5] - y1) / pixel_height), 0, height))
+        strips.append(((h0, h1), (p0, p1)))
+    return strips
+
+
+def iter_raster_rows(src, layout, row_range, bands, stat_methods, memory_limit_mb=1024, progress_callback=None):
+    """按条带逐窗口归约已打开栅格中row_range范围内的网格行，每个条带产出一次结果
+
+    layout为raster_grid_plan得到的网格布局。逐个产出(网格编号, {输出字段名: 统计值})，
+    仅包含有效网格，调用方可在下一个条带读取之前把当前结果写盘并释放。
+    """
+    if isinstance(layout, HexGrid):
+        strips = hex_strip_rows(layout, src.transform, src.height, src.width, row_range,
+                                memory_limit_mb, len(bands))
+        for n, (hex_rows, (pixel_r0, pixel_r1)) in enumerate(strips):
+            if pixel_r1 > pixel_r0:
+                window = Window(0, pixel_r0, src.width, pixel_r1 - pixel_r0)
+                strip_data = src.read(bands, window=window)
+                yield reduce_hex_block(strip_data, src.transform, pixel_r0, layout, hex_rows,
+                                       bands, stat_methods, src.nodata)
+                del strip_data
+            if progress_callback:
+                progress_callback(int((n + 1) / len(strips) * 100))
+        return
+
+    _, _, row_edges, col_edges = raster_grid_layout(src.transform, src.width, src.height, layout.grid_size)
+    first_row, last_row = row_range
+    block_height = src.block_shapes[bands[0] - 1][0]
+    strips = strip_grid_rows(row_edges[first_row:last_row + 1], src.width, block_height,
+                             memory_limit_mb, len(bands))
+
+    for n, (r0, r1) in enumerate(strips):
+        r0, r1 = r0 + first_row, r1 + first_row
+        pixel_r0, pixel_r1 = int(row_edges[r0]), int(row_edges[r1])
+        if pixel_r1 > pixel_r0:
+            window = Window(0, pixel_r0, src.width, pixel_r1 - pixel_r0)
+            strip_data = src.read(bands, window=window)
+            columns, valid = reduce_raster_block(
+                strip_data, row_edges[r0:r1 + 1] - pixel_r0, col_edges,
+                bands, stat_methods, src.nodata
+            )
+            del strip_data
+
+            row_idx, col_idx = np.nonzero(valid)
+            yield ((row_idx + r0) * layout.cols + col_idx,
+                   {name: values[row_idx, col_idx] for name, values in columns.items()})
+
+        if progress_callback:
+            progress_callback(int((n + 1) / len(strips) * 100))
+
+
+def reduce_raster_rows(src, layout, row_range, bands, stat_methods, memory_limit_mb=1024, progress_callback=None):
+    """按条带逐窗口归约已打开栅格中row_range范围内的网格行
+
+    返回(网格编号, {输出字段名: 统计值})，仅包含有效网格。
+    """
+    id_parts = []
+    column_parts = {name: [] for name in stat_column_names(bands, stat_methods).values()}
+    for cell_ids, columns in iter_raster_rows(src, layout, row_range, bands, stat_methods,
+                                              memory_limit_mb, progress_callback):
+        id_parts.append(cell_ids)
+        for name, values in columns.items():
+            column_parts[name].append(values)
+
+    cell_ids = np.concatenate(id_parts) if id_parts else np.array([], dtype=np.int64)
+    columns = {name: np.concatenate(parts) if parts else np.array([]) for name, parts in column_parts.items()}
+    return cell_ids, columns
+
+
+def grid_raster_windows(raster_path, grid_size, stat_methods=("mean",), bands=(1,),
+                        memory_limit_mb=1024, progress_callback=None, grid_type="square"):
+    """流式栅格网格划分
+
+    按网格行条带逐窗口读取栅格（所有选中波段一次读出），完成归约后立即丢弃窗口数据，
+    内存占用由memory_limit_mb控制，与栅格总大小无关。返回只含有效网格的RegularGrid或HexGrid。
+    """
+    bands = list(bands)
+    stat_methods = list(stat_methods)
+    with rasterio.open(raster_path) as src:
+        layout = raster_grid_plan(src.transform, src.width, src.height, grid_size, grid_type)
+        cell_ids, columns = reduce_raster_rows(
+            src, layout, (0, layout.rows), bands, stat_methods, memory_limit_mb, progress_callback
+        )
+    return layout.with_cells(cell_ids, columns)
+
+
+def split_row_bands(rows, n_bands):
+    """把网格行均匀划分为若干行带，返回每个行带的(起始网格行, 结束网格行)"""
+    edges = np.linspace(0, rows, min(rows, n_bands) + 1).round().astype(int)
+    return [(int(r0), int(r1)) for r0, r1 in zip(edges[:-1], edges[1:]) if r1 > r0]
+
+
+def iter_completed_band_tasks(task, band_args, n_workers):
+    """在进程池中并行执行各行带任务，按完成顺序逐个产出(行带序号, 结果)
+
+    默认使用spawn方式启动子进程，避免在GUI的工作线程中fork带来的死锁风险。
+    调用方中途停止迭代（如任务被取消）时，尚未开始的任务随之取消，只等待正在执行的任务结束。
+    """
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context(MP_START_METHOD)) as executor:
+        futures = {executor.submit(task, *args): n for n, args in enumerate(band_args)}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+
+
+def iter_band_tasks(task, band_args, n_workers, progress_callback=None):
+    """在进程池中并行执行各行带任务，按行带顺序逐个产出结果，进度按已完成行带数汇总
+
+    先完成的靠后行带暂存，等前面的行带完成后依次产出，保证输出顺序与单进程一致。
+    """
+    pending = {}
+    next_band = 0
+    results = iter_completed_band_tasks(task, band_args, n_workers)
+    try:
+        for done, (n, result) in enumerate(results, 1):
+            pending[n] = result
+            if progress_callback:
+                progress_callback(int(done / len(band_args) * 100))
+            while next_band in pending:
+                yield pending.pop(next_band)
+                next_band += 1
+    finally:
+        results.close()
+
+
+def run_band_tasks(task, band_args, n_workers, progress_callback=None):
+    """在进程池中并行执行各行带任务，按行带顺序返回全部结果"""
+    return list(iter_band_tasks(task, band_args, n_workers, progress_callback))
+
+
+def _vector_band_task(gdf, minx, miny, row_range, cols, grid_size, stat_method, keep_original_attributes,
+                      weighted=False, grid_type="square"):
+    """进程池任务：对一个行带内的要素做矢量网格划分，网格编号为全局编号"""
+    grid_function = grid_vector_weighted if weighted else grid_vector_features
+    return grid_function(gdf, minx, miny, row_range[1], cols, grid_size,
+                         stat_method, keep_original_attributes, row_range, grid_type)
+
+
+def vector_band_args(gdf, minx, miny, rows, cols, grid_size, n_bands, stat_method="mean",
+                     keep_original_attributes=True, weighted=False, grid_type="square"):
+    """把网格行划分为n_bands个行带，返回每个行带的_vector_band_task参数，只包含与该行带相交的要素"""
+    layout = GRID_TYPES[grid_type](minx, miny, grid_size, rows, cols)
+    bounds = gdf.geometry.bounds
+    feature_miny = bounds['miny'].to_numpy()
+    feature_maxy = bounds['maxy'].to_numpy()
+
+    band_args = []
+    for r0, r1 in split_row_bands(rows, n_bands):
+        y0, y1 = layout.row_span(r0, r1)
+        mask = (feature_maxy >= y0) & (feature_miny <= y1)
+        if mask.any():
+            band_args.append((gdf[mask], minx, miny, (r0, r1), cols, grid_size,
+                              stat_method, keep_original_attributes, weighted, grid_type))
+    return band_args
+
+
+def grid_vector_parallel(gdf, minx, miny, rows, cols, grid_size, stat_method="mean",
+                         keep_original_attributes=True, n_workers=2, progress_callback=None,
+                         weighted=False, grid_type="square"):
+    """多进程矢量网格划分
+
+    网格范围按行划分为若干行带，每个行带只分发与其相交的要素，
+    各进程结果按行带顺序合并，与单进程结果一致。
+    """
+    band_args = vector_band_args(gdf, minx, miny, rows, cols, grid_size, n_workers * 4,
+                                 stat_method, keep_original_attributes, weighted, grid_type)
+    results = run_band_tasks(_vector_band_task, band_args, n_workers, progress_callback)
+    if not results:
+        return _vector_band_task(gdf.iloc[:0], minx, miny, (0, rows), cols, grid_size,
+                                 stat_method, keep_original_attributes, weighted, grid_type)
+    return RegularGrid.concat(results, rows)
+
+
+def _raster_band_task(raster_path, grid_size, stat_methods, bands, memory_limit_mb, row_range, grid_type="square"):
+    """进程池任务：在子进程中打开栅格，流式归约一个行带"""
+    with rasterio.open(raster_path) as src:
+        layout = raster_grid_plan(src.transform, src.width, src.height, grid_size, grid_type)
+        return reduce_raster_rows(src, layout, row_range, bands, stat_methods, memory_limit_mb)
+
+
+def raster_band_args(raster_path, layout, grid_size, stat_methods, bands, memory_limit_mb, n_workers, grid_type,
+                     n_bands=None):
+    """按行带划分栅格网格（默认n_workers*4个行带），返回每个行带的_raster_band_task参数，内存上限在进程间平分"""
+    worker_memory_mb = max(1, memory_limit_mb // n_workers)
+    return [(raster_path, grid_size, stat_methods, bands, worker_memory_mb, row_range, grid_type)
+            for row_range in split_row_bands(layout.rows, n_bands or n_workers * 4)]
+
+
+def grid_raster_parallel(raster_path, grid_size, stat_methods=("mean",), bands=(1,),
+                         memory_limit_mb=1024, n_workers=2, progress_callback=None, grid_type="square"):
+    """多进程栅格网格划分
+
+    各进程分别打开栅格并流式读取各自行带的窗口，内存上限在进程间平分，
+    结果按行带顺序合并。返回只含有效网格的RegularGrid或HexGrid。
+    """
+    bands = list(bands)
+    stat_methods = list(stat_methods)
+    with rasterio.open(raster_path) as src:
+        layout = raster_grid_plan(src.transform, src.width, src.height, grid_size, grid_type)
+
+    band_args = raster_band_args(raster_path, layout, grid_size, stat_methods, bands,
+                                 memory_limit_mb, n_workers, grid_type)
+    results = run_band_tasks(_raster_band_task, band_args, n_workers, progress_callback)
+
+    cell_ids = np.concatenate([result[0] for result in results])
+    columns = {name: np.concatenate([result[1][name] for result in results])
+               for name in stat_column_names(bands, stat_methods).values()}
+    return layout.with_cells(cell_ids, columns)
+
+
+def iter_vector_chunks(gdf, minx, miny, rows, cols, grid_size, stat_method="mean",
+                       keep_original_attributes=True, weighted=False, n_workers=1,
+                       chunk_cells=GRID_CHUNK_CELLS, progress_callback=None, grid_type="square"):
+    """按行带分块进行矢量网格划分，逐块产出RegularGrid或HexGrid
+
+    每块约chunk_cells个网格单元；n_workers大于1时各行带在进程池中并行处理，
+    仍按行带顺序产出，拼接后与一次性划分的结果一致。
+    """
+    n_bands = max(-(-rows * cols // chunk_cells), n_workers * 4 if n_workers > 1 else 1)
+    band_args = vector_band_args(gdf, minx, miny, rows, cols, grid_size, n_bands,
+                                 stat_method, keep_original_attributes, weighted, grid_type)
+    if n_workers > 1:
+        results = iter_band_tasks(_vector_band_task, band_args, n_workers, progress_callback)
+    else:
+        results = (_vector_band_task(*args) for args in band_args)
+
+    for n, grid in enumerate(results, 1):
+        yield grid
+        if n_workers <= 1 and progress_callback:
+            progress_callback(int(n / len(band_args) * 100))
+
+
+def iter_raster_chunks(raster_path, grid_size, stat_methods=("mean",), bands=(1,),
+                       memory_limit_mb=1024, n_workers=1, progress_callback=None, grid_type="square"):
+    """按窗口条带分块进行栅格网格划分，逐块产出RegularGrid或HexGrid
+
+    单进程时每个读取条带产出一块；n_workers大于1时每个行带产出一块，按行带顺序产出。
+    """
+    bands = list(bands)
+    stat_methods = list(stat_methods)
+    with rasterio.open(raster_path) as src:
+        layout = raster_grid_plan(src.transform, src.width, src.height, grid_size, grid_type)
+        if n_workers <= 1:
+            for cell_ids, columns in iter_raster_rows(src, layout, (0, layout.rows), bands, stat_methods,
+                                                      memory_limit_mb, progress_callback):
+                yield layout.with_cells(cell_ids, columns)
+            return
+
+    band_args = raster_band_args(raster_path, layout, grid_size, stat_methods, bands,
+                                 memory_limit_mb, n_workers, grid_type)
+    for cell_ids, columns in iter_band_tasks(_raster_band_task, band_args, n_workers, progress_callback):
+        yield layout.with_cells(cell_ids, columns)
+
+
+def parse_pyramid_factors(text):
+    """解析逗号分隔的金字塔倍数（各级网格大小相对基础网格大小的整数倍），返回升序列表
+
+    输入为空时返回空列表（不使用金字塔模式），基础网格（倍数1）总是包含在内。
+    """
+    factors = set()
+    for item in text.replace("，", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if not item.isdigit() or int(item) < 1:
+            raise ValueError(f"金字塔倍数须为正整数: {item}")
+        factors.add(int(item))
+    return sorted(factors | {1}) if factors else []
+
+
+def combine_partials(group, n_groups, partials):
+    """按group把若干部分的可分解统计量合并为n_groups组
+
+    partials为{统计量: 数组}（PYRAMID_PARTIALS）。总和、计数直接相加，极值取极值，
+    标准差按各部分的离差平方和与组间离差合并，结果与直接对全部像素统计一致。
+    """
+    count = partials["count"].astype(np.float64)
+    total = partials["sum"].astype(np.float64)
+    combined = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nan_to_num(total / count)
+        squares = np.nan_to_num(partials["std"].astype(np.float64) ** 2 * count)
+        combined["count"] = np.bincount(group, count, n_groups)
+        combined["sum"] = np.bincount(group, total, n_groups)
+        group_mean = np.nan_to_num(combined["sum"] / combined["count"])
+        group_squares = np.bincount(group, squares + count * (mean - group_mean[group]) ** 2, n_groups)
+        combined["std"] = np.sqrt(group_squares / combined["count"])
+    for stat_method, ufunc in (("min", np.fmin), ("max", np.fmax)):
+        result = np.full(n_groups, np.nan)
+        ufunc.at(result, group, partials[stat_method].astype(np.float64))
+        combined[stat_method] = result
+    return combined
+
+
+def coarsen_partials(grid, factor, bands):
+    """把含可分解统计量的网格按factor×factor个单元合并为粗网格
+
+    grid的字段为各波段的PYRAMID_PARTIALS（b<波段>_count等），合并方式见combine_partials。
+    """
+    level = grid.coarsen(factor)
+    coarse_ids, group = np.unique(grid.coarse_cell_ids(grid.cell_ids, factor), return_inverse=True)
+    names = stat_column_names(bands, PYRAMID_PARTIALS)
+
+    columns = {}
+    for band in bands:
+        combined = combine_partials(group, len(coarse_ids), {
+            stat_method: grid[names[(band, stat_method)]].to_numpy() for stat_method in PYRAMID_PARTIALS
+        })
+        for stat_method in PYRAMID_PARTIALS:
+            columns[names[(band, stat_method)]] = combined[stat_method]
+
+    return level.with_cells(coarse_ids, {name: columns[name] for name in names.values()}, grid.crs)
+
+
+def finalize_columns(partials, bands, stat_methods):
+    """由各波段的可分解统计量{(波段, 统计量): 数组}计算所需的统计值，返回{输出字段名: 统计值}"""
+    output_names = stat_column_names(bands, stat_methods)
+    columns = {}
+    for band in bands:
+        count = np.asarray(partials[(band, "count")], dtype=np.float64)
+        for stat_method in stat_methods:
+            if stat_method == "mean":
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    values = np.asarray(partials[(band, "sum")], dtype=np.float64) / count
+            elif stat_method in PYRAMID_PARTIALS:
+                values = np.asarray(partials[(band, stat_method)])
+            else:
+                raise ValueError(f"不支持由可分解统计量计算统计方法: {stat_method}")
+            if stat_method == "count":
+                values = values.astype(np.int64)
+            columns[output_names[(band, stat_method)]] = values
+    return columns
+
+
+def finalize_partials(grid, bands, stat_methods):
+    """由网格中的可分解统计量计算所需的统计值，字段名与普通模式相同"""
+    names = stat_column_names(bands, PYRAMID_PARTIALS)
+    partials = {key: grid[name].to_numpy() for key, name in names.items()}
+    return grid.with_cells(grid.cell_ids, finalize_columns(partials, bands, stat_methods))
+
+
+def check_decomposable_stats(stat_methods, mode="金字塔模式"):
+    """检查统计方法能否由各部分的统计量合并得到（中位数、百分位数不能），mode用于错误提示"""
+    unsupported = [stat for stat in stat_methods if stat not in PYRAMID_STAT_METHODS]
+    if unsupported:
+        raise ValueError(f"{mode}仅支持可分解的统计方法（{', '.join(PYRAMID_STAT_METHODS)}），"
+                         f"不支持: {', '.join(unsupported)}")
+
+
+def grid_pyramid(base, factors, bands, stat_methods):
+    """由最细一级的可分解统计量网格逐级合并出各级网格，返回按factors顺序排列的网格列表"""
+    check_decomposable_stats(stat_methods)
+    return [finalize_partials(base if factor == 1 else coarsen_partials(base, factor, bands), bands, stat_methods)
+            for factor in factors]
+
+
+def pyramid_level_path(path, grid_size):
+    """金字塔各级网格的输出文件名：在文件名后附加网格大小"""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}_{grid_size:g}{ext}"
+
+
+def zone_layers(geometries):
+    """把分区划分为若干层，同一层内的分区内部互不重叠，返回每个分区的层号
+
+    只共享边界的相邻分区（如流域）位于同一层；内部重叠的分区（如相互嵌套的保护区）
+    按贪心着色放入不同的层，分层栅格化后每个像素可计入所有覆盖它的分区。
+    """
+    layers = np.zeros(len(geometries), dtype=np.int64)
+    left, right = shapely.STRtree(geometries).query(geometries, predicate="intersects")
+    keep = left < right
+    left, right = left[keep], right[keep]
+    overlap = shapely.relate_pattern(geometries[left], geometries[right], "T********")
+    left, right = left[overlap], right[overlap]
+    if not len(left):
+        return layers
+
+    # 邻接表：每个分区只需避开编号更小的重叠分区已占用的层号
+    order = np.argsort(right, kind="stable")
+    left, right = left[order], right[order]
+    starts = np.searchsorted(right, np.arange(len(geometries) + 1))
+    for zone in np.unique(right):
+        used = set(layers[left[starts[zone]:starts[zone + 1]]].tolist())
+        layer = 0
+        while layer in used:
+            layer += 1
+        layers[zone] = layer
+    return layers
+
+
+def zone_pixel_rows(transform, height, bounds, block_height=0):
+    """分区范围覆盖的像素行区间(起始行, 结束行)，起始行向下对齐到栅格分块高度"""
+    pixel_height = abs(transform[4])
+    r0 = int(np.clip(np.floor((transform[5] - bounds[:, 3].max()) / pixel_height), 0, height))
+    r1 = int(np.clip(np.ceil((transform[5] - bounds[:, 1].min()) / pixel_height), 0, height))
+    if block_height:
+        r0 -= r0 % block_height
+    return r0, max(r0, r1)
+
+
+def reduce_zone_rows(src, geometries, zone_ids, layers, bands, pixel_range, memory_limit_mb=1024,
+                     progress_callback=None):
+    """按像素行条带逐窗口计算已打开栅格在各分区内的可分解统计量
+
+    geometries为与栅格同一坐标系的分区多边形，zone_ids为其全局编号，layers为zone_layers得到的层号。
+    每个条带只读取与其相交的分区所覆盖的列范围，各层分区栅格化为与窗口对齐的标签数组
+    （0为背景，像素中心落入分区时计入），再由reduce_labels一次完成各分区的计数、总和、
+    标准差和极值；各条带的结果最后由combine_partials合并。
+    返回(有像素的分区编号, {(波段, 统计量): 统计值})，统计量为PYRAMID_PARTIALS。
+    """
+    transform = src.transform
+    pixel_width, pixel_height = transform[0], abs(transform[4])
+    bounds = shapely.bounds(geometries)
+    first_row, last_row = pixel_range
+    block_height = src.block_shapes[bands[0] - 1][0]
+    strips = strip_grid_rows(np.arange(last_row - first_row + 1), src.width, block_height,
+                             memory_limit_mb, len(bands) + 1)
+
+    group_parts = []
+    partial_parts = {(band, stat): [] for band in bands for stat in PYRAMID_PARTIALS}
+    for n, (r0, r1) in enumerate(strips):
+        r0, r1 = r0 + first_row, r1 + first_row
+        top = transform[5] - r0 * pixel_height
+        bottom = transform[5] - r1 * pixel_height
+        selected = np.flatnonzero((bounds[:, 3] > bottom) & (bounds[:, 1] < top))
+        if len(selected):
+            c0 = int(np.clip(np.floor((bounds[selected, 0].min() - transform[2]) / pixel_width), 0, src.width))
+            c1 = int(np.clip(np.ceil((bounds[selected, 2].max() - transform[2]) / pixel_width), 0, src.width))
+        if len(selected) and c1 > c0:
+            window = Window(c0, r0, c1 - c0, r1 - r0)
+            window_transform = src.window_transform(window)
+            strip_data = src.read(bands, window=window).astype(np.float64)
+            if src.nodata is not None and not np.isnan(src.nodata):
+                strip_data[strip_data == src.nodata] = np.nan
+
+            for layer in np.unique(layers[selected]):
+                in_layer = selected[layers[selected] == layer]
+                labels = features.rasterize(
+                    zip(geometries[in_layer], range(1, len(in_layer) + 1)),
+                    out_shape=(r1 - r0, c1 - c0), transform=window_transform, fill=0, dtype="int32"
+                ).ravel()
+                inside = labels > 0
+                labels = labels[inside] - 1
+                group_parts.append(zone_ids[in_layer])
+                for band, band_data in zip(bands, strip_data):
+                    results, _ = reduce_labels(labels, band_data.ravel()[inside], len(in_layer), PYRAMID_PARTIALS)
+                    for stat_method in PYRAMID_PARTIALS:
+                        partial_parts[(band, stat_method)].append(results[stat_method])
+                del labels, inside
+            del strip_data
+
+        if progress_callback:
+            progress_callback(int((n + 1) / len(strips) * 100))
+
+    return merge_zone_partials(group_parts, partial_parts, bands)
+
+
+def merge_zone_partials(group_parts, partial_parts, bands):
+    """合并按分区编号分段的可分解统计量，只保留含有效像素的分区"""
+    if not group_parts:
+        return np.array([], dtype=np.int64), {key: np.array([]) for key in partial_parts}
+    zone_ids, group = np.unique(np.concatenate(group_parts), return_inverse=True)
+    merged = {}
+    for band in bands:
+        combined = combine_partials(group, len(zone_ids), {
+            stat_method: np.concatenate(partial_parts[(band, stat_method)]) for stat_method in PYRAMID_PARTIALS
+        })
+        for stat_method in PYRAMID_PARTIALS:
+            merged[(band, stat_method)] = combined[stat_method]
+
+    valid = np.zeros(len(zone_ids), dtype=bool)
+    for band in bands:
+        valid |= merged[(band, "count")] > 0
+    return zone_ids[valid], {key: values[valid] for key, values in merged.items()}
+
+
+def _zonal_band_task(raster_path, geometries, zone_ids, layers, bands, memory_limit_mb, pixel_range):
+    """进程池任务：在子进程中打开栅格，计算一个像素行带内各分区的可分解统计量"""
+    with rasterio.open(raster_path) as src:
+        return reduce_zone_rows(src, geometries, zone_ids, layers, bands, pixel_range, memory_limit_mb)
+
+
+def zonal_statistics(raster_path, zones, stat_methods=("mean",), bands=(1,), memory_limit_mb=1024,
+                     n_workers=1, progress_callback=None):
+    """分区统计：按任意多边形分区（流域、保护区等）统计栅格值
+
+    分区先批量重投影到栅格坐标系并划分为内部互不重叠的层，再按像素行条带逐窗口
+    栅格化为标签数组并做标签归约，内存占用由memory_limit_mb控制，与栅格大小无关。
+    跨越多个条带的分区由各条带的可分解统计量合并，因此只支持PYRAMID_STAT_METHODS中的统计方法。
+    n_workers大于1时按像素行带在进程池中并行。
+    返回保留原始属性和几何的分区GeoDataFrame，附加各统计字段；没有覆盖任何像素中心的分区统计值为NaN。
+    """
+    bands = list(bands)
+    stat_methods = list(stat_methods)
+    check_decomposable_stats(stat_methods, "分区统计")
+
+    with rasterio.open(raster_path) as src:
+        transform, height = src.transform, src.height
+        block_height = src.block_shapes[bands[0] - 1][0]
+        raster_crs = src.crs
+    geometries = zones.geometry
+    if raster_crs is not None and zones.crs is not None and not CRS.from_user_input(zones.crs).equals(raster_crs):
+        geometries = geometries.to_crs(raster_crs)
+    geometries = np.asarray(geometries.values)
+    usable = np.flatnonzero(~(shapely.is_missing(geometries) | shapely.is_empty(geometries)))
+    geometries = geometries[usable]
+    layers = zone_layers(geometries)
+
+    zone_ids = np.array([], dtype=np.int64)
+    partials = {(band, stat): np.array([]) for band in bands for stat in PYRAMID_PARTIALS}
+    if len(geometries):
+        pixel_range = zone_pixel_rows(transform, height, shapely.bounds(geometries), block_height)
+        if n_workers > 1:
+            # 按像素行带划分，每个行带只分发与其相交的分区，各行带结果按分区编号合并
+            bounds = shapely.bounds(geometries)
+            worker_memory_mb = max(1, memory_limit_mb // n_workers)
+            band_args = []
+            for r0, r1 in split_row_bands(pixel_range[1] - pixel_range[0], n_workers * 4):
+                r0, r1 = r0 + pixel_range[0], r1 + pixel_range[0]
+                top = transform[5] - r0 * abs(transform[4])
+                bottom = transform[5] - r1 * abs(transform[4])
+                mask = (bounds[:, 3] > bottom) & (bounds[:, 1] < top)
+                if mask.any():
+                    band_args.append((raster_path, geometries[mask], usable[mask], layers[mask],
+                                      bands, worker_memory_mb, (r0, r1)))
+            results = run_band_tasks(_zonal_band_task, band_args, n_workers, progress_callback)
+            zone_ids, partials = merge_zone_partials(
+                [ids for ids, _ in results],
+                {key: [part[key] for _, part in results] for key in partials}, bands
+            )
+        else:
+            with rasterio.open(raster_path) as src:
+                zone_ids, partials = reduce_zone_rows(src, geometries, usable, layers, bands, pixel_range,
+                                                      memory_limit_mb, progress_callback)
+
+    # 没有像素的分区：计数为0，其余统计值为NaN
+    full = {}
+    for key, values in partials.items():
+        column = np.zeros(len(zones)) if key[1] == "count" else np.full(len(zones), np.nan)
+        column[zone_ids] = values
+        full[key] = column
+    result = zones.copy()
+    for name, values in finalize_columns(full, bands, stat_methods).items():
+        result[name] = values
+    return result
+
+
+def local_equal_area_crs(crs, bounds):
+    """以数据范围中心为投影中心、以米为单位的兰伯特方位等面积投影"""
+    minx, miny, maxx, maxy = bounds
+    if not CRS.from_user_input(crs).is_geographic:
+        transformer = Transformer.from_crs(crs, "EPSG:4326", always_xy=True)
+        minx, miny, maxx, maxy = transformer.transform_bounds(minx, miny, maxx, maxy)
+    lon = (minx + maxx) / 2
+    lat = (miny + maxy) / 2
+    return ProjectedCRS(
+        name=f"WGS 84 / LAEA {lat:.4f} {lon:.4f}",
+        conversion=LambertAzimuthalEqualAreaConversion(latitude_natural_origin=round(lat, 4),
+                                                        longitude_natural_origin=round(lon, 4)))
+
+
+def grid_target_crs(data_crs, bounds, degree_units=False, crs_mode="auto", custom_crs=None):
+    """确定网格划分所用的坐标系，返回None表示按数据原坐标系划分
+
+    以度为单位时在地理坐标系中按度划分（投影数据转为WGS84）；以米为单位时：
+    auto对地理坐标系数据使用局部等面积投影，投影坐标系数据保持不变；
+    equal_area总是使用局部等面积投影；custom使用自定义的投影坐标系；native不重投影。
+    """
+    if data_crs is None:
+        # 无坐标系信息时只能按原坐标划分
+        return None
+    data_crs = CRS.from_user_input(data_crs)
+    if degree_units:
+        return None if data_crs.is_geographic else CRS.from_epsg(4326)
+
+    if crs_mode == "native":
+        if data_crs.is_geographic:
+            raise ValueError("数据为地理坐标系，网格大小以米为单位时需选择投影坐标系")
+        return None
+    if crs_mode == "custom":
+        if not custom_crs:
+            raise ValueError("请输入自定义网格坐标系（如 EPSG:3035）")
+        target = CRS.from_user_input(custom_crs)
+        if target.is_geographic:
+            raise ValueError("自定义网格坐标系须为以米为单位的投影坐标系")
+    elif crs_mode == "equal_area" or data_crs.is_geographic:
+        target = local_equal_area_crs(data_crs, bounds)
+    else:
+        return None
+    return None if target == data_crs else target
+
+
+class ReprojectionCache:
+    """按(文件, 坐标系)缓存重投影结果
+
+    矢量数据一次性批量重投影后保存在内存中；栅格数据按块重投影写入缓存目录下的GeoTIFF，
+    之后按窗口流式读取。同一文件、同一坐标系以不同网格大小重复划分时直接使用缓存。
+    文件修改时间变化后缓存自动失效。未指定cache_dir时写入临时目录，用完后调用cleanup()
+    或以with语句使用，删除该临时目录。
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.temp_dir = None
+        self.vectors = {}
+        self.rasters = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
+
+    def cleanup(self):
+        """清空缓存并删除自动创建的临时目录（用户指定的cache_dir保留）"""
+        self.vectors.clear()
+        self.rasters.clear()
+        if self.temp_dir is not None:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            if self.cache_dir == self.temp_dir:
+                self.cache_dir = None
+            self.temp_dir = None
+
+    def key(self, path, crs):
+        """缓存键：(文件绝对路径, 修改时间, 目标坐标系WKT)"""
+        path = os.path.abspath(path)
+        return path, os.path.getmtime(path), CRS.from_user_input(crs).to_wkt()
+
+    def vector_key(self, path, gdf, crs):
+        """矢量缓存键：另附要素数和范围，区分同一文件按不同范围读取的要素子集"""
+        return self.key(path, crs) + (len(gdf), tuple(gdf.total_bounds))
+
+    def contains(self, path, crs, gdf=None):
+        """该文件（矢量数据为其中的要素gdf）重投影到crs的结果是否已缓存"""
+        if path is None:
+            return False
+        if gdf is not None:
+            return self.vector_key(path, gdf, crs) in self.vectors
+        return self.key(path, crs) in self.rasters
+
+    def vector(self, path, gdf, crs):
+        """返回重投影到crs的矢量数据，path为None时不缓存
+
+        只缓存重投影后的几何，属性字段取自gdf，同一文件每次读取不同字段时也可复用。
+        """
+        if path is None:
+            return gdf.to_crs(crs)
+        key = self.vector_key(path, gdf, crs)
+        if key not in self.vectors:
+            self.vectors[key] = gdf.geometry.to_crs(crs).values
+        return gdf.set_geometry(self.vectors[key], crs=crs)
+
+    def raster(self, path, crs, progress_callback=None):
+        """返回重投影到crs的栅格缓存文件路径
+
+        按输出文件的内部分块逐块重投影（最近邻重采样，保持原始像元值），
+        源栅格无nodata时以浮点NaN标记投影后范围外的像元。
+        """
+        key = self.key(path, crs)
+        cached = self.rasters.get(key)
+        if cached and os.path.exists(cached):
+            return cached
+
+        if self.cache_dir is None:
+            self.cache_dir = self.temp_dir = tempfile.mkdtemp(prefix="grid_reproject_")
+        name = os.path.splitext(os.path.basename(path))[0]
+        output_path = os.path.join(self.cache_dir, f"{name}_{len(self.rasters)}.tif")
+
+        with rasterio.open(path) as src:
+            vrt_options = {"crs": key[2], "resampling": Resampling.nearest}
+            if src.nodata is None:
+                dtype = "float32" if np.can_cast(src.dtypes[0], np.float32) else "float64"
+                vrt_options.update(nodata=np.nan, dtype=dtype)
+            with WarpedVRT(src, **vrt_options) as vrt:
+                profile = vrt.profile
+                profile.update(driver="GTiff", tiled=True, blockxsize=512, blockysize=512,
+                               compress="deflate", BIGTIFF="IF_SAFER")
+                with rasterio.open(output_path, "w", **profile) as dst:
+                    windows = [window for _, window in dst.block_windows(1)]
+                    for n, window in enumerate(windows, 1):
+                        dst.write(vrt.read(window=window), window=window)
+                        if progress_callback:
+                            progress_callback(int(n / len(windows) * 100))
+
+        self.rasters[key] = output_path
+        return output_path
+
+
+def file_fingerprint(path):
+    """输入文件指纹：文件及同名附属文件（如Shapefile的.dbf、.shx）的[(文件名, 大小, 修改时间)]"""
+    path = os.path.abspath(path)
+    stem = os.path.splitext(path)[0]
+    files = sorted(set(glob.glob(glob.escape(stem) + ".*")) | {path})
+    return [(name, os.path.getsize(name), os.stat(name).st_mtime_ns) for name in files]
+
+
+class ResultCache:
+    """网格划分结果的磁盘缓存，按(输入文件指纹, 划分参数)的哈希存取
+
+    每个结果存为一个Parquet文件，只保存网格编号和统计字段，
+    网格布局（类型、原点、大小、行列数、坐标系）写在文件元数据中，多边形读取后按需生成；
+    金字塔各级网格依次存放在同一文件中。缓存总大小超过max_mb时按最近使用时间淘汰，
+    命中时更新文件修改时间。需要pyarrow库。
+    """
+
+    VERSION = 1
+
+    def __init__(self, cache_dir=None, max_mb=1024):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".gis_grid_cache")
+        self.max_mb = max_mb
+
+    @property
+    def enabled(self):
+        """缓存上限大于0且已安装pyarrow时启用"""
+        import importlib.util
+        return self.max_mb > 0 and importlib.util.find_spec("pyarrow") is not None
+
+    def key(self, input_path, params):
+        """缓存键：输入文件指纹与划分参数的SHA-256"""
+        payload = json.dumps([self.VERSION, file_fingerprint(input_path), params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def get(self, key):
+        """读取缓存的网格（金字塔模式为网格列表），未命中时返回None
+
+        文件损坏（截断、非本工具写入或缺少网格元数据）时删除该缓存项，按未命中处理。
+        """
+        import pyarrow.parquet as pq
+
+        path = self.path(key)
+        try:
+            table = pq.read_table(path)
+            meta = json.loads(table.schema.metadata[b"grid"])
+            frame = table.to_pandas()
+            grids = []
+            start = 0
+            for layout in meta["levels"]:
+                part = frame.iloc[start:start + layout["count"]]
+                start += layout["count"]
+                grid = GRID_TYPES[layout["type"]](
+                    layout["x0"], layout["y0"], layout["grid_size"], layout["rows"], layout["cols"],
+                    part["cell_id"].to_numpy(), part.drop(columns="cell_id"),
+                    CRS.from_wkt(layout["crs"]) if layout["crs"] else None, layout["top_down"]
+                )
+                grids.append(grid)
+            result = grids if meta["pyramid"] else grids[0]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            # pyarrow.ArrowInvalid和JSON解析错误均为ValueError
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        os.utime(path)
+        return result
+
+    def put(self, key, result):
+        """写入结果（网格或金字塔网格列表）并按大小上限淘汰最久未使用的缓存"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        grids = result if isinstance(result, list) else [result]
+        levels = [{
+            "type": "hexagon" if isinstance(grid, HexGrid) else "square",
+            "x0": float(grid.x0), "y0": float(grid.y0), "grid_size": float(grid.grid_size),
+            "rows": int(grid.rows), "cols": int(grid.cols), "top_down": bool(grid.top_down),
+            "crs": CRS.from_user_input(grid.crs).to_wkt() if grid.crs is not None else None,
+            "count": len(grid),
+        } for grid in grids]
+        frame = pd.concat([grid.attributes.assign(cell_id=grid.cell_ids) for grid in grids], ignore_index=True)
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b"grid": json.dumps({"pyramid": isinstance(result, list), "levels": levels}).encode("utf-8"),
+        })
+
+        # 先写临时文件再替换，多个进程同时写入同一缓存目录时不会读到不完整的文件
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(table, temp_path)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        """缓存总大小超过上限时，按修改时间从旧到新删除缓存文件"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".parquet"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_mb * 1024 * 1024:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class OverviewCache:
+    """栅格预览概览的磁盘缓存
+
+    文件自带概览（金字塔）或本身不大时，按画布大小降采样读取，GDAL自动使用最接近的概览层；
+    否则按行条带以平均值重采样生成一次长边为OVERVIEW_SIZE像素的概览GeoTIFF，
+    按(文件指纹, 波段)缓存在cache_dir中，之后的预览只读取该小文件，耗时与栅格大小无关。
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".gis_grid_cache", "overviews")
+
+    def path(self, raster_path, band):
+        payload = json.dumps([file_fingerprint(raster_path), band, OVERVIEW_SIZE], default=str)
+        return os.path.join(self.cache_dir, f"{hashlib.sha256(payload.encode('utf-8')).hexdigest()}.tif")
+
+    def source(self, raster_path, band=1):
+        """返回(预览读取的文件, 波段)：自带概览或不大的栅格读原文件，否则读缓存的概览（需要时生成）"""
+        with rasterio.open(raster_path) as src:
+            if src.overviews(band) or max(src.width, src.height) <= OVERVIEW_SIZE:
+                return raster_path, band
+        path = self.path(raster_path, band)
+        if not os.path.exists(path):
+            self.build(raster_path, band, path)
+        return path, 1
+
+    def needs_build(self, raster_path, band=1):
+        """预览该栅格前是否需要先生成概览"""
+        with rasterio.open(raster_path) as src:
+            if src.overviews(band) or max(src.width, src.height) <= OVERVIEW_SIZE:
+                return False
+        return not os.path.exists(self.path(raster_path, band))
+
+    def build(self, raster_path, band, path):
+        """按行条带读取原栅格并平均值重采样为概览，忽略NoData，内存占用与栅格大小无关"""
+        with rasterio.open(raster_path) as src:
+            k = int(np.ceil(max(src.width, src.height) / OVERVIEW_SIZE))
+            width, height = -(-src.width // k), -(-src.height // k)
+            profile = {"driver": "GTiff", "width": width, "height": height, "count": 1, "dtype": "float32",
+                       "crs": src.crs, "transform": src.transform * rasterio.Affine.scale(k), "nodata": np.nan,
+                       "tiled": True, "blockxsize": 256, "blockysize": 256, "compress": "deflate"}
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with rasterio.open(temp_path, "w", **profile) as dst:
+                for r0 in range(0, height, 256):
+                    rows = min(256, height - r0)
+                    window = Window(0, r0 * k, src.width, min(rows * k, src.height - r0 * k))
+                    data = src.read(band, window=window, out_shape=(rows, width),
+                                    resampling=Resampling.average, masked=True)
+                    dst.write(data.astype(np.float32).filled(np.nan), 1, window=Window(0, r0, width, rows))
+            os.replace(temp_path, path)
+
+    def read(self, raster_path, band=1, max_size=1000):
+        """读取长边不超过max_size像素的预览图像，返回(NoData为NaN的图像, [minx, maxx, miny, maxy])"""
+        with rasterio.open(raster_path) as src:
+            bounds = src.bounds
+        path, band = self.source(raster_path, band)
+        with rasterio.open(path) as src:
+            k = max(1, int(np.ceil(max(src.width, src.height) / max_size)))
+            data = src.read(band, out_shape=(-(-src.height // k), -(-src.width // k)),
+                            resampling=Resampling.average, masked=True)
+        return data.astype(np.float64).filled(np.nan), [bounds.left, bounds.right, bounds.bottom, bounds.top]
+
+
+class BandCheckpoint:
+    """行带检查点：把已完成行带的网格结果写入磁盘，中断后重新运行同一任务时跳过这些行带
+
+    每个任务（输入文件指纹与划分参数、行带数相同）对应checkpoint_dir下的一个子目录，
+    每个完成的行带存为一个Parquet文件（网格编号和统计字段），先写临时文件再替换，
+    因此目录中的行带文件总是完整的。任务完成后删除该子目录。需要pyarrow库。
+    """
+
+    VERSION = 1
+
+    def __init__(self, checkpoint_dir, input_path, params, n_bands):
+        self.params = {**params, "n_bands": n_bands}
+        self.n_bands = n_bands
+        payload = json.dumps([self.VERSION, file_fingerprint(input_path), self.params], sort_keys=True, default=str)
+        self.directory = os.path.join(checkpoint_dir, hashlib.sha256(payload.encode("utf-8")).hexdigest())
+
+    @staticmethod
+    def available():
+        import importlib.util
+        return importlib.util.find_spec("pyarrow") is not None
+
+    def band_path(self, n):
+        return os.path.join(self.directory, f"band_{n:05d}.parquet")
+
+    def completed(self):
+        """已写入检查点的行带序号"""
+        return {int(os.path.basename(path)[5:10]) for path in glob.glob(os.path.join(self.directory, "band_*.parquet"))}
+
+    def save(self, n, grid):
+        """写入一个完成的行带；首次写入时同时记录任务参数，便于查看检查点对应的任务"""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, "job.json"), "w", encoding="utf-8") as f:
+                json.dump(self.params, f, ensure_ascii=False, indent=1, default=str)
+        path = self.band_path(n)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        grid.attributes.assign(cell_id=grid.cell_ids).to_parquet(temp_path, index=False)
+        os.replace(temp_path, path)
+
+    def load(self, n, layout):
+        """读取一个行带，按layout的网格布局还原为网格"""
+        frame = pd.read_parquet(self.band_path(n))
+        return layout.with_cells(frame["cell_id"].to_numpy(), frame.drop(columns="cell_id"))
+
+    def clear(self):
+        """任务完成后删除本任务的检查点"""
+        import shutil
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class GridChunkWriter:
+    """分块写出网格结果，支持GeoParquet和FlatGeobuf两种列式/流式格式
+
+    第一个非空块确定输出字段结构，之后每块直接追加到文件，完整结果无需同时保存在内存中。
+    用法：
+        with GridChunkWriter(path, "parquet", crs) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    """
+
+    def __init__(self, path, output_format, crs=None):
+        if output_format not in CHUNK_OUTPUT_FORMATS:
+            raise ValueError(f"不支持分块写出的格式: {output_format}")
+        self.path = path
+        self.output_format = output_format
+        self.crs = crs
+        self.rows_written = 0
+        self._writer = None
+        self._schema = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def write(self, chunk):
+        """追加一个网格块（GeoDataFrame），空块直接跳过"""
+        if len(chunk) == 0:
+            return
+        if self.output_format == "parquet":
+            self._write_parquet(chunk)
+        else:
+            self._write_flatgeobuf(chunk)
+        self.rows_written += len(chunk)
+
+    def _write_parquet(self, chunk):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("写出GeoParquet需要安装pyarrow库。请运行: pip install pyarrow")
+
+        attributes = pd.DataFrame(chunk.drop(columns=chunk.geometry.name))
+        table = pa.Table.from_pandas(attributes, schema=self._schema, preserve_index=False)
+        table = table.append_column("geometry", pa.array(shapely.to_wkb(chunk.geometry.values), pa.binary()))
+
+        if self._writer is None:
+            # 首块中全为空值的字段无法推断类型，统一按字符串写出
+            fields = [pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+                      for field in table.schema]
+            column_meta = {"encoding": "WKB", "geometry_types": ["Polygon"]}
+            if self.crs is not None:
+                column_meta["crs"] = CRS.from_user_input(self.crs).to_json_dict()
+            geo_meta = {"version": "1.0.0", "primary_column": "geometry", "columns": {"geometry": column_meta}}
+            schema = pa.schema(fields, metadata={b"geo": json.dumps(geo_meta).encode("utf-8")})
+            self._schema = pa.schema(fields[:-1])
+            table = table.cast(schema)
+            self._writer = pq.ParquetWriter(self.path, schema)
+        else:
+            table = table.replace_schema_metadata(self._writer.schema.metadata)
+
+        self._writer.write_table(table)
+
+    def _write_flatgeobuf(self, chunk):
+        try:
+            import fiona
+            from geopandas.io.file import infer_schema
+        except ImportError:
+            raise ImportError("写出FlatGeobuf需要安装fiona库。请运行: pip install fiona")
+
+        if self._writer is None:
+            crs_wkt = CRS.from_user_input(self.crs).to_wkt() if self.crs is not None else None
+            self._writer = fiona.open(self.path, "w", driver="FlatGeobuf",
+                                      schema=infer_schema(chunk), crs_wkt=crs_wkt)
+        self._writer.writerecords(chunk.iterfeatures())
+
+    def close(self):
+        """结束写出并关闭文件"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class ProgressReporter:
+    """限速的进度汇报器
+
+    按时间间隔和百分比变化两个条件节流，仅在满足条件时调用回调，
+    回调参数为(百分比, 每秒处理的网格数, 预计剩余秒数)。
+    给出cancel_check时每次汇报（不论是否节流）都先调用它，可在其中抛出异常以中止计算。
+    """
+    def __init__(self, total_cells, callback, min_interval=0.1, min_step=1, cancel_check=None):
+        self.total_cells = total_cells
+        self.callback = callback
+        self.cancel_check = cancel_check
+        self.min_interval = min_interval
+        self.min_step = min_step
+        self.start_time = time.perf_counter()
+        self.last_time = None
+        self.last_percent = -1
+
+    def __call__(self, percent):
+        """汇报当前进度（0~100），可直接作为计算函数的进度回调"""
+        if self.cancel_check:
+            self.cancel_check()
+        percent = int(max(0, min(100, percent)))
+        now = time.perf_counter()
+        if percent < 100:
+            if percent - self.last_percent < self.min_step:
+                return
+            if self.last_time is not None and now - self.last_time < self.min_interval:
+                return
+        elif self.last_percent == 100:
+            return
+
+        elapsed = max(now - self.start_time, 1e-9)
+        cells_per_second = self.total_cells * percent / 100 / elapsed
+        eta_seconds = elapsed * (100 - percent) / percent if percent > 0 else float("nan")
+        self.last_time = now
+        self.last_percent = percent
+        self.callback(percent, cells_per_second, eta_seconds)
+
+    def scaled(self, start, end):
+        """返回把子任务0~100的进度映射到[start, end]区间的回调"""
+        return lambda percent: self(start + (end - start) * percent / 100)
+
+
+def parse_bbox(text):
+    """解析逗号分隔的范围"minx,miny,maxx,maxy"，输入为空时返回None"""
+    items = [item.strip() for item in text.replace("，", ",").split(",") if item.strip()]
+    if not items:
+        return None
+    try:
+        bbox = tuple(float(item) for item in items)
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+        raise ValueError(f"范围应为 minx,miny,maxx,maxy: {text}")
+    return bbox
+
+
+def vector_fields(path):
+    """只读取文件头，返回矢量文件属性字段的[(字段名, 数据类型)]"""
+    try:
+        import pyogrio
+    except ImportError:
+        sample = gpd.read_file(path, rows=1)
+        return [(col, str(sample[col].dtype)) for col in sample.columns if col != sample.geometry.name]
+    info = pyogrio.read_info(path)
+    return [(name, str(dtype)) for name, dtype in zip(info["fields"], info["dtypes"])]
+
+
+def read_vector(path, columns=None, bbox=None, read_geometry=True, fids=None):
+    """按需读取矢量文件，返回以要素FID为索引的GeoDataFrame（不读几何时为DataFrame）
+
+    columns为要读取的属性字段（None为全部，空列表为只读几何），bbox为数据坐标系下的
+    (minx, miny, maxx, maxy)范围过滤，fids为之前按同一bbox读取得到的要素FID，给出时只读取这些要素。
+    安装pyogrio时只解码所需字段，并在安装pyarrow时以Arrow方式批量读取；
+    否则退回gpd.read_file读取全部字段后再选取，索引为要素在文件中的序号。
+    """
+    try:
+        import pyogrio
+    except ImportError:
+        gdf = gpd.read_file(path, bbox=bbox)
+        if fids is not None:
+            gdf = gdf.loc[fids]
+        if columns is not None:
+            gdf = gdf[list(columns) + [gdf.geometry.name]]
+        return gdf if read_geometry else pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+
+    import importlib.util
+    return pyogrio.read_dataframe(
+        path, columns=columns, bbox=None if fids is not None else bbox, fids=fids,
+        read_geometry=read_geometry, fid_as_index=True,
+        use_arrow=importlib.util.find_spec("pyarrow") is not None
+    )
+
+
+# 输出格式对应的文件扩展名
+OUTPUT_EXTENSIONS = {"shp": ".shp", "geojson": ".geojson", "kml": ".kml", "parquet": ".parquet", "fgb": ".fgb"}
+
+# 按扩展名识别为栅格的输入文件，其余按矢量文件读取
+RASTER_EXTENSIONS = (".tif", ".tiff", ".img", ".vrt", ".asc")
+
+
+def write_grid(grid, path, output_format):
+    """把网格（或分区统计结果GeoDataFrame）一次性写出到文件，网格多边形在写出时生成"""
+    output_gdf = grid if isinstance(grid, gpd.GeoDataFrame) else grid.to_geodataframe()
+    if output_format == "shp":
+        output_gdf.to_file(path)
+    elif output_format == "geojson":
+        output_gdf.to_file(path, driver='GeoJSON')
+    elif output_format == "kml":
+        output_gdf.to_file(path, driver='KML')
+    elif output_format == "parquet":
+        output_gdf.to_parquet(path)
+    elif output_format == "fgb":
+        output_gdf.to_file(path, driver='FlatGeobuf')
+    else:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+
+
+class JobCancelled(Exception):
+    """任务在行带（或窗口条带）边界处被取消"""
+
+
+class GridJob:
+    """网格划分任务：按参数完成重投影、网格划分及分块写出，不依赖图形界面
+
+    图形界面的后台线程和命令行批处理都通过它执行网格划分，
+    日志和进度通过message_callback、progress_callback回调输出。
+    可从其他线程调用cancel()协作式取消；给出checkpoint_dir时按行带保存检查点，中断后可继续。
+    """
+
+    def __init__(self, data, data_type, grid_size, grid_units, stat_method="mean", band_index=1, keep_original_attributes=True,
+                 input_path=None, memory_limit_mb=1024, n_workers=1, weighted=False,
+                 output_path=None, output_format=None, grid_type="square",
+                 crs_mode="auto", custom_crs=None, reprojection_cache=None, pyramid_factors=None,
+                 result_cache=None, zones=None, checkpoint_dir=None, message_callback=None, progress_callback=None):
+        self.data = data
+        self.data_type = data_type  # "vector" 或 "raster"
+        self.grid_size = grid_size
+        self.grid_units = grid_units
+        # 栅格数据可同时计算多个波段、多种统计量（列表形式传入）
+        self.stat_methods = list(stat_method) if isinstance(stat_method, (list, tuple)) else [stat_method]
+        self.stat_method = self.stat_methods[0]
+        self.bands = list(band_index) if isinstance(band_index, (list, tuple)) else [band_index]
+        self.band_index = self.bands[0]
+        self.keep_original_attributes = keep_original_attributes
+        self.input_path = input_path  # 输入文件：栅格未载入内存时按窗口流式读取，并作为重投影缓存的键
+        self.memory_limit_mb = memory_limit_mb
+        self.n_workers = n_workers  # 大于1时按行带在进程池中并行处理
+        self.weighted = weighted  # 矢量数据按相交面积/长度加权聚合
+        self.output_path = output_path  # 设置后按块直接写出到文件，不在内存中汇总结果
+        self.output_format = output_format
+        self.grid_type = grid_type  # "square"（正方形）或 "hexagon"（等面积六边形）
+        self.crs_mode = crs_mode  # 网格坐标系："auto"、"native"、"equal_area"或"custom"
+        self.custom_crs = custom_crs
+        # 未传入重投影缓存时使用本任务自己的缓存，任务结束后删除其临时文件
+        self.owns_reprojection_cache = reprojection_cache is None
+        self.reprojection_cache = reprojection_cache if reprojection_cache is not None else ReprojectionCache()
+        self.pyramid_factors = list(pyramid_factors or [])  # 金字塔模式：各级网格大小相对grid_size的倍数
+        self.result_cache = result_cache  # 结果缓存，为None时不缓存
+        self.zones = zones  # 分区多边形GeoDataFrame：给出时对栅格做分区统计而不划分网格
+        self.checkpoint_dir = checkpoint_dir  # 行带检查点目录，为None时不保存检查点
+        self.cancel_event = threading.Event()
+        self.message_callback = message_callback
+        self.progress_callback = progress_callback
+
+    def message(self, text):
+        """输出处理过程中的日志消息"""
+        if self.message_callback:
+            self.message_callback(text)
+
+    def report_progress(self, percent, cells_per_second, eta_seconds):
+        """节流后的进度回调，参数为(百分比, 每秒处理的网格数, 预计剩余秒数)"""
+        if self.progress_callback:
+            self.progress_callback(percent, cells_per_second, eta_seconds)
+
+    def cancel(self):
+        """请求取消任务（可从其他线程调用），在下一个行带或窗口条带边界处停止"""
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        """已请求取消时抛出JobCancelled"""
+        if self.cancel_event.is_set():
+            raise JobCancelled("任务已取消")
+
+    def progress_reporter(self, total_cells):
+        """创建进度汇报器，每次汇报进度时检查是否已请求取消"""
+        return ProgressReporter(total_cells, self.report_progress, cancel_check=self.check_cancelled)
+
+    def band_checkpoint(self, rows, cols):
+        """检查点模式下返回本任务的BandCheckpoint，未启用或无法使用时返回None"""
+        if not self.checkpoint_dir:
+            return None
+        if not self.input_path:
+            self.message("数据不是从文件读取，不保存检查点")
+            return None
+        if not BandCheckpoint.available():
+            self.message("未安装pyarrow，不保存检查点")
+            return None
+        n_bands = min(rows, max(CHECKPOINT_BANDS, self.n_workers * 4, -(-rows * cols // GRID_CHUNK_CELLS)))
+        return BandCheckpoint(self.checkpoint_dir, self.input_path, self.job_params(), n_bands)
+
+    def iter_checkpointed(self, checkpoint, task, band_args, layout, progress_callback=None):
+        """按行带执行任务，每完成一个行带即写入检查点，已有检查点的行带不再计算
+
+        n_workers大于1时各行带在进程池中并行，按完成顺序写入检查点。
+        全部行带完成后按行带顺序从检查点逐个读出网格，调用方可直接合并或分块写出。
+        """
+        done = checkpoint.completed()
+        pending = [n for n in range(len(band_args)) if n not in done]
+        if len(pending) < len(band_args):
+            self.message(f"从检查点继续：已完成 {len(band_args) - len(pending)}/{len(band_args)} 个行带")
+        else:
+            self.message(f"按 {len(band_args)} 个行带处理，检查点保存在: {checkpoint.directory}")
+
+        if self.n_workers > 1 and len(pending) > 1:
+            results = iter_completed_band_tasks(task, [band_args[n] for n in pending], self.n_workers)
+        else:
+            results = ((i, task(*band_args[n])) for i, n in enumerate(pending))
+        try:
+            for finished, (i, result) in enumerate(results, len(band_args) - len(pending) + 1):
+                grid = result if isinstance(result, RegularGrid) else layout.with_cells(*result)
+                checkpoint.save(pending[i], grid)
+                if progress_callback:
+                    progress_callback(int(finished / len(band_args) * 100))
+                self.check_cancelled()
+        finally:
+            results.close()
+
+        for n in range(len(band_args)):
+            yield checkpoint.load(n, layout)
+
+    def write_chunks(self, chunks, crs, path=None):
+        """把逐块产出的网格依次写出到输出文件（默认为output_path），多边形只在写出时生成"""
+        path = path or self.output_path
+        self.message(f"分块写出到文件: {path}")
+        with GridChunkWriter(path, self.output_format, crs) as writer:
+            for grid in chunks:
+                grid.crs = crs
+                writer.write(grid.to_geodataframe())
+        self.message(f"网格划分完成，共写出 {writer.rows_written} 个有效网格")
+
+    def finish_pyramid(self, grids, crs):
+        """输出金字塔各级网格：分块写出模式下每级写出到单独的文件并返回输出路径，否则返回网格列表"""
+        for grid in grids:
+            grid.crs = crs
+            self.message(f"网格大小 {grid.grid_size:g}: 共生成 {len(grid)} 个有效网格")
+        if self.output_path:
+            for grid in grids:
+                self.write_chunks(
+                    (grid.with_cells(grid.cell_ids[i:i + GRID_CHUNK_CELLS], grid.attributes.iloc[i:i + GRID_CHUNK_CELLS])
+                     for i in range(0, len(grid), GRID_CHUNK_CELLS)),
+                    crs, pyramid_level_path(self.output_path, grid.grid_size)
+                )
+            return self.output_path
+        return grids
+
+    def reproject_input(self):
+        """按网格坐标系一次性批量重投影输入数据，结果按(文件, 坐标系)缓存"""
+        if self.data_type == "vector":
+            data_crs, bounds = self.data.crs, self.data.total_bounds
+        else:
+            raster_meta = self.data[1]
+            transform = raster_meta['transform']
+            data_crs = raster_meta.get('crs')
+            bounds = rasterio.transform.array_bounds(raster_meta['height'], raster_meta['width'], transform)
+
+        target_crs = grid_target_crs(data_crs, bounds, self.grid_units == "度", self.crs_mode, self.custom_crs)
+        if target_crs is None:
+            return
+        cached = self.reprojection_cache.contains(self.input_path, target_crs,
+                                                  self.data if self.data_type == "vector" else None)
+        self.message(f"重投影到网格坐标系: {target_crs.name}" + ("（使用缓存）" if cached else ""))
+
+        if self.data_type == "vector":
+            self.data = self.reprojection_cache.vector(self.input_path, self.data, target_crs)
+        else:
+            # 栅格重投影到缓存文件后按窗口流式读取
+            self.input_path = self.reprojection_cache.raster(self.input_path, target_crs)
+            with rasterio.open(self.input_path) as src:
+                self.data = (None, src.meta.copy())
+
+    def job_params(self):
+        """决定划分结果的参数，用于结果缓存和检查点的键"""
+        params = {
+            "data_type": self.data_type, "grid_size": self.grid_size, "grid_units": self.grid_units,
+            "stat_methods": self.stat_methods, "bands": self.bands,
+            "keep_original_attributes": self.keep_original_attributes, "weighted": self.weighted,
+            "grid_type": self.grid_type, "crs_mode": self.crs_mode, "custom_crs": self.custom_crs,
+            "pyramid_factors": self.pyramid_factors,
+        }
+        if self.data_type == "vector":
+            # 读取的字段和（范围过滤后的）要素子集也决定结果
+            params["columns"] = [col for col in self.data.columns if col != self.data.geometry.name]
+            params["features"] = [len(self.data), self.data.total_bounds.tolist()]
+        return params
+
+    def result_cache_key(self):
+        """结果缓存键，不使用缓存（未设置缓存、无输入文件或分块写出模式）时返回None"""
+        if (self.result_cache is None or not self.result_cache.enabled or not self.input_path or self.output_path
+                or self.zones is not None):
+            return None
+        return self.result_cache.key(self.input_path, self.job_params())
+
+    def run(self):
+        """执行网格划分，返回网格、金字塔各级网格列表、分区统计结果或（分块写出模式下的）输出文件路径"""
+        if self.data_type not in ("vector", "raster"):
+            raise ValueError(f"未知的数据类型: {self.data_type}")
+        if self.zones is not None:
+            if self.data_type != "raster" or not self.input_path:
+                raise ValueError("分区统计仅支持栅格文件输入")
+            if self.pyramid_factors:
+                raise ValueError("分区统计不能与金字塔模式同时使用")
+            check_decomposable_stats(self.stat_methods, "分区统计")
+            if self.checkpoint_dir:
+                self.message("分区统计不保存检查点")
+            return self.process_zonal()
+        if self.pyramid_factors:
+            if self.grid_type != "square":
+                raise ValueError("金字塔模式仅支持正方形网格")
+            if self.data_type == "raster":
+                check_decomposable_stats(self.stat_methods)
+            elif self.checkpoint_dir:
+                self.message("矢量数据金字塔模式不保存检查点")
+
+        cache_key = self.result_cache_key()
+        if cache_key is not None:
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                self.message("输入文件和划分参数未变化，使用缓存的结果")
+                return cached
+
+        try:
+            self.reproject_input()
+            if self.data_type == "vector":
+                result = self.process_vector()
+            else:
+                result = self.process_raster()
+        finally:
+            if self.owns_reprojection_cache:
+                self.reprojection_cache.cleanup()
+
+        if cache_key is not None:
+            try:
+                self.result_cache.put(cache_key, result)
+            except Exception as e:
+                self.message(f"结果未能写入缓存: {str(e)}")
+        return result
+
+    def process_vector(self):
+        """处理矢量数据"""
+        self.message("开始矢量数据网格划分...")
+        gdf = self.data
+        
+        # 获取数据边界
+        total_bounds = gdf.total_bounds
+        minx, miny, maxx, maxy = total_bounds
+        
+        self.message(f"数据边界: X({minx:.2f}~{maxx:.2f}), Y({miny:.2f}~{maxy:.2f})")
+        
+        # 计算网格行列数
+        rows, cols = GRID_TYPES[self.grid_type].shape_for_extent(minx, miny, maxx, maxy, self.grid_size)
+        
+        self.message(f"将生成 {rows} 行 x {cols} 列的网格，共 {rows * cols} 个单元")
+        progress = self.progress_reporter(rows * cols)
+        progress(10)
+        
+        if self.pyramid_factors:
+            # 金字塔模式：只在最细一级求交，各级网格由相交对换算得到
+            self.message(f"金字塔模式：共 {len(self.pyramid_factors)} 级，"
+                                      f"倍数 {', '.join(map(str, self.pyramid_factors))}")
+            grids = grid_vector_pyramid(
+                gdf, minx, miny, rows, cols, self.grid_size, self.pyramid_factors,
+                self.stat_method, self.keep_original_attributes, self.weighted
+            )
+            progress(95)
+            result = self.finish_pyramid(grids, gdf.crs)
+            progress(100)
+            return result
+        
+        checkpoint = self.band_checkpoint(rows, cols)
+        if checkpoint is not None:
+            # 检查点模式：按行带划分，每完成一个行带写入检查点，重新运行时跳过已完成的行带
+            band_args = vector_band_args(gdf, minx, miny, rows, cols, self.grid_size, checkpoint.n_bands,
+                                         self.stat_method, self.keep_original_attributes, self.weighted,
+                                         self.grid_type)
+            layout = GRID_TYPES[self.grid_type](minx, miny, self.grid_size, rows, cols)
+            chunks = self.iter_checkpointed(checkpoint, _vector_band_task, band_args, layout, progress.scaled(10, 95))
+            if self.output_path:
+                self.write_chunks(chunks, gdf.crs)
+                checkpoint.clear()
+                progress(100)
+                return self.output_path
+            grids = list(chunks)
+            if grids:
+                grid = RegularGrid.concat(grids, rows)
+            else:
+                grid = _vector_band_task(gdf.iloc[:0], minx, miny, (0, rows), cols, self.grid_size, self.stat_method,
+                                         self.keep_original_attributes, self.weighted, self.grid_type)
+            checkpoint.clear()
+        elif self.output_path:
+            # 分块写出：按行带逐块划分并立即写盘
+            self.write_chunks(iter_vector_chunks(
+                gdf, minx, miny, rows, cols, self.grid_size,
+                self.stat_method, self.keep_original_attributes, self.weighted,
+                self.n_workers, progress_callback=progress.scaled(10, 95), grid_type=self.grid_type
+            ), gdf.crs)
+            progress(100)
+            return self.output_path
+        elif self.n_workers > 1:
+            # 并行模式：按行带划分要素，在进程池中分别划分后按顺序合并
+            self.message(f"使用 {self.n_workers} 个进程并行处理")
+            grid = grid_vector_parallel(
+                gdf, minx, miny, rows, cols, self.grid_size,
+                self.stat_method, self.keep_original_attributes,
+                self.n_workers, progress.scaled(10, 95), self.weighted, self.grid_type
+            )
+        elif self.weighted:
+            # 加权模式：批量裁剪要素，按相交面积/长度加权聚合
+            grid = grid_vector_weighted(
+                gdf, minx, miny, rows, cols, self.grid_size,
+                self.stat_method, self.keep_original_attributes, grid_type=self.grid_type
+            )
+            progress(95)
+        else:
+            # 批量生成网格并通过空间索引一次性完成相交查询和分组统计
+            grid = grid_vector_features(
+                gdf, minx, miny, rows, cols, self.grid_size,
+                self.stat_method, self.keep_original_attributes, grid_type=self.grid_type
+            )
+            progress(95)
+        
+        # 结果为隐式规则网格，多边形在导出或绘图时按需生成
+        progress(100)
+        
+        self.message(f"矢量数据网格划分完成，共生成 {len(grid)} 个有效网格")
+        return grid
+
+    def process_zonal(self):
+        """分区统计：分区重投影到栅格坐标系后按窗口流式统计，栅格本身不重投影"""
+        self.message(f"开始分区统计：共 {len(self.zones)} 个分区（内存上限 {self.memory_limit_mb} MB）")
+        progress = self.progress_reporter(len(self.zones))
+        progress(10)
+        if self.n_workers > 1:
+            self.message(f"使用 {self.n_workers} 个进程并行处理")
+        result = zonal_statistics(
+            self.input_path, self.zones, self.stat_methods, self.bands,
+            self.memory_limit_mb, self.n_workers, progress.scaled(10, 95)
+        )
+        self.message(f"分区统计完成，共 {len(result)} 个分区")
+
+        if self.output_path:
+            self.message(f"写出到文件: {self.output_path}")
+            write_grid(result, self.output_path, self.output_format)
+            result = self.output_path
+        progress(100)
+        return result
+
+    def process_raster(self):
+        """处理栅格数据"""
+        self.message("开始栅格数据网格划分...")
+        raster_data, raster_meta = self.data
+        
+        # 获取数据边界
+        transform = raster_meta['transform']
+        width = raster_meta['width']
+        height = raster_meta['height']
+        
+        minx = transform[2]
+        maxy = transform[5]
+        maxx = minx + width * transform[0]
+        miny = maxy + height * transform[4]
+        
+        self.message(f"数据边界: X({minx:.2f}~{maxx:.2f}), Y({miny:.2f}~{maxy:.2f})")
+        
+        # 计算网格行列数
+        rows, cols = GRID_TYPES[self.grid_type].shape_for_extent(minx, miny, maxx, maxy, self.grid_size)
+        
+        self.message(f"将生成 {rows} 行 x {cols} 列的网格，共 {rows * cols} 个单元")
+        progress = self.progress_reporter(rows * cols)
+        progress(10)
+        
+        # 金字塔模式：最细一级计算可分解统计量，各级网格由其逐级合并得到
+        stat_methods = list(PYRAMID_PARTIALS) if self.pyramid_factors else self.stat_methods
+        if self.pyramid_factors:
+            self.message(f"金字塔模式：共 {len(self.pyramid_factors)} 级，"
+                                      f"倍数 {', '.join(map(str, self.pyramid_factors))}")
+        
+        layout = raster_grid_plan(transform, width, height, self.grid_size, self.grid_type)
+        checkpoint = self.band_checkpoint(layout.rows, layout.cols)
+        if checkpoint is not None:
+            # 检查点模式：各行带流式读取窗口，每完成一个行带写入检查点，重新运行时跳过已完成的行带
+            band_args = raster_band_args(self.input_path, layout, self.grid_size, stat_methods, self.bands,
+                                         self.memory_limit_mb, self.n_workers, self.grid_type, checkpoint.n_bands)
+            chunks = self.iter_checkpointed(checkpoint, _raster_band_task, band_args, layout, progress.scaled(10, 95))
+            if self.output_path and not self.pyramid_factors:
+                self.write_chunks(chunks, raster_meta.get('crs'))
+                checkpoint.clear()
+                progress(100)
+                return self.output_path
+            grid = RegularGrid.concat(list(chunks), layout.rows)
+            checkpoint.clear()
+        elif self.output_path and self.input_path and not self.pyramid_factors:
+            # 分块写出：按窗口条带逐块归约并立即写盘
+            self.write_chunks(iter_raster_chunks(
+                self.input_path, self.grid_size, self.stat_methods, self.bands,
+                self.memory_limit_mb, self.n_workers, progress.scaled(10, 95), self.grid_type
+            ), raster_meta.get('crs'))
+            progress(100)
+            return self.output_path
+        elif self.n_workers > 1 and self.input_path:
+            # 并行模式：各进程流式读取各自行带的窗口，结果按顺序合并
+            self.message(f"使用 {self.n_workers} 个进程并行处理（内存上限 {self.memory_limit_mb} MB）")
+            grid = grid_raster_parallel(
+                self.input_path, self.grid_size, stat_methods, self.bands,
+                self.memory_limit_mb, self.n_workers, progress.scaled(10, 95), self.grid_type
+            )
+        elif raster_data is None:
+            # 流式模式：按网格行条带逐窗口读取，内存占用受内存上限控制
+            self.message(f"栅格未载入内存，按窗口流式处理（内存上限 {self.memory_limit_mb} MB）")
+            grid = grid_raster_windows(
+                self.input_path, self.grid_size, stat_methods, self.bands,
+                self.memory_limit_mb, progress.scaled(10, 95), self.grid_type
+            )
+        else:
+            # 块归约：一次NumPy计算得到全部波段、全部统计量，再批量生成有效网格
+            if raster_data.ndim == 3:
+                raster_data = raster_data[[band - 1 for band in self.bands]]
+            grid = grid_raster_array(
+                raster_data, transform, self.grid_size,
+                stat_methods, raster_meta.get('nodata'), self.bands, self.grid_type
+            )
+            progress(95)
+        
+        if self.pyramid_factors:
+            grids = grid_pyramid(grid, self.pyramid_factors, self.bands, self.stat_methods)
+            result = self.finish_pyramid(grids, raster_meta.get('crs'))
+            progress(100)
+            return result
+        
+        # 设置CRS（如果栅格数据有CRS信息）
+        if raster_meta.get('crs'):
+            grid.crs = raster_meta['crs']
+        progress(100)
+        
+        self.message(f"栅格数据网格划分完成，共生成 {len(grid)} 个有效网格")
+        return grid
+
+
+
+def cli_print(text, file=None):
+    """整行一次写出，多个进程同时输出时各行不会相互穿插"""
+    file = file or sys.stdout
+    file.write(text + "\n")
+    file.flush()
+
+
+def cli_output_stems(input_paths):
+    """为每个输入文件确定输出文件名主干，主干相同的文件附加原扩展名以免相互覆盖"""
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in input_paths]
+    duplicated = {stem for stem in stems if stems.count(stem) > 1}
+    stems = [stem + "_" + os.path.splitext(path)[1].lstrip(".") if stem in duplicated else stem
+             for stem, path in zip(stems, input_paths)]
+    if len(set(stems)) < len(stems):
+        raise ValueError("输入文件名重复，输出文件会相互覆盖，请分批处理")
+    return stems
+
+
+def _cli_job(input_path, output_stem, grid_sizes, options):
+    """命令行批处理中的单个任务：读取一个输入文件，依次按各网格大小划分并写出
+
+    同一文件的各网格大小在同一进程中处理，重投影结果只计算一次。
+    返回[(网格大小, 输出文件列表, 有效网格数, 耗时秒数)]，分块写出模式下有效网格数为None；
+    分区统计模式下只有一项，网格大小为None，有效网格数为分区数。
+    """
+    name = os.path.basename(input_path)
+    stem = os.path.join(options["output_dir"], output_stem)
+    ext = OUTPUT_EXTENSIONS[options["output_format"]]
+
+    if input_path.lower().endswith(RASTER_EXTENSIONS):
+        # 栅格只读取元数据，按窗口流式处理，内存占用受内存上限控制
+        data_type = "raster"
+        with rasterio.open(input_path) as src:
+            data = (None, src.meta.copy())
+    else:
+        data_type = "vector"
+        data = read_vector(input_path, options["columns"], options["bbox"]).reset_index(drop=True)
+
+    if options["zones"]:
+        # 分区统计：不划分网格，输出文件名附加_zonal
+        start = time.perf_counter()
+        output_path = f"{stem}_zonal{ext}"
+        job = GridJob(
+            data, data_type, None, options["units"],
+            options["stat_methods"], options["bands"], input_path=input_path,
+            memory_limit_mb=options["memory_limit_mb"], n_workers=options["n_workers"],
+            output_path=output_path if options["stream"] else None, output_format=options["output_format"],
+            zones=read_vector(options["zones"]).reset_index(drop=True),
+            message_callback=lambda text: cli_print(f"[{name}] {text}")
+        )
+        result = job.run()
+        n_zones = None
+        if not isinstance(result, str):
+            n_zones = len(result)
+            write_grid(result, output_path, options["output_format"])
+        return [(None, [output_path], n_zones, time.perf_counter() - start)]
+
+    results = []
+    # 重投影的栅格只在本文件的各网格大小之间复用，处理完即删除临时文件
+    with ReprojectionCache() as reprojection_cache:
+        for grid_size in grid_sizes:
+            start = time.perf_counter()
+            # 千米转换为米；文件名附加网格大小（金字塔模式下附加各级网格大小）
+            size = grid_size * 1000 if options["units"] == "千米" else grid_size
+            output_path = stem + ext if options["pyramid_factors"] else f"{stem}_{size:g}{ext}"
+            job = GridJob(
+                data, data_type, size, options["units"],
+                options["stat_methods"], options["bands"], options["keep_original_attributes"],
+                input_path, options["memory_limit_mb"], options["n_workers"], options["weighted"],
+                output_path if options["stream"] else None, options["output_format"], options["grid_type"],
+                options["crs_mode"], options["custom_crs"], reprojection_cache, options["pyramid_factors"],
+                ResultCache(options["cache_dir"], options["cache_mb"]) if options["cache_dir"] else None,
+                checkpoint_dir=options["checkpoint_dir"],
+                message_callback=lambda text: cli_print(f"[{name}] {text}")
+            )
+            result = job.run()
+
+            if isinstance(result, str):
+                # 分块写出模式：结果已写入文件，有效网格数见日志
+                grids = None
+                outputs = ([pyramid_level_path(result, size * factor) for factor in options["pyramid_factors"]]
+                           if options["pyramid_factors"] else [result])
+            else:
+                grids = result if isinstance(result, list) else [result]
+                outputs = [pyramid_level_path(output_path, grid.grid_size) if options["pyramid_factors"] else output_path
+                           for grid in grids]
+                for grid, path in zip(grids, outputs):
+                    write_grid(grid, path, options["output_format"])
+            n_cells = None if grids is None else sum(len(grid) for grid in grids)
+            results.append((grid_size, outputs, n_cells, time.perf_counter() - start))
+    return results
+
+
+def build_cli_parser():
+    """命令行参数定义"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="GIS数据网格划分（命令行批处理）。不带参数运行时启动图形界面。",
+        epilog="示例: python GIS矢量数据网格划分工具.py a.shp b.tif -s 1 5 -u 千米 --stat mean,std -f parquet -o out -j 4\n"
+               "性能基准: python GIS矢量数据网格划分工具.py benchmark --scale small",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("inputs", nargs="+", help="输入的矢量或栅格文件（.tif/.tiff/.img/.vrt/.asc按栅格读取）")
+    parser.add_argument("-s", "--grid-size", type=float, nargs="+", help="网格大小，可给出多个（分区统计时不需要）")
+    parser.add_argument("-u", "--units", choices=["米", "千米", "度"], default="米", help="网格大小单位（默认: 米）")
+    parser.add_argument("--grid-type", choices=["square", "hexagon"], default="square", help="网格形状（默认: square）")
+    parser.add_argument("--stat", default="mean",
+                        help="统计方法，逗号分隔，如 mean,std,p90；矢量数据使用第一个（默认: mean）")
+    parser.add_argument("--bands", default="1", help="栅格波段，逗号分隔（默认: 1）")
+    parser.add_argument("--weighted", action="store_true", help="矢量数据按相交面积/长度加权聚合")
+    parser.add_argument("--keep-attributes", action="store_true", help="矢量数据保留原始属性而不计算统计值")
+    parser.add_argument("--columns", default=None,
+                        help="矢量数据只读取这些属性字段，逗号分隔；给出空字符串时不读属性（默认: 全部）")
+    parser.add_argument("--bbox", default="", help="矢量数据只读取与范围 minx,miny,maxx,maxy 相交的要素")
+    parser.add_argument("--crs-mode", choices=["auto", "native", "equal_area", "custom"], default="auto",
+                        help="网格坐标系（默认: auto）")
+    parser.add_argument("--crs", default=None, help="crs-mode为custom时使用的投影坐标系，如 EPSG:3035")
+    parser.add_argument("--pyramid", default="", help="金字塔倍数，逗号分隔，如 1,2,5,10,20")
+    parser.add_argument("--zones", default=None,
+                        help="分区多边形文件（如流域、保护区），给出时对栅格输入按分区统计而不划分网格")
+    parser.add_argument("-f", "--format", choices=list(OUTPUT_EXTENSIONS), default="parquet",
+                        help="输出格式（默认: parquet）")
+    parser.add_argument("--stream", action="store_true", help="按块直接写出（仅parquet、fgb格式）")
+    parser.add_argument("-o", "--output-dir", default=".", help="输出目录（默认: 当前目录）")
+    parser.add_argument("--memory-limit", type=int, default=1024, help="每个任务的内存上限，单位MB（默认: 1024）")
+    parser.add_argument("--cache-dir", default=None, help="结果缓存目录，给出时重复运行相同文件和参数直接使用缓存")
+    parser.add_argument("--cache-mb", type=int, default=1024, help="结果缓存上限，单位MB（默认: 1024）")
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="行带检查点目录，给出时每完成一个行带保存一次，中断后重新运行相同命令从中断处继续")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="同时处理的输入文件数（默认: 1）")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="每个文件按行带并行的进程数（默认: 1）")
+    return parser
+
+
+def cli_main(argv):
+    """命令行入口：按输入文件在进程池中批量执行网格划分，返回退出码
+
+    不导入PyQt5和matplotlib，可在无图形界面的计算节点上无人值守运行。
+    """
+    global MP_START_METHOD
+
+    if argv and argv[0] == "benchmark":
+        return benchmark_main(argv[1:])
+
+    parser = build_cli_parser()
+    args = parser.parse_args(argv)
+    try:
+        stat_methods = parse_stat_methods(args.stat) or ["mean"]
+        bands = [int(band) for band in args.bands.replace("，", ",").split(",") if band.strip()]
+        pyramid_factors = parse_pyramid_factors(args.pyramid)
+        output_stems = cli_output_stems(args.inputs)
+        bbox = parse_bbox(args.bbox)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.stream and args.format not in CHUNK_OUTPUT_FORMATS:
+        parser.error("分块写出仅支持parquet和fgb格式")
+    if args.crs_mode == "custom" and not args.crs:
+        parser.error("crs-mode为custom时需用--crs指定坐标系")
+    if not args.grid_size and not args.zones:
+        parser.error("需用-s指定网格大小，或用--zones指定分区文件")
+
+    options = {
+        "units": args.units,
+        "stat_methods": stat_methods,
+        "bands": bands,
+        "keep_original_attributes": args.keep_attributes,
+        "memory_limit_mb": args.memory_limit,
+        "n_workers": args.workers,
+        "weighted": args.weighted,
+        "stream": args.stream,
+        "output_format": args.format,
+        "output_dir": args.output_dir,
+        "grid_type": args.grid_type,
+        "crs_mode": args.crs_mode,
+        "custom_crs": args.crs,
+        "pyramid_factors": pyramid_factors,
+        "columns": (None if args.columns is None else
+                    [col.strip() for col in args.columns.replace("，", ",").split(",") if col.strip()]),
+        "bbox": bbox,
+        "cache_dir": args.cache_dir,
+        "cache_mb": args.cache_mb,
+        "zones": args.zones,
+        "checkpoint_dir": args.checkpoint_dir,
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # 命令行模式下没有图形界面线程，可以使用fork启动子进程，避免子进程重新执行本文件
+    if "fork" in multiprocessing.get_all_start_methods():
+        MP_START_METHOD = "fork"
+
+    start = time.perf_counter()
+    failed = 0
+
+    def report(input_path, results=None, error=None):
+        nonlocal failed
+        if error is not None:
+            failed += 1
+            cli_print(f"失败: {input_path}: {error}", sys.stderr)
+            return
+        for grid_size, outputs, n_cells, seconds in results:
+            if grid_size is None:
+                task, cells = "分区统计", "" if n_cells is None else f"{n_cells} 个分区，"
+            else:
+                task, cells = f"网格大小 {grid_size:g} {args.units}", "" if n_cells is None else f"{n_cells} 个有效网格，"
+            cli_print(f"完成: {input_path} {task}，{cells}耗时 {seconds:.1f} 秒 -> {', '.join(outputs)}")
+
+    if args.jobs > 1 and len(args.inputs) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs,
+                                 mp_context=multiprocessing.get_context(MP_START_METHOD)) as executor:
+            futures = {executor.submit(_cli_job, path, stem, args.grid_size, options): path
+                       for path, stem in zip(args.inputs, output_stems)}
+            for future in as_completed(futures):
+                try:
+                    report(futures[future], future.result())
+                except Exception as e:
+                    report(futures[future], error=e)
+    else:
+        for path, stem in zip(args.inputs, output_stems):
+            try:
+                report(path, _cli_job(path, stem, args.grid_size, options))
+            except Exception as e:
+                report(path, error=e)
+
+    cli_print(f"共处理 {len(args.inputs)} 个文件，失败 {failed} 个，总耗时 {time.perf_counter() - start:.1f} 秒")
+    return 1 if failed else 0
+
+
+# 性能基准：在合成数据上无界面运行网格划分，记录耗时、峰值内存和处理速度
+
+# 基准规模：(点要素数, 栅格边长像素数)
+BENCHMARK_SCALES = {"small": (20_000, 1000), "medium": (200_000, 4000), "large": (2_000_000, 12000)}
+
+# 合成数据的范围（米）、坐标系和栅格像元大小
+BENCHMARK_EXTENT = (4_000_000.0, 3_000_000.0, 4_100_000.0, 3_100_000.0)
+BENCHMARK_CRS = "EPSG:3035"
+BENCHMARK_PIXEL_SIZE = 30.0
+
+
+def benchmark_cases(scale="medium"):
+    """按规模生成基准用例列表，每个用例为参数字典，name唯一标识用例及其规模"""
+    n_points, raster_size = BENCHMARK_SCALES[scale]
+    cases = []
+    for grid_size in (1000, 100):
+        cases.append({"kind": "points", "n_features": n_points, "grid_size": grid_size})
+    cases.append({"kind": "points", "n_features": n_points, "grid_size": 1000, "grid_type": "hexagon"})
+    cases.append({"kind": "polygons", "n_features": n_points // 10, "grid_size": 1000, "weighted": True})
+    for grid_size in (BENCHMARK_PIXEL_SIZE * 10, BENCHMARK_PIXEL_SIZE * 100):
+        cases.append({"kind": "raster", "raster_size": raster_size, "grid_size": grid_size, "in_memory": False})
+    cases.append({"kind": "raster", "raster_size": raster_size, "grid_size": BENCHMARK_PIXEL_SIZE * 10,
+                  "in_memory": True})
+    cases.append({"kind": "raster", "raster_size": raster_size, "grid_size": BENCHMARK_PIXEL_SIZE * 10,
+                  "in_memory": False, "grid_type": "hexagon"})
+
+    for case in cases:
+        case.setdefault("grid_type", "square")
+        case.setdefault("weighted", False)
+        size = f"{case['n_features']}" if case["kind"] != "raster" else f"{case['raster_size']}px"
+        suffix = ("_weighted" if case["weighted"] else "") + ("_memory" if case.get("in_memory") else "")
+        case["name"] = f"{case['kind']}_{case['grid_type']}_{size}_{case['grid_size']:g}m{suffix}"
+    return cases
+
+
+def synthetic_vector(kind, n_features, seed=0):
+    """生成合成矢量数据：一半均匀分布、一半聚集分布的点，或边长50~500米的正方形面"""
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = BENCHMARK_EXTENT
+    n_uniform = n_features // 2
+    centers = rng.uniform((minx, miny), (maxx, maxy), (20, 2))
+    clustered = centers[rng.integers(0, 20, n_features - n_uniform)] + rng.normal(0, 3000, (n_features - n_uniform, 2))
+    xy = np.clip(np.vstack([rng.uniform((minx, miny), (maxx, maxy), (n_uniform, 2)), clustered]),
+                 (minx, miny), (maxx - 500, maxy - 500))
+    if kind == "points":
+        geometries = shapely.points(xy)
+    else:
+        side = rng.uniform(50, 500, n_features)
+        geometries = shapely.box(xy[:, 0], xy[:, 1], xy[:, 0] + side, xy[:, 1] + side)
+    return gpd.GeoDataFrame({"value": rng.normal(100, 20, n_features)}, geometry=geometries, crs=BENCHMARK_CRS)
+
+
+def synthetic_raster(path, size, seed=0):
+    """按行条带写出size×size的分块GeoTIFF合成栅格，约1%为NoData，写出过程内存占用与栅格大小无关"""
+    rng = np.random.default_rng(seed)
+    transform = rasterio.transform.from_origin(BENCHMARK_EXTENT[0], BENCHMARK_EXTENT[3],
+                                               BENCHMARK_PIXEL_SIZE, BENCHMARK_PIXEL_SIZE)
+    profile = {"driver": "GTiff", "width": size, "height": size, "count": 1, "dtype": "float32",
+               "crs": BENCHMARK_CRS, "transform": transform, "nodata": -9999.0,
+               "tiled": True, "blockxsize": 256, "blockysize": 256}
+    with rasterio.open(path, "w", **profile) as dst:
+        for r0 in range(0, size, 1024):
+            rows = min(1024, size - r0)
+            data = rng.normal(100, 20, (rows, size)).astype(np.float32)
+            data[rng.random((rows, size)) < 0.01] = -9999.0
+            dst.write(data, 1, window=Window(0, r0, size, rows))
+
+
+def peak_rss_mb():
+    """本进程及已结束子进程的峰值常驻内存（MB）"""
+    import resource
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # macOS以字节计，Linux以KB计
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / scale
+
+
+def _benchmark_task(case, raster_path, n_workers, memory_limit_mb):
+    """进程池任务：在新进程中准备数据并运行一次网格划分，只对GridJob.run计时"""
+    if case["kind"] == "raster":
+        data_type = "raster"
+        with rasterio.open(raster_path) as src:
+            data = (src.read() if case["in_memory"] else None, src.meta.copy())
+    else:
+        data_type = "vector"
+        data = synthetic_vector(case["kind"], case["n_features"])
+
+    job = GridJob(
+        data, data_type, case["grid_size"], "米", "mean", 1, False, raster_path,
+        memory_limit_mb, n_workers, case["weighted"], grid_type=case["grid_type"], crs_mode="native"
+    )
+    start = time.perf_counter()
+    grid = job.run()
+    seconds = time.perf_counter() - start
+    cells = int(grid.rows) * int(grid.cols)
+    inputs = case["raster_size"] ** 2 if data_type == "raster" else case["n_features"]
+    return {"seconds": seconds, "cells": cells, "valid_cells": len(grid),
+            "cells_per_second": cells / seconds if seconds > 0 else float("inf"),
+            "inputs_per_second": inputs / seconds if seconds > 0 else float("inf"),
+            "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def run_benchmark_case(case, raster_path, n_workers=1, memory_limit_mb=1024, repeat=1):
+    """在单独的进程中运行用例repeat次（每次一个新进程，峰值内存互不影响），返回耗时最短的一次"""
+    runs = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=multiprocessing.get_context(MP_START_METHOD)) as executor:
+            runs.append(executor.submit(_benchmark_task, case, raster_path, n_workers, memory_limit_mb).result())
+    return min(runs, key=lambda run: run["seconds"])
+
+
+def git_revision(path):
+    """返回文件所在git仓库的当前提交，不在仓库中或未安装git时返回None"""
+    import subprocess
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(path)),
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.stdout.strip() or None
+
+
+def load_benchmark_history(path):
+    """读取基准历史记录（每次运行一项的列表），文件不存在时返回空列表"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def previous_benchmark_result(history, name):
+    """历史记录中同名用例最近一次的结果，没有时返回None"""
+    for run in reversed(history):
+        for result in run["cases"]:
+            if result["name"] == name:
+                return result
+    return None
+
+
+def benchmark_main(argv):
+    """基准子命令入口：逐个运行用例、输出结果并追加到JSON历史记录，返回退出码
+
+    每个用例在新进程中运行，记录GridJob.run的耗时、进程峰值内存、每秒网格单元数和每秒输入要素（像素）数，
+    并与历史记录中同名用例的上一次结果比较。
+    """
+    import argparse
+    import platform
+    import shutil
+    global MP_START_METHOD
+
+    parser = argparse.ArgumentParser(
+        prog="GIS矢量数据网格划分工具.py benchmark",
+        description="在合成数据上运行矢量、栅格网格划分基准，记录耗时、峰值内存和每秒处理网格数。"
+    )
+    parser.add_argument("--scale", choices=list(BENCHMARK_SCALES), default="medium", help="数据规模（默认: medium）")
+    parser.add_argument("--cases", default="", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--history", default="grid_benchmark_history.json",
+                        help="历史记录文件（默认: grid_benchmark_history.json）")
+    parser.add_argument("--repeat", type=int, default=1, help="每个用例运行次数，取最快一次（默认: 1）")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="每个用例的并行进程数（默认: 1）")
+    parser.add_argument("--memory-limit", type=int, default=1024, help="栅格流式处理的内存上限，单位MB（默认: 1024）")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="耗时比上次同名用例增加超过该比例时视为变慢（默认: 0.2）")
+    parser.add_argument("--fail-on-regression", action="store_true", help="有用例变慢时以退出码1结束")
+    args = parser.parse_args(argv)
+
+    cases = [case for case in benchmark_cases(args.scale) if args.cases in case["name"]]
+    if not cases:
+        parser.error(f"没有名称包含 {args.cases} 的用例")
+    if "fork" in multiprocessing.get_all_start_methods():
+        MP_START_METHOD = "fork"
+
+    history = load_benchmark_history(args.history)
+    run = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(__file__),
+        "scale": args.scale,
+        "workers": args.workers,
+        "memory_limit_mb": args.memory_limit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "shapely": shapely.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "cases": [],
+    }
+
+    regressions = []
+    data_dir = tempfile.mkdtemp(prefix="grid_benchmark_")
+    try:
+        for case in cases:
+            raster_path = None
+            if case["kind"] == "raster":
+                raster_path = os.path.join(data_dir, f"raster_{case['raster_size']}.tif")
+                if not os.path.exists(raster_path):
+                    synthetic_raster(raster_path, case["raster_size"])
+            result = {**case, **run_benchmark_case(case, raster_path, args.workers, args.memory_limit, args.repeat)}
+            result["workers"] = args.workers
+            run["cases"].append(result)
+
+            change = ""
+            previous = previous_benchmark_result(history, case["name"])
+            if previous is not None and previous.get("workers", 1) == args.workers:
+                ratio = result["seconds"] / previous["seconds"] - 1
+                change = f"，较上次 {ratio:+.1%}"
+                if ratio > args.threshold:
+                    change += "（变慢）"
+                    regressions.append(case["name"])
+            unit = "像素" if case["kind"] == "raster" else "要素"
+            cli_print(f"{case['name']}: {result['seconds']:.2f} 秒，{result['cells_per_second']:,.0f} 单元/秒，"
+                      f"{result['inputs_per_second']:,.0f} {unit}/秒，峰值内存 {result['peak_rss_mb']:.0f} MB{change}")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    # 先写临时文件再替换，中断时不会损坏已有的历史记录
+    history.append(run)
+    temp_path = f"{args.history}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(history, f, ensure_ascii=False, indent=1)
+    os.replace(temp_path, args.history)
+    cli_print(f"结果已追加到: {args.history}")
+
+    if regressions:
+        cli_print(f"变慢超过 {args.threshold:.0%} 的用例: {', '.join(regressions)}", sys.stderr)
+        return 1 if args.fail_on_regression else 0
+    return 0
+
+
+# 带参数运行时为命令行模式，在导入图形界面相关模块之前执行并退出
+if __name__ == "__main__" and len(sys.argv) > 1:
+    sys.exit(cli_main(sys.argv[1:]))
+
+
+# 以下为图形界面部分
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 from matplotlib.patches import Arrow
+from matplotlib.collections import PolyCollection
 from matplotlib import cm
 import matplotlib.colors as mcolors
 from matplotlib import font_manager as fm
@@ -34,18 +2885,10 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QH
                              QComboBox, QCheckBox, QDoubleSpinBox, QTabWidget, QDialog,
                              QTableWidget, QTableWidgetItem, QHeaderView, QSplitter,
                              QToolBar, QAction, QMenu, QMenuBar, QStatusBar, QToolButton,
-                             QDialogButtonBox, QLineEdit, QListWidget, QListView, QGridLayout)
+                             QDialogButtonBox, QLineEdit, QListWidget, QListWidgetItem, QListView, QGridLayout)
 from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSize, QSettings
 from PyQt5.QtGui import QFont, QColor, QPalette, QIcon, QPixmap, QPainter
 
-# Unicode符号定义
-RED_LIGHT = "🔴"
-BLUE_LIGHT = "🔵"
-GREEN_LIGHT = "🟢"
-
-# 应用设置
-APP_NAME = "ProfessionalGISGridTool"
-ORG_NAME = "GeoDataLab"
 
 class DataInfoDialog(QDialog):
     """数据显示信息对话框"""
@@ -105,6 +2948,52 @@ class FieldSelectionDialog(QDialog):
             return self.field_list.currentItem().text()
         return None
 
+def draw_grid(ax, grid, value_column=None, cmap=None, norm=None, max_cells=None):
+    """绘制网格数据（RegularGrid或GeoDataFrame），返回实际绘制的单元数
+
+    正方形网格（RegularGrid）绘制为一幅imshow图像，六边形网格和分区统计结果绘制为一个PolyCollection；
+    单元数超过max_cells时分别按块平均或等间隔抽稀。
+    """
+    if value_column:
+        values = grid[value_column].to_numpy(dtype=np.float64)
+    else:
+        # 没有数值字段时使用单一颜色
+        values = np.ones(len(grid))
+        cmap = mcolors.ListedColormap(['lightblue'])
+        norm = mcolors.Normalize(vmin=0, vmax=2)
+
+    # 隐式网格由行列号直接排布为图像（超过max_cells时按块平均抽稀），无需生成多边形
+    grid_image = grid.to_image(values, max_cells or 100_000_000) if isinstance(grid, RegularGrid) else None
+    if grid_image is not None:
+        image, extent = grid_image
+        ax.imshow(np.ma.masked_invalid(image), extent=extent, cmap=cmap, norm=norm,
+                  alpha=0.7, interpolation='nearest', origin='upper')
+        return int(np.count_nonzero(~np.isnan(image)))
+
+    index = slice(None)
+    if max_cells and len(grid) > max_cells:
+        # 等间隔抽稀
+        index = slice(None, None, int(np.ceil(len(grid) / max_cells)))
+        values = values[index]
+    geoms = grid.polygons(index) if isinstance(grid, RegularGrid) else grid.geometry.values[index]
+    n_drawn = len(geoms)
+    if not isinstance(grid, RegularGrid):
+        # 分区等多部分多边形拆分为单个多边形，各部分使用所属要素的值
+        geoms, part_index = shapely.get_parts(np.asarray(geoms), return_index=True)
+        values = values[part_index]
+
+    # 一次性取出所有外环坐标构建PolyCollection
+    coords, index = shapely.get_coordinates(shapely.get_exterior_ring(geoms), return_index=True)
+    split_at = np.flatnonzero(np.diff(index)) + 1
+    collection = PolyCollection(
+        np.split(coords, split_at), array=values, cmap=cmap, norm=norm,
+        edgecolor='black' if len(geoms) <= 5000 else 'none', linewidth=0.5, alpha=0.7
+    )
+    ax.add_collection(collection)
+    ax.autoscale_view()
+    return n_drawn
+
+
 class PreviewCanvas(FigureCanvas):
     """预览画布类"""
     def __init__(self, parent=None, width=5, height=4, dpi=100):
@@ -175,220 +3064,36 @@ class PreviewCanvas(FigureCanvas):
         self.ax.grid(True, alpha=0.3)
 
 class GridWorker(QThread):
-    """后台工作线程，用于网格划分操作"""
+    """后台工作线程，在线程中执行GridJob，日志、进度和结果转发为Qt信号"""
     progress_updated = pyqtSignal(int)
+    rate_updated = pyqtSignal(float, float)  # 每秒处理的网格数, 预计剩余秒数
     message_emitted = pyqtSignal(str)
     finished = pyqtSignal(object)
     error_occurred = pyqtSignal(str)
+    cancelled = pyqtSignal()
 
-    def __init__(self, data, data_type, grid_size, grid_units, stat_method="mean", band_index=1, keep_original_attributes=True):
+    def __init__(self, *args, **kwargs):
         super().__init__()
-        self.data = data
-        self.data_type = data_type  # "vector" 或 "raster"
-        self.grid_size = grid_size
-        self.grid_units = grid_units
-        self.stat_method = stat_method
-        self.band_index = band_index
-        self.keep_original_attributes = keep_original_attributes
+        self.job = GridJob(*args, message_callback=self.message_emitted.emit,
+                           progress_callback=self.report_progress, **kwargs)
+
+    def report_progress(self, percent, cells_per_second, eta_seconds):
+        """节流后的进度回调，转发为Qt信号"""
+        self.progress_updated.emit(percent)
+        self.rate_updated.emit(cells_per_second, eta_seconds)
+
+    def cancel(self):
+        """请求停止，任务在下一个行带或窗口条带边界处结束"""
+        self.job.cancel()
 
     def run(self):
         try:
-            if self.data_type == "vector":
-                self.process_vector()
-            elif self.data_type == "raster":
-                self.process_raster()
-            else:
-                self.error_occurred.emit(f"未知的数据类型: {self.data_type}")
-                
+            self.finished.emit(self.job.run())
+        except JobCancelled:
+            self.cancelled.emit()
         except Exception as e:
             self.error_occurred.emit(str(e))
 
-    def process_vector(self):
-        """处理矢量数据"""
-        self.message_emitted.emit("开始矢量数据网格划分...")
-        gdf = self.data
-        
-        # 获取数据边界
-        total_bounds = gdf.total_bounds
-        minx, miny, maxx, maxy = total_bounds
-        
-        self.message_emitted.emit(f"数据边界: X({minx:.2f}~{maxx:.2f}), Y({miny:.2f}~{maxy:.2f})")
-        
-        # 计算网格行列数
-        cols = int(np.ceil((maxx - minx) / self.grid_size))
-        rows = int(np.ceil((maxy - miny) / self.grid_size))
-        
-        self.message_emitted.emit(f"将生成 {rows} 行 x {cols} 列的网格，共 {rows * cols} 个单元")
-        
-        # 创建网格
-        grid_polygons = []
-        attributes = []
-        
-        total_cells = rows * cols
-        processed = 0
-        
-        for i in range(rows):
-            for j in range(cols):
-                # 计算当前网格的边界
-                x1 = minx + j * self.grid_size
-                x2 = minx + (j + 1) * self.grid_size
-                y1 = miny + i * self.grid_size
-                y2 = miny + (i + 1) * self.grid_size
-                
-                # 创建网格多边形
-                grid_cell = box(x1, y1, x2, y2)
-                
-                # 查找与当前网格相交的原始要素
-                intersecting_features = gdf[gdf.intersects(grid_cell)]
-                
-                if not intersecting_features.empty:
-                    # 计算每个字段的统计值
-                    attr_dict = {}
-                    
-                    if self.keep_original_attributes:
-                        # 保留原始属性
-                        for col in gdf.columns:
-                            if col != 'geometry':
-                                try:
-                                    # 对于每个字段，使用第一个相交要素的值
-                                    attr_dict[col] = intersecting_features[col].iloc[0]
-                                except:
-                                    attr_dict[col] = None
-                    else:
-                        # 计算统计值
-                        for col in gdf.columns:
-                            if col != 'geometry' and col != 'id':
-                                try:
-                                    # 尝试计算数值字段的统计值
-                                    if intersecting_features[col].dtype in [np.int64, np.float64]:
-                                        if self.stat_method == "mean":
-                                            attr_dict[col] = intersecting_features[col].mean()
-                                        elif self.stat_method == "sum":
-                                            attr_dict[col] = intersecting_features[col].sum()
-                                        elif self.stat_method == "max":
-                                            attr_dict[col] = intersecting_features[col].max()
-                                        elif self.stat_method == "min":
-                                            attr_dict[col] = intersecting_features[col].min()
-                                        elif self.stat_method == "count":
-                                            attr_dict[col] = intersecting_features[col].count()
-                                        elif self.stat_method == "std":
-                                            attr_dict[col] = intersecting_features[col].std()
-                                        elif self.stat_method == "median":
-                                            attr_dict[col] = intersecting_features[col].median()
-                                    else:
-                                        # 对于非数值字段，使用第一个相交要素的值
-                                        attr_dict[col] = intersecting_features[col].iloc[0]
-                                except:
-                                    attr_dict[col] = None
-                    
-                    grid_polygons.append(grid_cell)
-                    attributes.append(attr_dict)
-                
-                processed += 1
-                progress = int(processed / total_cells * 100)
-                self.progress_updated.emit(progress)
-        
-        # 创建网格GeoDataFrame
-        grid_gdf = gpd.GeoDataFrame(attributes, geometry=grid_polygons, crs=gdf.crs)
-        
-        self.message_emitted.emit(f"矢量数据网格划分完成，共生成 {len(grid_gdf)} 个有效网格")
-        self.finished.emit(grid_gdf)
-
-    def process_raster(self):
-        """处理栅格数据"""
-        self.message_emitted.emit("开始栅格数据网格划分...")
-        raster_data, raster_meta = self.data
-        
-        # 获取数据边界
-        transform = raster_meta['transform']
-        width = raster_meta['width']
-        height = raster_meta['height']
-        
-        minx = transform[2]
-        maxy = transform[5]
-        maxx = minx + width * transform[0]
-        miny = maxy + height * transform[4]
-        
-        self.message_emitted.emit(f"数据边界: X({minx:.2f}~{maxx:.2f}), Y({miny:.2f}~{maxy:.2f})")
-        
-        # 计算网格行列数
-        cols = int(np.ceil((maxx - minx) / self.grid_size))
-        rows = int(np.ceil((maxy - miny) / self.grid_size))
-        
-        self.message_emitted.emit(f"将生成 {rows} 行 x {cols} 列的网格，共 {rows * cols} 个单元")
-        
-        # 创建网格
-        grid_polygons = []
-        attributes = []
-        
-        total_cells = rows * cols
-        processed = 0
-        
-        for i in range(rows):
-            for j in range(cols):
-                # 计算当前网格的边界
-                x1 = minx + j * self.grid_size
-                x2 = minx + (j + 1) * self.grid_size
-                y1 = miny + i * self.grid_size
-                y2 = miny + (i + 1) * self.grid_size
-                
-                # 创建网格多边形
-                grid_cell = box(x1, y1, x2, y2)
-                
-                # 计算网格内的像素值统计
-                # 首先找到网格覆盖的像素范围
-                col_start = int((x1 - minx) / transform[0])
-                col_end = int((x2 - minx) / transform[0])
-                row_start = int((y1 - maxy) / transform[4])  # transform[4]是负值
-                row_end = int((y2 - maxy) / transform[4])
-                
-                # 确保不超出图像范围
-                col_start = max(0, min(col_start, width))
-                col_end = max(0, min(col_end, width))
-                row_start = max(0, min(row_start, height))
-                row_end = max(0, min(row_end, height))
-                
-                if col_end > col_start and row_end > row_start:
-                    # 提取网格内的像素值
-                    cell_values = raster_data[row_start:row_end, col_start:col_end]
-                    
-                    # 计算统计值（忽略NaN值）
-                    if cell_values.size > 0:
-                        valid_values = cell_values[~np.isnan(cell_values)]
-                        
-                        if valid_values.size > 0:
-                            if self.stat_method == "mean":
-                                stat_value = np.mean(valid_values)
-                            elif self.stat_method == "sum":
-                                stat_value = np.sum(valid_values)
-                            elif self.stat_method == "max":
-                                stat_value = np.max(valid_values)
-                            elif self.stat_method == "min":
-                                stat_value = np.min(valid_values)
-                            elif self.stat_method == "count":
-                                stat_value = valid_values.size
-                            elif self.stat_method == "std":
-                                stat_value = np.std(valid_values)
-                            elif self.stat_method == "median":
-                                stat_value = np.median(valid_values)
-                            
-                            attr_dict = {"value": stat_value}
-                            grid_polygons.append(grid_cell)
-                            attributes.append(attr_dict)
-                
-                processed += 1
-                progress = int(processed / total_cells * 100)
-                self.progress_updated.emit(progress)
-        
-        # 创建网格GeoDataFrame
-        grid_gdf = gpd.GeoDataFrame(attributes, geometry=grid_polygons)
-        # 设置CRS（如果栅格数据有CRS信息）
-        if raster_meta.get('crs'):
-            grid_gdf.crs = raster_meta['crs']
-        
-        self.message_emitted.emit(f"栅格数据网格划分完成，共生成 {len(grid_gdf)} 个有效网格")
-        self.finished.emit(grid_gdf)
-
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -398,10 +3103,18 @@ class MainWindow(QMainWindow):
         
         # 初始化变量
         self.input_data = None
+        self.input_path = None
         self.data_type = None  # "vector" 或 "raster"
-        self.output_gdf = None
+        self.output_grid = None
+        self.pyramid_grids = None  # 金字塔模式下的各级网格
+        self.input_bbox = None  # 矢量数据导入时的范围过滤
+        self.vector_fids = None  # 导入的矢量要素FID，用于按需读取属性字段时对齐
+        self.vector_attributes = {}  # 已读取的属性字段
         self.selected_field = None  # 用户选择的出图字段
         self.settings = QSettings(ORG_NAME, APP_NAME)
+        self.reprojection_cache = ReprojectionCache()  # 按(文件, 坐标系)缓存重投影结果
+        self.overview_cache = OverviewCache()  # 栅格预览概览
+        self.worker = None
         
         # 设置应用样式
         self.setup_style()
@@ -487,6 +3200,15 @@ class MainWindow(QMainWindow):
         type_layout.addStretch()
         input_layout.addLayout(type_layout)
         
+        # 范围过滤（仅对矢量数据有效，只读取与该范围相交的要素）
+        bbox_layout = QHBoxLayout()
+        bbox_layout.addWidget(QLabel("范围过滤:"))
+        
+        self.import_bbox = QLineEdit()
+        self.import_bbox.setPlaceholderText("minx,miny,maxx,maxy（可选，数据坐标系）")
+        bbox_layout.addWidget(self.import_bbox)
+        input_layout.addLayout(bbox_layout)
+        
         self.import_btn = QPushButton("导入数据文件")
         self.import_btn.clicked.connect(self.import_data)
         self.import_btn.setIcon(self.style().standardIcon(getattr(self.style(), 'SP_DialogOpenButton')))
@@ -503,6 +3225,26 @@ class MainWindow(QMainWindow):
         self.file_info.setStyleSheet("background-color: #252525; padding: 5px; border: 1px solid #555;")
         input_layout.addWidget(self.file_info)
         
+        # 属性字段（仅对矢量数据有效，处理时只读取勾选的字段）
+        input_layout.addWidget(QLabel("属性字段:"))
+        
+        self.field_list = QListWidget()
+        self.field_list.setMaximumHeight(100)
+        input_layout.addWidget(self.field_list)
+        
+        # 分区文件（仅对栅格数据有效，给出时按多边形分区统计而不划分网格）
+        zones_layout = QHBoxLayout()
+        zones_layout.addWidget(QLabel("分区文件:"))
+        
+        self.zones_path = QLineEdit()
+        self.zones_path.setPlaceholderText("可选，如流域、保护区多边形")
+        zones_layout.addWidget(self.zones_path)
+        
+        zones_btn = QPushButton("浏览")
+        zones_btn.clicked.connect(self.select_zones_file)
+        zones_layout.addWidget(zones_btn)
+        input_layout.addLayout(zones_layout)
+        
         left_layout.addWidget(input_group)
         
         # 创建网格设置组
@@ -524,7 +3266,32 @@ class MainWindow(QMainWindow):
         self.grid_units.addItems(["米", "千米", "度"])
         size_layout.addWidget(self.grid_units, 0, 2)
         
-        size_layout.addWidget(QLabel("统计方法:"), 1, 0)
+        # 网格形状（六边形网格面积与同样大小的正方形网格相同）
+        size_layout.addWidget(QLabel("网格形状:"), 1, 0)
+        
+        self.grid_type = QComboBox()
+        self.grid_type.addItem("正方形", "square")
+        self.grid_type.addItem("六边形（等面积）", "hexagon")
+        size_layout.addWidget(self.grid_type, 1, 1, 1, 2)
+        
+        # 网格坐标系（以米为单位时，地理坐标系数据重投影到等面积投影后再划分）
+        size_layout.addWidget(QLabel("网格坐标系:"), 2, 0)
+        
+        self.crs_mode = QComboBox()
+        self.crs_mode.addItem("自动（地理坐标系转等面积投影）", "auto")
+        self.crs_mode.addItem("数据原坐标系", "native")
+        self.crs_mode.addItem("等面积投影", "equal_area")
+        self.crs_mode.addItem("自定义", "custom")
+        size_layout.addWidget(self.crs_mode, 2, 1)
+        
+        self.custom_crs = QLineEdit()
+        self.custom_crs.setPlaceholderText("如 EPSG:3035")
+        self.custom_crs.setEnabled(False)
+        self.crs_mode.currentIndexChanged.connect(
+            lambda: self.custom_crs.setEnabled(self.crs_mode.currentData() == "custom"))
+        size_layout.addWidget(self.custom_crs, 2, 2)
+        
+        size_layout.addWidget(QLabel("统计方法:"), 3, 0)
         
         self.stat_method = QComboBox()
         self.stat_method.addItem("平均值", "mean")
@@ -534,27 +3301,99 @@ class MainWindow(QMainWindow):
         self.stat_method.addItem("计数", "count")
         self.stat_method.addItem("标准差", "std")
         self.stat_method.addItem("中位数", "median")
-        size_layout.addWidget(self.stat_method, 1, 1, 1, 2)
+        size_layout.addWidget(self.stat_method, 3, 1, 1, 2)
+        
+        # 附加统计量（仅对栅格数据有效，与主统计方法一次计算）
+        size_layout.addWidget(QLabel("附加统计:"), 4, 0)
+        
+        self.extra_stats = QLineEdit()
+        self.extra_stats.setPlaceholderText("如 std,count,p10,p90")
+        size_layout.addWidget(self.extra_stats, 4, 1, 1, 2)
+        
+        # 波段选择（仅对栅格数据有效，可勾选多个波段）
+        size_layout.addWidget(QLabel("波段:"), 5, 0)
+        
+        self.band_list = QListWidget()
+        self.band_list.setMaximumHeight(80)
+        self.set_band_items(1)
+        size_layout.addWidget(self.band_list, 5, 1, 1, 2)
+        
+        # 内存上限（超过该大小的栅格不整体载入，按窗口流式处理）
+        size_layout.addWidget(QLabel("内存上限:"), 6, 0)
+        
+        self.memory_limit = QSpinBox()
+        self.memory_limit.setRange(64, 262144)
+        self.memory_limit.setValue(1024)
+        self.memory_limit.setSuffix(" MB")
+        size_layout.addWidget(self.memory_limit, 6, 1, 1, 2)
+        
+        # 并行进程数（1为单进程）
+        size_layout.addWidget(QLabel("并行进程:"), 7, 0)
+        
+        self.n_workers = QSpinBox()
+        self.n_workers.setRange(1, os.cpu_count() or 1)
+        self.n_workers.setValue(1)
+        size_layout.addWidget(self.n_workers, 7, 1, 1, 2)
+        
+        # 矢量聚合方式（仅对矢量数据有效）
+        size_layout.addWidget(QLabel("矢量聚合:"), 8, 0)
+        
+        self.aggregation_mode = QComboBox()
+        self.aggregation_mode.addItem("相交要素（不加权）", "intersects")
+        self.aggregation_mode.addItem("面积/长度加权", "weighted")
+        size_layout.addWidget(self.aggregation_mode, 8, 1, 1, 2)
+        
+        # 金字塔倍数（各级网格大小为网格大小的整数倍，为空时只按网格大小划分）
+        size_layout.addWidget(QLabel("金字塔倍数:"), 9, 0)
         
-        # 波段选择（仅对栅格数据有效）
-        size_layout.addWidget(QLabel("波段:"), 2, 0)
+        self.pyramid_factors = QLineEdit()
+        self.pyramid_factors.setPlaceholderText("如 1,2,5,10,20")
+        size_layout.addWidget(self.pyramid_factors, 9, 1, 1, 2)
         
-        self.band_combo = QComboBox()
-        self.band_combo.addItem("波段 1", 1)
-        size_layout.addWidget(self.band_combo, 2, 1, 1, 2)
+        # 网格预览上限（超过时预览抽稀显示）
+        size_layout.addWidget(QLabel("预览上限:"), 10, 0)
+        
+        self.preview_limit = QSpinBox()
+        self.preview_limit.setRange(1000, 10000000)
+        self.preview_limit.setSingleStep(10000)
+        self.preview_limit.setValue(200000)
+        self.preview_limit.setSuffix(" 单元")
+        size_layout.addWidget(self.preview_limit, 10, 1, 1, 2)
+        
+        # 结果缓存上限（输入文件和参数未变化时直接读取上次的结果，0为不缓存）
+        size_layout.addWidget(QLabel("结果缓存:"), 11, 0)
+        
+        self.result_cache_limit = QSpinBox()
+        self.result_cache_limit.setRange(0, 1048576)
+        self.result_cache_limit.setSingleStep(256)
+        self.result_cache_limit.setValue(1024)
+        self.result_cache_limit.setSuffix(" MB")
+        size_layout.addWidget(self.result_cache_limit, 11, 1, 1, 2)
         
         # 属性保留选项
         self.keep_attrs_check = QCheckBox("保留原始属性")
         self.keep_attrs_check.setChecked(True)
-        size_layout.addWidget(self.keep_attrs_check, 3, 0, 1, 3)
+        size_layout.addWidget(self.keep_attrs_check, 12, 0, 1, 3)
+        
+        # 行带检查点（中断或停止后再次执行相同的划分时跳过已完成的行带）
+        self.checkpoint_check = QCheckBox("保存行带检查点（中断后可继续）")
+        size_layout.addWidget(self.checkpoint_check, 13, 0, 1, 3)
         
         grid_layout.addLayout(size_layout)
         
+        process_layout = QHBoxLayout()
         self.process_btn = QPushButton("执行网格划分")
         self.process_btn.clicked.connect(self.process_data)
         self.process_btn.setEnabled(False)
         self.process_btn.setIcon(self.style().standardIcon(getattr(self.style(), 'SP_MediaPlay')))
-        grid_layout.addWidget(self.process_btn)
+        process_layout.addWidget(self.process_btn)
+        
+        self.cancel_btn = QPushButton("停止")
+        self.cancel_btn.clicked.connect(self.cancel_processing)
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.setIcon(self.style().standardIcon(getattr(self.style(), 'SP_MediaStop')))
+        process_layout.addWidget(self.cancel_btn)
+        grid_layout.addLayout(process_layout)
         
         left_layout.addWidget(grid_group)
         
@@ -570,11 +3409,18 @@ class MainWindow(QMainWindow):
         self.output_format.addItem("ESRI Shapefile", "shp")
         self.output_format.addItem("GeoJSON", "geojson")
         self.output_format.addItem("KML", "kml")
+        self.output_format.addItem("GeoParquet", "parquet")
+        self.output_format.addItem("FlatGeobuf", "fgb")
         format_layout.addWidget(self.output_format)
         
         format_layout.addStretch()
         output_layout.addLayout(format_layout)
         
+        # 分块写出：处理过程中直接把网格按块写入GeoParquet/FlatGeobuf文件，不在内存中汇总
+        self.stream_output_check = QCheckBox("处理时直接分块写出（仅GeoParquet/FlatGeobuf）")
+        self.stream_output_check.setToolTip("适用于超大网格：结果边生成边写盘，处理完成后不再预览")
+        output_layout.addWidget(self.stream_output_check)
+        
         self.export_btn = QPushButton("导出数据")
         self.export_btn.clicked.connect(self.export_data)
         self.export_btn.setEnabled(False)
@@ -612,7 +3458,9 @@ class MainWindow(QMainWindow):
         
         main_layout.addWidget(right_panel, 1)  # 1表示拉伸因子
         
-        # 创建进度条
+        # 创建进度条及处理速度显示
+        self.rate_label = QLabel()
+        self.statusBar().addPermanentWidget(self.rate_label)
         self.progress_bar = QProgressBar()
         self.progress_bar.setVisible(False)
         self.statusBar().addPermanentWidget(self.progress_bar)
@@ -716,39 +3564,148 @@ class MainWindow(QMainWindow):
         
         self.grid_size.setValue(grid_size)
         self.grid_units.setCurrentIndex(grid_units_index)
+        self.grid_type.setCurrentIndex(self.settings.value("grid_type_index", 0, type=int))
+        self.crs_mode.setCurrentIndex(self.settings.value("crs_mode_index", 0, type=int))
+        self.custom_crs.setText(self.settings.value("custom_crs", "", type=str))
         
         # 加载统计方法
         stat_method_index = self.settings.value("stat_method_index", 0, type=int)
         self.stat_method.setCurrentIndex(stat_method_index)
+        self.extra_stats.setText(self.settings.value("extra_stats", "", type=str))
+        self.pyramid_factors.setText(self.settings.value("pyramid_factors", "", type=str))
+        self.result_cache_limit.setValue(self.settings.value("result_cache_mb", 1024, type=int))
+        self.import_bbox.setText(self.settings.value("import_bbox", "", type=str))
+        self.checkpoint_check.setChecked(self.settings.value("checkpoint", False, type=bool))
         
         # 加载输出格式
         output_format_index = self.settings.value("output_format_index", 0, type=int)
         self.output_format.setCurrentIndex(output_format_index)
         
+        # 加载分块写出选项
+        self.stream_output_check.setChecked(self.settings.value("stream_output", False, type=bool))
+        
         # 加载属性保留选项
         keep_attrs = self.settings.value("keep_attrs", True, type=bool)
         self.keep_attrs_check.setChecked(keep_attrs)
         
+        # 加载内存上限
+        memory_limit = self.settings.value("memory_limit_mb", 1024, type=int)
+        self.memory_limit.setValue(memory_limit)
+        
+        # 加载并行进程数
+        n_workers = self.settings.value("n_workers", 1, type=int)
+        self.n_workers.setValue(n_workers)
+        
+        # 加载矢量聚合方式
+        aggregation_index = self.settings.value("aggregation_mode_index", 0, type=int)
+        self.aggregation_mode.setCurrentIndex(aggregation_index)
+        
+        # 加载预览上限
+        preview_limit = self.settings.value("preview_limit", 200000, type=int)
+        self.preview_limit.setValue(preview_limit)
+        
     def save_settings(self):
         """保存应用设置"""
         # 保存网格设置
         self.settings.setValue("grid_size", self.grid_size.value())
         self.settings.setValue("grid_units_index", self.grid_units.currentIndex())
+        self.settings.setValue("grid_type_index", self.grid_type.currentIndex())
+        self.settings.setValue("crs_mode_index", self.crs_mode.currentIndex())
+        self.settings.setValue("custom_crs", self.custom_crs.text())
         
         # 保存统计方法
         self.settings.setValue("stat_method_index", self.stat_method.currentIndex())
+        self.settings.setValue("extra_stats", self.extra_stats.text())
+        self.settings.setValue("pyramid_factors", self.pyramid_factors.text())
+        self.settings.setValue("result_cache_mb", self.result_cache_limit.value())
+        self.settings.setValue("import_bbox", self.import_bbox.text())
+        self.settings.setValue("checkpoint", self.checkpoint_check.isChecked())
         
         # 保存输出格式
         self.settings.setValue("output_format_index", self.output_format.currentIndex())
         
+        # 保存分块写出选项
+        self.settings.setValue("stream_output", self.stream_output_check.isChecked())
+        
         # 保存属性保留选项
         self.settings.setValue("keep_attrs", self.keep_attrs_check.isChecked())
         
+        # 保存内存上限
+        self.settings.setValue("memory_limit_mb", self.memory_limit.value())
+        
+        # 保存并行进程数
+        self.settings.setValue("n_workers", self.n_workers.value())
+        
+        # 保存矢量聚合方式
+        self.settings.setValue("aggregation_mode_index", self.aggregation_mode.currentIndex())
+        
+        # 保存预览上限
+        self.settings.setValue("preview_limit", self.preview_limit.value())
+        
     def closeEvent(self, event):
         """应用关闭事件"""
         self.save_settings()
+        if self.worker is not None and self.worker.isRunning():
+            # 等待当前行带完成后退出，已完成的行带保留在检查点中
+            self.worker.cancel()
+            self.worker.wait()
+        self.reprojection_cache.cleanup()
         event.accept()
         
+    def set_band_items(self, num_bands):
+        """重建可勾选的波段列表，默认勾选第一个波段"""
+        self.band_list.clear()
+        for i in range(1, num_bands + 1):
+            item = QListWidgetItem(f"波段 {i}")
+            item.setData(Qt.UserRole, i)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if i == 1 else Qt.Unchecked)
+            self.band_list.addItem(item)
+    
+    def checked_bands(self):
+        """获取勾选的波段编号列表"""
+        return [self.band_list.item(i).data(Qt.UserRole)
+                for i in range(self.band_list.count())
+                if self.band_list.item(i).checkState() == Qt.Checked]
+    
+    def set_field_items(self, fields):
+        """重建可勾选的属性字段列表，默认全部勾选"""
+        self.field_list.clear()
+        for name, dtype in fields:
+            item = QListWidgetItem(f"{name} ({dtype})")
+            item.setData(Qt.UserRole, name)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked)
+            self.field_list.addItem(item)
+    
+    def checked_fields(self):
+        """获取勾选的属性字段名列表"""
+        return [self.field_list.item(i).data(Qt.UserRole)
+                for i in range(self.field_list.count())
+                if self.field_list.item(i).checkState() == Qt.Checked]
+    
+    def vector_with_fields(self, columns):
+        """为导入的几何附加所需的属性字段，尚未读取的字段只读属性表、按FID对齐后缓存"""
+        missing = [col for col in columns if col not in self.vector_attributes]
+        if missing:
+            self.log_message(f"读取属性字段: {', '.join(missing)}")
+            attributes = read_vector(self.input_path, missing, self.input_bbox, read_geometry=False,
+                                     fids=self.vector_fids).reindex(self.vector_fids)
+            for col in missing:
+                self.vector_attributes[col] = attributes[col].to_numpy()
+        gdf = self.input_data.copy()
+        for col in columns:
+            gdf[col] = self.vector_attributes[col]
+        return gdf
+    
+    def select_zones_file(self):
+        """选择分区统计使用的多边形文件"""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "选择分区文件", "", "矢量文件 (*.shp *.gpkg *.geojson *.fgb *.parquet);;所有文件 (*)"
+        )
+        if file_path:
+            self.zones_path.setText(file_path)
+    
     def import_data(self):
         data_type = self.data_type_combo.currentData()
         
@@ -766,8 +3723,16 @@ class MainWindow(QMainWindow):
                 self.log_message(f"正在导入文件: {file_path}")
                 
                 if data_type == "vector":
-                    self.input_data = gpd.read_file(file_path)
+                    # 只读取几何，属性字段在处理时按勾选按需读取
+                    self.input_bbox = parse_bbox(self.import_bbox.text())
+                    fields = vector_fields(file_path)
+                    geometry = read_vector(file_path, columns=[], bbox=self.input_bbox)
+                    self.vector_fids = geometry.index.to_numpy()
+                    self.vector_attributes = {}
+                    self.input_data = geometry.reset_index(drop=True)
+                    self.input_path = file_path
                     self.data_type = "vector"
+                    self.set_field_items(fields)
                     
                     # 显示文件信息
                     num_features = len(self.input_data)
@@ -776,6 +3741,7 @@ class MainWindow(QMainWindow):
                     
                     info_text = f"已导入矢量数据: {os.path.basename(file_path)}\n"
                     info_text += f"要素数量: {num_features}\n"
+                    info_text += f"属性字段: {len(fields)} 个\n"
                     info_text += f"坐标系统: {crs}\n"
                     info_text += f"数据范围: X({bounds[0]:.2f}~{bounds[2]:.2f}), Y({bounds[1]:.2f}~{bounds[3]:.2f})"
                     
@@ -786,16 +3752,23 @@ class MainWindow(QMainWindow):
                     with rasterio.open(file_path) as src:
                         # 读取所有波段的信息
                         num_bands = src.count
-                        raster_data = src.read(1)  # 默认读取第一个波段
                         raster_meta = src.meta.copy()
+                        
+                        # 全部波段超过内存上限时不整体载入，处理时按窗口流式读取
+                        raster_bytes = src.width * src.height * num_bands * np.dtype(src.dtypes[0]).itemsize
+                        if raster_bytes > self.memory_limit.value() * 1024 * 1024:
+                            raster_data = None
+                            self.log_message(f"栅格大小约 {raster_bytes / 1024 ** 2:.0f} MB，超过内存上限，将采用流式处理")
+                        else:
+                            raster_data = src.read()  # 读取全部波段，形状为(波段, 行, 列)
                     
                     self.input_data = (raster_data, raster_meta)
+                    self.input_path = file_path
                     self.data_type = "raster"
                     
                     # 更新波段选择
-                    self.band_combo.clear()
-                    for i in range(1, num_bands + 1):
-                        self.band_combo.addItem(f"波段 {i}", i)
+                    self.set_band_items(num_bands)
+                    self.set_field_items([])
                     
                     # 显示文件信息
                     transform = raster_meta['transform']
@@ -841,21 +3814,22 @@ class MainWindow(QMainWindow):
             self.original_preview.add_grid(bounds, gdf.crs)
             
         else:  # raster
-            raster_data, raster_meta = self.input_data
-            transform = raster_meta['transform']
+            raster_meta = self.input_data[1]
             
-            # 计算边界
-            minx = transform[2]
-            maxy = transform[5]
-            maxx = minx + raster_meta['width'] * transform[0]
-            miny = maxy + raster_meta['height'] * transform[4]
+            # 按画布大小降采样读取第一个波段：使用文件自带的概览，没有时生成一次概览并缓存
+            if self.overview_cache.needs_build(self.input_path):
+                self.log_message("栅格没有概览，正在生成预览概览（仅首次，之后使用缓存）...")
+            max_size = max(self.original_preview.width(), self.original_preview.height(), 500)
+            raster_data, extent = self.overview_cache.read(self.input_path, 1, max_size)
+            minx, maxx, miny, maxy = extent
             bounds = (minx, miny, maxx, maxy)
             
             # 绘制数据
             im = self.original_preview.ax.imshow(
-                raster_data, 
-                extent=[minx, maxx, miny, maxy],
-                cmap='viridis'
+                np.ma.masked_invalid(raster_data),
+                extent=extent,
+                cmap='viridis',
+                interpolation='nearest'
             )
             
             # 添加颜色条
@@ -888,24 +3862,28 @@ class MainWindow(QMainWindow):
     
     def preview_grid_data(self):
         """预览网格数据"""
-        if self.output_gdf is None:
+        if self.output_grid is None:
             return
             
         self.grid_preview.clear()
         
-        bounds = self.output_gdf.total_bounds
+        bounds = self.output_grid.total_bounds
         
         # 绘制网格数据
         # 选择一个数值字段进行可视化
         value_column = self.selected_field
         if not value_column:
             # 如果没有选择字段，尝试自动选择一个
-            for col in self.output_gdf.columns:
-                if col != 'geometry' and self.output_gdf[col].dtype in [np.int64, np.float64]:
+            for col in self.output_grid.columns:
+                if self.output_grid[col].dtype in [np.int64, np.float64]:
                     value_column = col
                     break
         
-        if value_column and value_column in self.output_gdf.columns:
+        if not (value_column and value_column in self.output_grid.columns):
+            value_column = None
+        
+        cmap = norm = None
+        if value_column:
             # 使用颜色映射
             try:
                 cmap = plt.colormaps['viridis']
@@ -913,37 +3891,24 @@ class MainWindow(QMainWindow):
                 cmap = cm.get_cmap('viridis')
                 
             norm = mcolors.Normalize(
-                vmin=self.output_gdf[value_column].min(),
-                vmax=self.output_gdf[value_column].max()
+                vmin=self.output_grid[value_column].min(),
+                vmax=self.output_grid[value_column].max()
             )
-            
-            for idx, row in self.output_gdf.iterrows():
-                color = cmap(norm(row[value_column]))
-                self.grid_preview.ax.fill(
-                    *row.geometry.exterior.xy, 
-                    facecolor=color, 
-                    edgecolor='black', 
-                    linewidth=0.5,
-                    alpha=0.7
-                )
-            
+        
+        # 规则网格绘制为图像，其余网格绘制为PolyCollection，超过预览上限时抽稀
+        max_cells = self.preview_limit.value()
+        drawn = draw_grid(self.grid_preview.ax, self.output_grid, value_column, cmap, norm, max_cells)
+        if len(self.output_grid) > max_cells:
+            self.log_message(f"网格数 {len(self.output_grid)} 超过预览上限，预览已抽稀为约 {drawn} 个单元")
+        
+        if value_column:
             # 添加颜色条
             sm = cm.ScalarMappable(norm=norm, cmap=cmap)
             sm.set_array([])
             self.grid_preview.fig.colorbar(sm, ax=self.grid_preview.ax, label=value_column)
-        else:
-            # 如果没有数值字段，使用单一颜色
-            for idx, row in self.output_gdf.iterrows():
-                self.grid_preview.ax.fill(
-                    *row.geometry.exterior.xy, 
-                    facecolor='lightblue', 
-                    edgecolor='black', 
-                    linewidth=0.5,
-                    alpha=0.7
-                )
         
         # 添加网格和装饰
-        self.grid_preview.add_grid(bounds, self.output_gdf.crs)
+        self.grid_preview.add_grid(bounds, self.output_grid.crs)
         
         # 添加指北针和比例尺
         self.grid_preview.add_north_arrow(
@@ -986,11 +3951,15 @@ class MainWindow(QMainWindow):
             data_info["宽度"] = f"{bounds[2] - bounds[0]:.2f}"
             data_info["高度"] = f"{bounds[3] - bounds[1]:.2f}"
             
-            # 字段信息
-            for col in gdf.columns:
-                if col != 'geometry':
-                    dtype = gdf[col].dtype
-                    data_info[f"字段 '{col}'"] = f"{dtype}, {gdf[col].notna().sum()} 个有效值"
+            # 字段信息（未读取的字段只显示数据类型）
+            for i in range(self.field_list.count()):
+                col = self.field_list.item(i).data(Qt.UserRole)
+                dtype = self.field_list.item(i).text()[len(col) + 2:-1]
+                if col in self.vector_attributes:
+                    valid = pd.Series(self.vector_attributes[col]).notna().sum()
+                    data_info[f"字段 '{col}'"] = f"{dtype}, {valid} 个有效值"
+                else:
+                    data_info[f"字段 '{col}'"] = dtype
             
         else:  # raster
             raster_data, raster_meta = self.input_data
@@ -1010,11 +3979,15 @@ class MainWindow(QMainWindow):
             data_info["宽度"] = f"{maxx - minx:.2f}"
             data_info["高度"] = f"{maxy - miny:.2f}"
             
-            # 数据统计
-            data_info["最小值"] = f"{np.nanmin(raster_data):.4f}"
-            data_info["最大值"] = f"{np.nanmax(raster_data):.4f}"
-            data_info["平均值"] = f"{np.nanmean(raster_data):.4f}"
-            data_info["标准差"] = f"{np.nanstd(raster_data):.4f}"
+            # 数据统计（流式模式下数据未载入内存，不做全图统计）
+            if raster_data is None:
+                data_info["处理模式"] = f"流式处理（内存上限 {self.memory_limit.value()} MB）"
+            else:
+                raster_data = raster_data[0]  # 统计第一个波段
+                data_info["最小值"] = f"{np.nanmin(raster_data):.4f}"
+                data_info["最大值"] = f"{np.nanmax(raster_data):.4f}"
+                data_info["平均值"] = f"{np.nanmean(raster_data):.4f}"
+                data_info["标准差"] = f"{np.nanstd(raster_data):.4f}"
         
         # 显示对话框
         dialog = DataInfoDialog(data_info, self)
@@ -1025,50 +3998,153 @@ class MainWindow(QMainWindow):
             self.log_message("错误: 没有导入任何数据", error=True)
             return
         
-        # 获取网格大小并转换为米（如果是度或千米）
+        # 获取网格大小（千米转换为米；以度为单位时在地理坐标系中直接按度划分）
         grid_size = self.grid_size.value()
         units = self.grid_units.currentText()
         
         if units == "千米":
             grid_size *= 1000  # 转换为米
-        elif units == "度":
-            # 对于地理坐标系，度转换为米的近似值（在赤道附近）
-            grid_size *= 111320  # 1度约等于111.32公里
         
         stat_method = self.stat_method.currentData()
-        band_index = self.band_combo.currentData() if self.data_type == "raster" else 1
+        band_index = 1
+        if self.data_type == "raster":
+            # 栅格数据：主统计方法加附加统计量，所有勾选波段一次完成
+            try:
+                extra_stats = parse_stat_methods(self.extra_stats.text())
+            except ValueError as e:
+                self.log_message(f"错误: {str(e)}", error=True)
+                return
+            stat_method = [stat_method] + [stat for stat in extra_stats if stat != stat_method]
+            band_index = self.checked_bands() or [1]
         keep_original_attributes = self.keep_attrs_check.isChecked()
         
-        self.log_message(f"开始处理数据，网格大小: {self.grid_size.value()} {units}, 统计方法: {stat_method}")
+        try:
+            pyramid_factors = parse_pyramid_factors(self.pyramid_factors.text())
+        except ValueError as e:
+            self.log_message(f"错误: {str(e)}", error=True)
+            return
+        
+        # 矢量数据只读取勾选的属性字段
+        input_data = self.input_data
+        if self.data_type == "vector":
+            try:
+                input_data = self.vector_with_fields(self.checked_fields())
+            except Exception as e:
+                self.log_message(f"读取属性字段失败: {str(e)}", error=True)
+                return
+        
+        # 分区统计：读取分区多边形，栅格按分区统计而不划分网格
+        zones = None
+        zones_path = self.zones_path.text().strip()
+        if zones_path and self.data_type == "raster":
+            try:
+                zones = read_vector(zones_path).reset_index(drop=True)
+            except Exception as e:
+                self.log_message(f"读取分区文件失败: {str(e)}", error=True)
+                return
+        elif zones_path:
+            self.log_message("分区统计仅对栅格数据有效，矢量数据按网格划分")
+        
+        # 分块写出模式需要先确定输出文件
+        output_path = None
+        output_format = self.output_format.currentData()
+        if self.stream_output_check.isChecked():
+            if output_format not in CHUNK_OUTPUT_FORMATS:
+                self.log_message("错误: 分块写出仅支持GeoParquet和FlatGeobuf格式", error=True)
+                return
+            output_path, _ = QFileDialog.getSaveFileName(
+                self, "保存文件", "", self.output_file_filter(output_format)
+            )
+            if not output_path:
+                return
+        
+        if zones is not None:
+            self.log_message(f"开始分区统计，分区文件: {zones_path}, 统计方法: {stat_method}")
+        else:
+            self.log_message(f"开始处理数据，网格大小: {self.grid_size.value()} {units}, 统计方法: {stat_method}")
         
         # 显示进度条
         self.progress_bar.setVisible(True)
         self.progress_bar.setValue(0)
+        self.rate_label.clear()
         
         # 禁用按钮防止重复操作
         self.import_btn.setEnabled(False)
         self.process_btn.setEnabled(False)
         self.export_btn.setEnabled(False)
         self.plot_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(True)
+        
+        # 行带检查点保存在用户目录下，按输入文件和划分参数区分
+        checkpoint_dir = None
+        if self.checkpoint_check.isChecked():
+            checkpoint_dir = os.path.join(os.path.expanduser("~"), ".gis_grid_checkpoints")
         
         # 创建工作线程
         self.worker = GridWorker(
-            self.input_data, self.data_type, grid_size, units, 
-            stat_method, band_index, keep_original_attributes
+            input_data, self.data_type, grid_size, units, 
+            stat_method, band_index, keep_original_attributes,
+            self.input_path, self.memory_limit.value(), self.n_workers.value(),
+            self.aggregation_mode.currentData() == "weighted",
+            output_path, output_format, self.grid_type.currentData(),
+            self.crs_mode.currentData(), self.custom_crs.text().strip(), self.reprojection_cache,
+            pyramid_factors, ResultCache(max_mb=self.result_cache_limit.value()), zones, checkpoint_dir
         )
         self.worker.progress_updated.connect(self.progress_bar.setValue)
+        self.worker.rate_updated.connect(self.update_rate)
         self.worker.message_emitted.connect(self.log_message)
         self.worker.finished.connect(self.on_processing_finished)
         self.worker.error_occurred.connect(self.on_processing_error)
+        self.worker.cancelled.connect(self.on_processing_cancelled)
         self.worker.start()
     
+    def cancel_processing(self):
+        """请求停止当前处理"""
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.cancel()
+            self.cancel_btn.setEnabled(False)
+            self.log_message("正在停止，当前行带完成后结束...")
+    
+    def on_processing_cancelled(self):
+        self.import_btn.setEnabled(True)
+        self.process_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
+        self.progress_bar.setVisible(False)
+        self.rate_label.clear()
+        
+        if self.checkpoint_check.isChecked():
+            self.log_message("处理已停止，已完成的行带保存在检查点中，再次执行相同的划分时将从中断处继续")
+        else:
+            self.log_message("处理已停止")
+    
+    def update_rate(self, cells_per_second, eta_seconds):
+        """在状态栏显示处理速度和预计剩余时间"""
+        if np.isnan(eta_seconds):
+            self.rate_label.setText(f"{cells_per_second:,.0f} 单元/秒")
+        else:
+            self.rate_label.setText(f"{cells_per_second:,.0f} 单元/秒，预计剩余 {eta_seconds:.0f} 秒")
+    
     def on_processing_finished(self, result_gdf):
-        self.output_gdf = result_gdf
         self.progress_bar.setValue(100)
-        
-        # 启用按钮
         self.import_btn.setEnabled(True)
         self.process_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
+        
+        self.pyramid_grids = None
+        if isinstance(result_gdf, str):
+            # 分块写出模式：结果已直接写入文件，内存中不保留网格
+            self.output_grid = None
+            self.log_message(f"数据处理完成，结果已写出到: {result_gdf}")
+            QMessageBox.information(self, "完成", f"网格划分处理已完成，结果已写出到:\n{result_gdf}")
+            return
+        
+        if isinstance(result_gdf, list):
+            # 金字塔模式：预览和绘图使用最细一级网格，导出时写出全部级别
+            self.pyramid_grids = result_gdf
+            result_gdf = result_gdf[0]
+        self.output_grid = result_gdf
+        
+        # 启用按钮
         self.export_btn.setEnabled(True)
         self.plot_btn.setEnabled(True)
         
@@ -1087,38 +4163,46 @@ class MainWindow(QMainWindow):
         # 启用按钮
         self.import_btn.setEnabled(True)
         self.process_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
         
         self.progress_bar.setVisible(False)
         QMessageBox.critical(self, "错误", f"处理过程中发生错误:\n{error_msg}")
     
+    def output_file_filter(self, output_format):
+        """返回输出格式对应的文件过滤器"""
+        if output_format == "shp":
+            return "ESRI Shapefile (*.shp)"
+        elif output_format == "geojson":
+            return "GeoJSON (*.geojson)"
+        elif output_format == "kml":
+            return "KML (*.kml)"
+        elif output_format == "parquet":
+            return "GeoParquet (*.parquet)"
+        elif output_format == "fgb":
+            return "FlatGeobuf (*.fgb)"
+    
     def export_data(self):
-        if self.output_gdf is None:
+        if self.output_grid is None:
             self.log_message("错误: 没有可导出的数据", error=True)
             return
         
         output_format = self.output_format.currentData()
         
-        if output_format == "shp":
-            file_filter = "ESRI Shapefile (*.shp)"
-        elif output_format == "geojson":
-            file_filter = "GeoJSON (*.geojson)"
-        elif output_format == "kml":
-            file_filter = "KML (*.kml)"
-        
         file_path, _ = QFileDialog.getSaveFileName(
-            self, "保存文件", "", file_filter
+            self, "保存文件", "", self.output_file_filter(output_format)
         )
         
         if file_path:
             try:
-                self.log_message(f"正在导出文件: {file_path}")
+                # 金字塔模式下每级网格写出到文件名附加网格大小的单独文件
+                if self.pyramid_grids:
+                    outputs = [(pyramid_level_path(file_path, grid.grid_size), grid) for grid in self.pyramid_grids]
+                else:
+                    outputs = [(file_path, self.output_grid)]
                 
-                if output_format == "shp":
-                    self.output_gdf.to_file(file_path)
-                elif output_format == "geojson":
-                    self.output_gdf.to_file(file_path, driver='GeoJSON')
-                elif output_format == "kml":
-                    self.output_gdf.to_file(file_path, driver='KML')
+                for path, grid in outputs:
+                    self.log_message(f"正在导出文件: {path}")
+                    write_grid(grid, path, output_format)
                 
                 self.log_message("文件导出成功")
                 QMessageBox.information(self, "成功", "文件导出成功")
@@ -1129,14 +4213,14 @@ class MainWindow(QMainWindow):
     
     def generate_plot(self):
         """生成专题图"""
-        if self.output_gdf is None:
+        if self.output_grid is None:
             self.log_message("错误: 没有可绘制的数据", error=True)
             return
         
         # 获取可用的数值字段
         numeric_fields = []
-        for col in self.output_gdf.columns:
-            if col != 'geometry' and self.output_gdf[col].dtype in [np.int64, np.float64]:
+        for col in self.output_grid.columns:
+            if self.output_grid[col].dtype in [np.int64, np.float64]:
                 numeric_fields.append(col)
         
         if not numeric_fields:
@@ -1163,7 +4247,7 @@ class MainWindow(QMainWindow):
             fig, ax = plt.subplots(figsize=(10, 8))
             
             # 使用选择的字段进行可视化
-            if self.selected_field and self.selected_field in self.output_gdf.columns:
+            if self.selected_field and self.selected_field in self.output_grid.columns:
                 # 使用颜色映射
                 try:
                     cmap = plt.colormaps['viridis']
@@ -1171,19 +4255,12 @@ class MainWindow(QMainWindow):
                     cmap = cm.get_cmap('viridis')
                     
                 norm = mcolors.Normalize(
-                    vmin=self.output_gdf[self.selected_field].min(),
-                    vmax=self.output_gdf[self.selected_field].max()
+                    vmin=self.output_grid[self.selected_field].min(),
+                    vmax=self.output_grid[self.selected_field].max()
                 )
                 
-                for idx, row in self.output_gdf.iterrows():
-                    color = cmap(norm(row[self.selected_field]))
-                    ax.fill(
-                        *row.geometry.exterior.xy, 
-                        facecolor=color, 
-                        edgecolor='black', 
-                        linewidth=0.5,
-                        alpha=0.7
-                    )
+                # 完整绘制全部网格（不抽稀）
+                draw_grid(ax, self.output_grid, self.selected_field, cmap, norm)
                 
                 # 添加颜色条
                 sm = cm.ScalarMappable(norm=norm, cmap=cmap)
@@ -1192,18 +4269,11 @@ class MainWindow(QMainWindow):
                 cbar.set_label(self.selected_field)
             else:
                 # 如果没有选择字段，使用单一颜色
-                for idx, row in self.output_gdf.iterrows():
-                    ax.fill(
-                        *row.geometry.exterior.xy, 
-                        facecolor='lightblue', 
-                        edgecolor='black', 
-                        linewidth=0.5,
-                        alpha=0.7
-                    )
+                draw_grid(ax, self.output_grid)
             
             # 获取边界并添加网格
-            bounds = self.output_gdf.total_bounds
-            self.add_grid(bounds, self.output_gdf.crs, ax)
+            bounds = self.output_grid.total_bounds
+            self.add_grid(bounds, self.output_grid.crs, ax)
             
             # 添加指北针和比例尺
             self.add_north_arrow(
@@ -1225,7 +4295,7 @@ class MainWindow(QMainWindow):
             
             # 设置标题和标签
             ax.set_title("网格数据专题图")
-            if self.output_gdf.crs and self.output_gdf.crs.is_geographic:
+            if self.output_grid.crs and self.output_grid.crs.is_geographic:
                 ax.set_xlabel("经度")
                 ax.set_ylabel("纬度")
             else: